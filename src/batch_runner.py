@@ -0,0 +1,214 @@
+"""
+Runs a file of questions through the agent graph concurrently.
+
+Usage:
+    python batch_runner.py questions.txt results.jsonl --concurrency 8
+
+Questions are read one per line from a .txt file, or from a .jsonl file with a
+"question" key per line. Every result is appended to the results file as soon
+as its question completes, so re-running the same command after a crash only
+runs the questions that have no successful result yet.
+
+Gemini requests are rate limited by the token bucket attached to the Vertex AI
+clients (VERTEX_REQUESTS_PER_MINUTE / VERTEX_MAX_BURST), questions that still
+hit the quota are retried with exponential backoff.
+
+Each result records its answer path ("fast_path:<template>", "cache" or "llm")
+and the number of query_gen turns it took. The summary printed at the end gives
+the share, mean latency and mean turns of each path, the time saved by the fast
+path, the fast path matcher's hit rates and the size of the few-shot index.
+"""
+# python native packages
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+# third party packages
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+# custom packages
+from tracing import configure_tracing, tracer
+
+
+def read_questions(file_path: str) -> List[str]:
+    with open(file_path, "r", encoding="utf-8") as file:
+        if file_path.endswith(".jsonl"):
+            return [json.loads(line)["question"] for line in file if line.strip()]
+        return [line.strip() for line in file if line.strip()]
+
+
+def read_completed(file_path: str) -> set:
+    """Questions that already have a successful result in the results file."""
+    completed = set()
+    if not os.path.exists(file_path):
+        return completed
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written last line of a crashed run
+                continue
+            if result.get("error") is None:
+                completed.add(result["question"])
+    return completed
+
+
+def is_quota_error(error: BaseException) -> bool:
+    # google.api_core.exceptions.ResourceExhausted / TooManyRequests, or an HTTP error with status 429.
+    # Never the message text, SQL errors may quote a 429 value, row count or id
+    if type(error).__name__ in {"ResourceExhausted", "TooManyRequests"}:
+        return True
+    return 429 in (getattr(error, "code", None), getattr(error, "status_code", None))
+
+
+class ResultWriter:
+    """Appends one JSON line per result and fsyncs it, so finished work survives a crash."""
+
+    def __init__(self, file_path: str):
+        self._file = open(file_path, "a", encoding="utf-8")
+
+    def write(self, result: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(result, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def answer_path(state) -> str:
+    """How the question was answered: from the previous result, a SQL template, the SQL cache or the LLM."""
+    if state.get("follow_up_kind"):
+        return f"follow_up:{state['follow_up_kind']}"
+    if state.get("fast_path_match"):
+        return f"fast_path:{state['fast_path_match']['template']}"
+    if state.get("cached_sql"):
+        return "cache"
+    return "llm"
+
+
+def path_report(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Share of the questions, mean latency and mean query_gen turns per answer path,
+    and the time the fast path saved compared to the mean latency of LLM answers.
+    """
+    latencies: Dict[str, List[float]] = {}
+    iterations: Dict[str, List[int]] = {}
+    for result in results:
+        if result["error"] is None:
+            path = result["path"].split(":")[0]
+            latencies.setdefault(path, []).append(result["elapsed_seconds"])
+            iterations.setdefault(path, []).append(result.get("iterations") or 0)
+    answered = sum(len(values) for values in latencies.values())
+    report = {
+        path: {
+            "questions": len(values),
+            "share": round(len(values) / answered, 3),
+            "mean_seconds": round(sum(values) / len(values), 3),
+            "mean_iterations": round(sum(iterations[path]) / len(values), 3),
+        }
+        for path, values in sorted(latencies.items())
+    }
+    if "fast_path" in report and "llm" in report:
+        saved = (report["llm"]["mean_seconds"] - report["fast_path"]["mean_seconds"]) * report["fast_path"]["questions"]
+        report["fast_path"]["saved_seconds"] = round(saved, 3)
+    return report
+
+
+async def answer_question(graph, question: str, max_attempts: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    attempts = 0
+    result = {"question": question, "answer": None, "sql": None, "exports": [], "path": None, "error": None}
+    try:
+        # One trace per question, retried attempts included
+        with tracer.span("question") as span:
+            async for attempt in AsyncRetrying(
+                retry=retry_if_exception(is_quota_error),
+                wait=wait_exponential_jitter(initial=2, max=60),
+                stop=stop_after_attempt(max_attempts),
+                reraise=True,
+            ):
+                with attempt:
+                    attempts += 1
+                    span.set(retries=attempts - 1)
+                    state = await graph.ainvoke({"messages": [{"role": "user", "content": question}]})
+        result["answer"] = state["messages"][-1].content
+        result["sql"] = state.get("generated_query")
+        result["exports"] = state.get("exports", [])
+        result["path"] = answer_path(state)
+        result["iterations"] = state.get("query_gen_turns")
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["attempts"] = attempts
+    result["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    result["completed_at"] = datetime.now().isoformat(timespec="seconds")
+    return result
+
+
+async def run_batch(
+    graph,
+    questions: List[str],
+    results_path: str,
+    concurrency: int = 4,
+    max_attempts: int = 5,
+) -> Dict[str, int]:
+    completed = read_completed(results_path)
+    pending = [question for question in dict.fromkeys(questions) if question not in completed]
+    semaphore = asyncio.Semaphore(concurrency)
+    writer = ResultWriter(results_path)
+    results = []
+
+    async def run_one(question: str) -> None:
+        async with semaphore:
+            result = await answer_question(graph, question, max_attempts)
+        results.append(result)
+        writer.write(result)
+        status = "FAILED" if result["error"] else result["path"]
+        print(f"[{result['elapsed_seconds']:>7.1f}s] {status:24} {question[:80]}")
+
+    try:
+        await asyncio.gather(*(run_one(question) for question in pending))
+    finally:
+        writer.close()
+
+    failed = sum(result["error"] is not None for result in results)
+    return {"skipped": len(questions) - len(pending), "run": len(pending), "failed": failed, "paths": path_report(results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of questions through the Text2SQL agent.")
+    parser.add_argument("questions", help="Questions file (.txt, one per line, or .jsonl with a 'question' key)")
+    parser.add_argument("results", help="Results file (.jsonl), appended to as questions complete")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", 4)))
+    parser.add_argument("--max-attempts", type=int, default=5, help="Attempts per question on quota errors")
+    args = parser.parse_args()
+
+    from settings import load_settings
+    from text2SQL_demo_code import build_graph
+
+    # Batch questions are independent, no session state to keep
+    settings = load_settings(checkpointer="none")
+    configure_tracing(settings)
+    graph = build_graph(settings)
+    summary = asyncio.run(
+        run_batch(graph, read_questions(args.questions), args.results, args.concurrency, args.max_attempts)
+    )
+    if "fast_path" in graph.resources.__dict__:
+        summary["fast_path_matcher"] = graph.resources.fast_path.stats()
+    if "few_shot_index" in graph.resources.__dict__:
+        summary["few_shot_index"] = graph.resources.few_shot_index.stats()
+    if graph.resources.__dict__.get("sql_validator") is not None:
+        summary["sql_validator"] = graph.resources.sql_validator.stats()
+    if "db" in graph.resources.__dict__ and graph.resources.db.result_cache is not None:
+        summary["result_cache"] = graph.resources.db.result_cache.stats()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
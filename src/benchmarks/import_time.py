@@ -0,0 +1,59 @@
+"""
+Cold import benchmark for the agent modules.
+
+Usage:
+    python benchmarks/import_time.py [--budget 2.0] [--repeat 3]
+
+Each module is imported in a fresh interpreter and the best wall time of
+`--repeat` runs is compared to the budget. The script exits with status 1 if
+any module goes over it, so it can gate CI or a worker image build.
+"""
+# python native packages
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "text2SQL_demo_code",
+    "trend_analysis",
+    "batch_runner",
+]
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def cold_import_seconds(module: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        cwd=SRC_FOLDER,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a cold import of the agent goes over budget.")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET_SECONDS", 2.0)))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    over_budget = []
+    for module in MODULES:
+        seconds = min(cold_import_seconds(module) for _ in range(args.repeat))
+        status = "OK" if seconds <= args.budget else "OVER BUDGET"
+        print(f"{module:<25} {seconds:6.3f}s  {status}")
+        if seconds > args.budget:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"Cold import over the {args.budget}s budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
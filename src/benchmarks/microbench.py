@@ -0,0 +1,226 @@
+"""
+Per-component microbenchmarks on synthetic review data.
+
+Usage:
+    python benchmarks/microbench.py --rows 1000 100000 --output bench.json
+    python benchmarks/microbench.py --rows 10000000 --db-url postgresql+psycopg2://...
+
+For each size the reviews are generated once (a local SQLite file per size in
+--data-dir, or the table in --db-url) and every component is timed `--repeat`
+times. The DataFrame and prompt benchmarks work on in-memory data, so they are
+capped at --max-frame-rows and --max-prompt-rows; the rows each benchmark
+actually used are reported next to its timings. The trend plot uses a fake
+LLM in place of the OpenAI column classifier.
+
+The results are written as one JSON document, so runs can be compared over time.
+"""
+# python native packages
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_FOLDER)
+
+DEFAULT_ROWS = [1_000, 10_000, 100_000]
+DEFAULT_MAX_FRAME_ROWS = 100_000
+DEFAULT_MAX_PROMPT_ROWS = 1_000
+
+AGGREGATE_SQL = (
+    "SELECT account_name, COUNT(*) AS review_count FROM qualtrics_enriched_data "
+    "WHERE product = 'Rancher Prime' GROUP BY account_name ORDER BY review_count DESC LIMIT 10"
+)
+SCAN_SQL = "SELECT account_name, product, date, topic_1, topic_1_sentiment FROM qualtrics_enriched_data"
+QUESTION = "What are the main complaints about Rancher Prime in EMEA?"
+FILTERS = "Product Family: Rancher Prime, Geo: EMEA"
+
+
+def time_calls(function: Callable[[], Any], repeat: int, setup: Callable[[], Any] = None) -> Dict[str, float]:
+    """Best, median and mean wall time in ms of `repeat` calls. `setup` runs untimed before each call."""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "best_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+def fake_gemini_response(df) -> str:
+    """A fenced RCA answer in the shape prompt_template_05 asks for, built from the topics in the data."""
+    topics = [
+        {
+            "topic": topic,
+            "takeaways": [f"{count} mentions of {topic.lower()}"],
+            "examples": list(df.loc[df["Topic"] == topic, "summary"].head(3)),
+        }
+        for topic, count in df["Topic"].value_counts().items()
+    ]
+    answer = {
+        "validation": {"is_rejected": False, "message": ""},
+        "topics": topics,
+        "overall_strengths_and_weaknesses": {"overall_strengths": ["Support"], "overall_weaknesses": ["Pricing"]},
+    }
+    return "```json\n" + json.dumps(answer, indent=2) + "\n```"
+
+
+def fake_eval_model():
+    """Stands in for the OpenAI classifier: a column is time related if it is named like one."""
+    from langchain_core.runnables import RunnableLambda
+    from trend_analysis import Eval_Query_Result
+
+    def classify(inputs):
+        first, second = list(inputs["data"][0])[:2]
+        return Eval_Query_Result(
+            first_column_is_time_related=first in {"date", "day", "month", "year"},
+            second_column_is_time_related=second in {"date", "day", "month", "year"},
+            first_column_title=first,
+            second_column_title=second,
+        )
+
+    return RunnableLambda(classify)
+
+
+def run_size(n_rows: int, args, results: List[Dict[str, Any]]) -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from sqlalchemy import create_engine
+
+    import trend_analysis
+    from benchmarks.synthetic_data import ensure_reviews, reviews_frame, sqlite_reviews_url
+    from exporter import iter_batches, write_csv_gz
+    from models import CustomSQLDatabase
+    from test_gemini_rca import build_prompt, explode_topic_triplets, parse_gemini_response_to_json, preprocess_df
+    from VoC_RCA_Prompt_iterations import prompt_template_05
+
+    def record(benchmark: str, input_rows: int, timings: Dict[str, float]) -> None:
+        result = {"benchmark": benchmark, "rows": n_rows, "input_rows": input_rows, "repeat": args.repeat, **timings}
+        results.append(result)
+        print(f"{benchmark:<32} rows={n_rows:<10} input={input_rows:<10} median={timings['median_ms']:.3f} ms")
+
+    if args.db_url:
+        engine = create_engine(args.db_url)
+        ensure_reviews(engine, n_rows, args.seed)
+        engine.dispose()
+        db_url = args.db_url
+    else:
+        db_url = sqlite_reviews_url(n_rows, args.data_dir, args.seed)
+    db = CustomSQLDatabase.from_uri(db_url, include_tables=["qualtrics_enriched_data"])
+
+    record("db_run_aggregate", n_rows, time_calls(lambda: db.run(AGGREGATE_SQL, fetch="all"), args.repeat))
+    record(
+        "db_run_stream_scan",
+        n_rows,
+        time_calls(lambda: sum(len(chunk) for chunk in db.run(SCAN_SQL, fetch="stream")), args.repeat),
+    )
+
+    frame_rows = min(n_rows, args.max_frame_rows)
+    raw_df = reviews_frame(frame_rows, args.seed)
+    rows = raw_df.reset_index().to_dict("records")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "export.csv.gz")
+        record(
+            "write_csv_gz",
+            frame_rows,
+            time_calls(lambda: write_csv_gz(iter_batches(rows), csv_path), args.repeat),
+        )
+
+    record("explode_topic_triplets", frame_rows, time_calls(lambda: explode_topic_triplets(raw_df), args.repeat))
+    record("preprocess_df", frame_rows, time_calls(lambda: preprocess_df(raw_df.copy()), args.repeat))
+
+    prompt_df = preprocess_df(raw_df.head(args.max_prompt_rows).copy())
+    record(
+        "build_prompt",
+        len(prompt_df),
+        time_calls(
+            lambda: build_prompt(prompt_template_05, prompt_df, FILTERS, QUESTION, data_format="markdown"),
+            args.repeat,
+        ),
+    )
+    response = fake_gemini_response(prompt_df)
+    record(
+        "parse_gemini_response_to_json",
+        len(prompt_df),
+        time_calls(lambda: parse_gemini_response_to_json(response), args.repeat),
+    )
+
+    # Reviews per day and per month, as the agent would get them back from SQL
+    dates = raw_df["date"].str.slice(6, 10) + "-" + raw_df["date"].str.slice(3, 5)
+    monthly = [{"month": month, "review_count": count} for month, count in sorted(Counter(dates).items())]
+    daily_counts = list(raw_df["date"].value_counts(sort=False))
+    record(
+        "curve_finder",
+        len(daily_counts),
+        time_calls(lambda: trend_analysis.curve_finder(list(range(len(daily_counts))), daily_counts), args.repeat),
+    )
+
+    trend_analysis.get_eval_model = fake_eval_model
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # trend_analysis_plot writes its png to the working directory
+        os.chdir(tmp_dir)
+        try:
+            record("trend_analysis_plot", len(monthly), time_calls(lambda: trend_analysis.trend_analysis_plot(monthly), args.repeat))
+        finally:
+            os.chdir(working_dir)
+    db._engine.dispose()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SRC_FOLDER, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the agent's components on synthetic review data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="Table sizes, e.g. 1000 10000000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db-url", default=None, help="Database to load the reviews into, a local SQLite file by default")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "text2sql_benchmarks"))
+    parser.add_argument("--max-frame-rows", type=int, default=DEFAULT_MAX_FRAME_ROWS)
+    parser.add_argument("--max-prompt-rows", type=int, default=DEFAULT_MAX_PROMPT_ROWS)
+    parser.add_argument("--output", default=None, help="JSON results file, printed to stdout if omitted")
+    args = parser.parse_args()
+
+    results = []
+    for n_rows in args.rows:
+        run_size(n_rows, args, results)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": (args.db_url or "sqlite").split(":", 1)[0],
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
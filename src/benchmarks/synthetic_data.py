@@ -0,0 +1,147 @@
+"""
+Synthetic reviews in the shape of `qualtrics_enriched_data`.
+
+Rows are generated deterministically from a seed, in insertion (date) order,
+with a skewed account distribution and up to three topic triplets
+(`topic_i`, `topic_i_sentiment`, `topic_i_parent_topic`) per review.
+"""
+# python native packages
+import os
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List
+
+# third party packages
+from sqlalchemy import Column, Date, Integer, MetaData, String, Table, Text, create_engine, func, inspect, select
+from sqlalchemy.engine import Engine
+
+TABLE_NAME = "qualtrics_enriched_data"
+N_TOPICS = 3
+DEFAULT_CHUNK_SIZE = 50_000
+
+N_ACCOUNTS = 500
+PRODUCTS = {
+    "SUSE Linux Enterprise Server": "Business Critical Linux",
+    "SLES for SAP Applications": "Business Critical Linux",
+    "SUSE Manager": "Business Critical Linux",
+    "Rancher Prime": "Enterprise Container Management",
+    "NeuVector": "Enterprise Container Management",
+    "SUSE Edge": "Edge",
+}
+SOURCES = ["Qualtrics", "G2", "Support Case", "NPS Survey"]
+GEOS = ["EMEA", "NA", "APAC", "LATAM"]
+SENTIMENTS = ["Very negative", "Negative", "Mixed", "Positive", "Very positive"]
+TOPICS = {
+    "Documentation quality": "Documentation",
+    "Installation": "Product",
+    "Upgrade process": "Product",
+    "Performance": "Product",
+    "Support response time": "Support",
+    "Support expertise": "Support",
+    "Pricing": "Commercial",
+    "Licensing": "Commercial",
+    "General feedback": "Other",
+}
+WORDS = [
+    "the", "upgrade", "support", "was", "slow", "documentation", "clear", "cluster", "license",
+    "great", "issue", "resolved", "team", "patch", "kernel", "helpful", "price", "missing", "easy",
+]
+START_DATE = date(2022, 1, 1)
+DAYS = 3 * 365
+
+
+def _columns() -> List[Column]:
+    columns = [
+        Column("id", Integer, primary_key=True),
+        Column("account_number", String(16)),
+        Column("account_name", String(64)),
+        Column("overall_sentiment", String(16)),
+        Column("product", String(64)),
+        Column("business_unit", String(64)),
+        Column("source", String(32)),
+        Column("geo", String(8)),
+        Column("date", Date),
+        Column("summary", Text),
+    ]
+    for i in range(1, N_TOPICS + 1):
+        columns += [
+            Column(f"topic_{i}", String(64)),
+            Column(f"topic_{i}_sentiment", String(16)),
+            Column(f"topic_{i}_parent_topic", String(32)),
+        ]
+    return columns
+
+
+def generate_reviews(n_rows: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+    # Zipf-like: a few accounts write most of the reviews
+    account_weights = [1 / rank for rank in range(1, N_ACCOUNTS + 1)]
+    products = list(PRODUCTS)
+    topics = list(TOPICS)
+
+    for row_id in range(1, n_rows + 1):
+        account = rng.choices(range(N_ACCOUNTS), weights=account_weights)[0]
+        product = rng.choice(products)
+        review = {
+            "id": row_id,
+            "account_number": f"A{account:05d}",
+            "account_name": f"Account {account:03d}",
+            "overall_sentiment": rng.choice(SENTIMENTS),
+            "product": product,
+            "business_unit": PRODUCTS[product],
+            "source": rng.choice(SOURCES),
+            "geo": rng.choice(GEOS),
+            # Dates grow with the row id, like an append-only table
+            "date": START_DATE + timedelta(days=min(DAYS - 1, row_id * DAYS // n_rows + rng.randint(0, 2))),
+            "summary": " ".join(rng.choices(WORDS, k=rng.randint(8, 30))),
+        }
+        n_mentioned = rng.choices([1, 2, 3], weights=[0.4, 0.4, 0.2])[0]
+        for i, topic in enumerate(rng.sample(topics, N_TOPICS), start=1):
+            mentioned = i <= n_mentioned
+            review[f"topic_{i}"] = topic if mentioned else None
+            review[f"topic_{i}_sentiment"] = rng.choice(SENTIMENTS) if mentioned else None
+            review[f"topic_{i}_parent_topic"] = TOPICS[topic] if mentioned else None
+        yield review
+
+
+def reviews_frame(n_rows: int, seed: int = 0):
+    """The reviews as a DataFrame, with the date as a day-first string like the exported data.csv."""
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(generate_reviews(n_rows, seed), index="id")
+    df["date"] = pd.to_datetime(df["date"]).dt.strftime("%d/%m/%Y")
+    return df
+
+
+def ensure_reviews(engine: Engine, n_rows: int, seed: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """(Re)creates the reviews table unless it already holds `n_rows` rows."""
+    metadata = MetaData()
+    table = Table(TABLE_NAME, metadata, *_columns())
+    if inspect(engine).has_table(TABLE_NAME):
+        with engine.connect() as connection:
+            if connection.execute(select(func.count()).select_from(table)).scalar() == n_rows:
+                return
+        table.drop(engine)
+    metadata.create_all(engine)
+
+    chunk = []
+    with engine.begin() as connection:
+        for review in generate_reviews(n_rows, seed):
+            chunk.append(review)
+            if len(chunk) >= chunk_size:
+                connection.execute(table.insert(), chunk)
+                chunk = []
+        if chunk:
+            connection.execute(table.insert(), chunk)
+
+
+def sqlite_reviews_url(n_rows: int, data_dir: str, seed: int = 0) -> str:
+    """URL of a local SQLite file holding `n_rows` reviews, generated once per size and seed."""
+    os.makedirs(data_dir, exist_ok=True)
+    url = f"sqlite:///{os.path.join(data_dir, f'reviews_{n_rows}_{seed}.sqlite')}"
+    engine = create_engine(url)
+    try:
+        ensure_reviews(engine, n_rows, seed)
+    finally:
+        engine.dispose()
+    return url
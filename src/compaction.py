@@ -0,0 +1,85 @@
+# python native packages
+import json
+from typing import Any, Dict, List, Tuple
+
+# third party packages
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+# custom packages
+from utils import count_tokens
+
+DEFAULT_HISTORY_TOKEN_BUDGET = 8000
+SUMMARY_CHARS = 200
+
+
+def message_tokens(message: BaseMessage) -> int:
+    tokens = count_tokens(message.content if isinstance(message.content, str) else json.dumps(message.content))
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(json.dumps(tool_call.get("args", {})))
+    return tokens
+
+
+def _shorten(text: str, label: str) -> str:
+    first_line = text.strip().splitlines()[0] if text.strip() else ""
+    if len(first_line) > SUMMARY_CHARS:
+        first_line = first_line[:SUMMARY_CHARS] + "..."
+    return f"[{label}: {first_line}]"
+
+
+def _is_error(message: ToolMessage) -> bool:
+    return isinstance(message.content, str) and message.content.startswith("Error")
+
+
+def compact_messages(
+    messages: List[BaseMessage], token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET
+) -> Tuple[List[BaseMessage], Dict[str, Any]]:
+    """
+    Returns a compacted copy of the history to send to the model, and the
+    token counts before and after. The state itself is left untouched.
+
+    - tool results of earlier questions are replaced by a one line summary
+    - schema dumps of the current question are dropped once a later one exists
+    - failed query bodies are dropped once a later query was run
+    - if still over `token_budget`, the oldest remaining tool results are shortened
+
+    Tool messages are shortened but never removed, so every tool call keeps its answer.
+    The results of the model's last turn, which it has not read yet, are never shortened.
+    """
+    before = sum(message_tokens(message) for message in messages)
+
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    # The turn's tool calls may run concurrently, so it can end in several tool results
+    last_ai = max((i for i, m in enumerate(messages) if isinstance(m, AIMessage)), default=-1)
+    tool_indices = [i for i, m in enumerate(messages) if isinstance(m, ToolMessage) and i < last_ai]
+    last_schema = max((i for i in tool_indices if messages[i].name == "sql_db_schema"), default=-1)
+    last_query = max((i for i in tool_indices if messages[i].name == "sql_db_query"), default=-1)
+
+    compacted = list(messages)
+    for i in tool_indices:
+        message = messages[i]
+        if not isinstance(message.content, str):
+            continue
+        if i < last_human:
+            content = _shorten(message.content, f"{message.name} result of an earlier question, compacted")
+        elif message.name == "sql_db_schema" and i < last_schema:
+            content = "[Schema dump superseded by a later sql_db_schema call]"
+        elif message.name == "sql_db_query" and i < last_query and _is_error(message):
+            content = _shorten(message.content, "Failed query, superseded by a later query")
+        else:
+            continue
+        compacted[i] = message.model_copy(update={"content": content})
+
+    after = sum(message_tokens(message) for message in compacted)
+    for i in tool_indices:
+        if after <= token_budget:
+            break
+        content = compacted[i].content
+        if not isinstance(content, str) or content.startswith("["):
+            continue
+        tokens = message_tokens(compacted[i])
+        compacted[i] = compacted[i].model_copy(
+            update={"content": _shorten(compacted[i].content, f"{compacted[i].name} result, compacted")}
+        )
+        after += message_tokens(compacted[i]) - tokens
+
+    return compacted, {"before": before, "after": after}
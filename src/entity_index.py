@@ -0,0 +1,222 @@
+"""
+In-memory index of the distinct values of the reviews' categorical columns.
+
+    index = EntityValueIndex(db)
+    index.resolve(["Viseca", "SUSE Multi-Linux Manager", "EMEA"])
+
+Loose mentions are matched against the values by, in order of confidence:
+exact normalized match, initials ("BCL" -> "Business Critical Linux"), prefix
+of any word sequence of the value (a trie over the value's word suffixes) and
+trigram similarity, which tolerates typos and missing words. The values are
+re-read every `refresh_seconds` and only the changed ones are re-indexed.
+"""
+# python native packages
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# custom packages
+from models import CustomSQLDatabase
+
+DEFAULT_TABLE = "qualtrics_enriched_data"
+ENTITY_COLUMNS = ["account_name", "product", "business_unit", "source", "geo"]
+DEFAULT_REFRESH_SECONDS = 3600
+DEFAULT_MIN_SCORE = 0.35
+DEFAULT_LIMIT = 3
+
+# Key of an indexed value: (column, normalized value)
+EntityKey = Tuple[str, str]
+
+
+def normalize_name(value: str) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", str(value).casefold()).split())
+
+
+def initials(normalized: str) -> str:
+    return "".join(word[0] for word in normalized.split())
+
+
+def trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PrefixTrie:
+    """Character trie mapping every prefix of the inserted strings to their keys."""
+
+    def __init__(self):
+        self._root: Dict[str, Any] = {}
+
+    def insert(self, text: str, key: EntityKey) -> None:
+        node = self._root
+        for char in text:
+            node = node.setdefault(char, {})
+            node.setdefault("", set()).add(key)
+
+    def remove(self, text: str, key: EntityKey) -> None:
+        node = self._root
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                return
+            node.get("", set()).discard(key)
+
+    def find(self, prefix: str) -> Set[EntityKey]:
+        node = self._root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get("", set())
+
+
+class EntityValueIndex:
+    """
+    Distinct values of `columns` with their review counts, indexed by trigrams,
+    word-suffix prefixes and initials.
+    """
+
+    def __init__(
+        self,
+        db: CustomSQLDatabase,
+        table: str = DEFAULT_TABLE,
+        columns: Optional[List[str]] = None,
+        refresh_seconds: float = DEFAULT_REFRESH_SECONDS,
+        min_score: float = DEFAULT_MIN_SCORE,
+    ):
+        self.db = db
+        self.table = table
+        self.columns = columns or list(ENTITY_COLUMNS)
+        self.refresh_seconds = refresh_seconds
+        self.min_score = min_score
+        self._lock = threading.RLock()
+        # (column, normalized) -> {"values": [...], "reviews": n}
+        self._entries: Dict[EntityKey, Dict[str, Any]] = {}
+        self._by_column: Dict[str, Dict[str, Dict[str, Any]]] = {column: {} for column in self.columns}
+        self._trigrams: Dict[str, Set[EntityKey]] = {}
+        self._trigram_counts: Dict[EntityKey, int] = {}
+        self._initials: Dict[str, Set[EntityKey]] = {}
+        self._trie = PrefixTrie()
+        self._refreshed_at: Optional[float] = None
+
+    def _read_values(self) -> Dict[EntityKey, Dict[str, Any]]:
+        quote = self.db._engine.dialect.identifier_preparer.quote
+        entries: Dict[EntityKey, Dict[str, Any]] = {}
+        for column in self.columns:
+            rows = self.db.run(
+                f"SELECT {quote(column)}, COUNT(*) FROM {quote(self.table)} "
+                f"WHERE {quote(column)} IS NOT NULL GROUP BY {quote(column)}"
+            )
+            for value, reviews in rows:
+                normalized = normalize_name(value)
+                if not normalized:
+                    continue
+                entry = entries.setdefault((column, normalized), {"values": [], "reviews": 0})
+                entry["values"].append(value)
+                entry["reviews"] += reviews
+        return entries
+
+    def _add(self, key: EntityKey, entry: Dict[str, Any]) -> None:
+        column, normalized = key
+        self._entries[key] = entry
+        self._by_column[column][normalized] = entry
+        value_trigrams = trigrams(normalized)
+        self._trigram_counts[key] = len(value_trigrams)
+        for trigram in value_trigrams:
+            self._trigrams.setdefault(trigram, set()).add(key)
+        self._initials.setdefault(initials(normalized), set()).add(key)
+        words = normalized.split()
+        for i in range(len(words)):
+            self._trie.insert(" ".join(words[i:]), key)
+
+    def _remove(self, key: EntityKey) -> None:
+        column, normalized = key
+        del self._entries[key]
+        del self._by_column[column][normalized]
+        del self._trigram_counts[key]
+        for trigram in trigrams(normalized):
+            self._trigrams.get(trigram, set()).discard(key)
+        self._initials.get(initials(normalized), set()).discard(key)
+        words = normalized.split()
+        for i in range(len(words)):
+            self._trie.remove(" ".join(words[i:]), key)
+
+    def refresh(self) -> Dict[str, int]:
+        """Re-reads the values and re-indexes only the added and removed ones."""
+        entries = self._read_values()
+        with self._lock:
+            removed = [key for key in self._entries if key not in entries]
+            added = [key for key in entries if key not in self._entries]
+            for key in removed:
+                self._remove(key)
+            for key in added:
+                self._add(key, entries[key])
+            # Counts and spellings of the unchanged values
+            for key, entry in entries.items():
+                self._entries[key] = self._by_column[key[0]][key[1]] = entry
+            self._refreshed_at = time.monotonic()
+        return {"added": len(added), "removed": len(removed), "values": len(entries)}
+
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            stale = self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.refresh_seconds
+        if not stale:
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            # Keep answering from the previous values, retry after another period
+            print(f"Exception: {e}")
+            with self._lock:
+                if self._refreshed_at is None and not self._entries:
+                    raise
+                self._refreshed_at = time.monotonic()
+
+    def values(self, column: str) -> Dict[str, List[str]]:
+        """Normalized name -> values of the column."""
+        self._ensure_fresh()
+        with self._lock:
+            return {normalized: entry["values"] for normalized, entry in self._by_column.get(column, {}).items()}
+
+    def match(self, mention: str, columns: Optional[List[str]] = None, limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+        """The best matching values of a mention, highest score first."""
+        self._ensure_fresh()
+        normalized = normalize_name(mention)
+        if not normalized:
+            return []
+        mention_trigrams = trigrams(normalized)
+        with self._lock:
+            # Trigram similarity (Dice coefficient) from the posting lists, without rescanning the values
+            shared: Counter = Counter()
+            for trigram in mention_trigrams:
+                shared.update(self._trigrams.get(trigram, ()))
+            scores = {
+                key: 2 * count / (len(mention_trigrams) + self._trigram_counts[key]) for key, count in shared.items()
+            }
+            # Prefix of the value or of one of its word suffixes, exact when the whole value
+            for key in self._trie.find(normalized):
+                score = 1.0 if key[1] == normalized else 0.7 + 0.25 * len(normalized) / len(key[1])
+                scores[key] = max(scores.get(key, 0.0), score)
+            if " " not in normalized and len(normalized) > 1:
+                for key in self._initials.get(normalized, ()):
+                    scores[key] = max(scores.get(key, 0.0), 0.95)
+            ranked = sorted(
+                (
+                    (score, self._entries[key]["reviews"], key)
+                    for key, score in scores.items()
+                    if score >= self.min_score and (not columns or key[0] in columns)
+                ),
+                key=lambda item: (-item[0], -item[1]),
+            )[:limit]
+            return [
+                {"column": key[0], "value": self._entries[key]["values"][0], "score": round(score, 3), "reviews": reviews}
+                for score, reviews, key in ranked
+            ]
+
+    def resolve(
+        self, mentions: List[str], columns: Optional[List[str]] = None, limit: int = DEFAULT_LIMIT
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Mention -> its best matching canonical values."""
+        return {mention: self.match(mention, columns, limit) for mention in mentions}
@@ -0,0 +1,192 @@
+# python native packages
+import contextvars
+import csv
+import gzip
+import os
+import re
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional
+
+# third party packages
+from sqlalchemy.engine import Result
+
+# custom packages
+from tracing import tracer
+
+ExportFormat = Literal["csv.gz", "parquet"]
+
+DEFAULT_EXPORT_DIR = "exports"
+DEFAULT_EXPORT_BATCH_SIZE = 5000
+# Rows held back to infer the Parquet column types, a column still all NULL after them is written as text
+PARQUET_SCHEMA_ROWS = 50_000
+
+
+def iter_batches(source: Any, batch_size: int = DEFAULT_EXPORT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yields lists of row dicts from a query result of any supported shape.
+
+    Accepted sources are a `ResultStream` (or any iterable of row chunks),
+    a SQLAlchemy `Result` cursor and a plain iterator of row dicts.
+    At most `batch_size` rows are held in memory at a time.
+    """
+    if isinstance(source, Result):
+        for partition in source.mappings().partitions(batch_size):
+            yield [dict(row) for row in partition]
+        return
+
+    batch = []
+    for item in source:
+        if isinstance(item, list):
+            # Already chunked, e.g. a ResultStream
+            yield item
+            continue
+        batch.append(dict(item))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_filename(question: str, export_format: ExportFormat = "csv.gz") -> str:
+    """Builds a unique per-question, per-run file name."""
+    slug = re.sub(r"[^a-z0-9]+", "_", question.lower()).strip("_")[:50] or "query"
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{timestamp}_{slug}_{uuid.uuid4().hex[:6]}.{export_format}"
+
+
+def write_csv_gz(batches: Iterable[List[Dict[str, Any]]], file_path: str, columns: Optional[List[str]] = None) -> int:
+    """Writes row batches to a gzip-compressed CSV file with a single header row."""
+    row_count = 0
+    with gzip.open(file_path, mode="wt", newline="", encoding="utf-8") as file:
+        writer = None
+        if columns:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+        for batch in batches:
+            if not batch:
+                continue
+            if writer is None:
+                writer = csv.DictWriter(file, fieldnames=list(batch[0].keys()))
+                writer.writeheader()
+            writer.writerows(batch)
+            row_count += len(batch)
+    return row_count
+
+
+def write_parquet(batches: Iterable[List[Dict[str, Any]]], file_path: str, columns: Optional[List[str]] = None) -> int:
+    """
+    Writes row batches to a Parquet file, one row group per batch (requires pyarrow).
+
+    The schema is inferred from the rows: batches are held back until every
+    column has had a non-NULL value, or PARQUET_SCHEMA_ROWS rows were read.
+    Columns still without one are written as text.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export requires pyarrow: pip install pyarrow") from e
+
+    def unified(tables: List[Any]) -> Any:
+        return pa.unify_schemas([table.schema for table in tables], promote_options="permissive")
+
+    def open_writer(tables: List[Any]) -> Any:
+        schema = pa.schema([
+            field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in unified(tables)
+        ])
+        writer = pq.ParquetWriter(file_path, schema, compression="snappy")
+        for table in tables:
+            writer.write_table(table.cast(schema))
+        return writer
+
+    row_count = 0
+    writer = None
+    pending: List[Any] = []
+    try:
+        for batch in batches:
+            if not batch:
+                continue
+            table = pa.Table.from_pylist(batch)
+            row_count += len(batch)
+            if writer is not None:
+                writer.write_table(table.cast(writer.schema))
+                continue
+            pending.append(table)
+            if row_count >= PARQUET_SCHEMA_ROWS or not any(pa.types.is_null(field.type) for field in unified(pending)):
+                writer, pending = open_writer(pending), []
+        if pending:
+            # The whole result was held back
+            writer = open_writer(pending)
+        if writer is None:
+            # Empty result, still leave a readable file behind
+            empty = pa.table({column: pa.array([], pa.string()) for column in columns or []})
+            pq.write_table(empty, file_path)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
+
+
+class ResultExporter:
+    """
+    Exports full query results to disk on a background thread.
+
+    `submit` returns the target path immediately, so the agent can reference the
+    file in its answer while the rows are still being written.
+    `report` blocks until the export finishes and returns its path and row count.
+    """
+
+    def __init__(
+        self,
+        export_dir: str = DEFAULT_EXPORT_DIR,
+        export_format: ExportFormat = "csv.gz",
+        batch_size: int = DEFAULT_EXPORT_BATCH_SIZE,
+        max_workers: int = 2,
+    ):
+        self.export_dir = export_dir
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="result-exporter")
+        self._jobs: Dict[str, Future] = {}
+
+    def submit(self, source: Any, question: str, columns: Optional[List[str]] = None) -> str:
+        os.makedirs(self.export_dir, exist_ok=True)
+        file_path = os.path.join(self.export_dir, export_filename(question, self.export_format))
+        # The copied context makes the export a child of the caller's span
+        self._jobs[file_path] = self._executor.submit(
+            contextvars.copy_context().run, self._export, source, file_path, columns
+        )
+        return file_path
+
+    def _export(self, source: Any, file_path: str, columns: Optional[List[str]]) -> int:
+        writer = write_parquet if self.export_format == "parquet" else write_csv_gz
+        try:
+            with tracer.span("export", format=self.export_format) as span:
+                rows = writer(iter_batches(source, self.batch_size), file_path, columns)
+                span.set(rows=rows)
+            return rows
+        finally:
+            close = getattr(source, "close", None)
+            if close:
+                close()
+
+    def report(self, file_path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        job = self._jobs.get(file_path)
+        if job is None:
+            return {"path": file_path, "rows": None, "error": "Unknown export"}
+        try:
+            rows = job.result(timeout=timeout)
+        except TimeoutError:
+            return {"path": file_path, "rows": None, "error": None}
+        except Exception as e:
+            rows, error = None, str(e)
+        else:
+            error = None
+        del self._jobs[file_path]
+        return {"path": file_path, "rows": rows, "error": error}
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
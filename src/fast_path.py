@@ -0,0 +1,262 @@
+"""
+Deterministic fast path for the common question shapes.
+
+    "Give me the top 5 accounts with the most reviews"
+    "i want all reviews from Viseca Payment Services SA"
+    "Id like to find the feedback we received for the SLES product from BCL
+     Business unit that come from Support CSAT/ Support SAT surveys"
+
+A question is matched only if every part of it is understood: the request, and
+each "from <company>", "for the <product> product", "from <unit> business
+unit", "from <source> surveys" or "from <geo> region" clause. Every name must
+resolve to values of its column (exact, acronym, or a single value containing
+it). Anything else, e.g. dates or ambiguous names, is left to the LLM.
+
+The SQL follows the QUERY_GEN_SYSTEM rules: Date, Account name and Summary
+columns first, newest first, and no empty groups in aggregates. Resolved values
+are bound as parameters and rendered as literals by the dialect.
+"""
+# python native packages
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# third party packages
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# custom packages
+from entity_index import EntityValueIndex, initials, normalize_name
+from models import CustomSQLDatabase
+
+FAST_PATH_TOOL_CALL_PREFIX = "fast_path_query_"
+DEFAULT_TABLE = "qualtrics_enriched_data"
+MAX_TOP_N = 1000
+
+# Filterable column -> output column title
+FILTER_COLUMNS = {
+    "account_name": "Account name",
+    "product": "Product",
+    "business_unit": "Business unit",
+    "source": "Source",
+    "geo": "Geo",
+}
+
+_REQUEST = re.compile(
+    r"^(?:(?:i\s*(?:'?d|would)?\s*(?:want|like)|id\s+like)\s+(?:to\s+(?:find|get|see|have)\s+)?"
+    r"|(?:can|could)\s+(?:you|i)\s+(?:please\s+)?(?:provide|have|get|give\s+me|show\s+me|find)\s+"
+    r"|please\s+(?:provide|give\s+me|show\s+me|find|list)\s+"
+    r"|(?:give|show)\s+me\s+|list\s+|find\s+)?"
+    r"(?:all\s+)?(?:of\s+)?(?:the\s+)?(?:reviews|feedback)"
+    r"(?:\s+(?:that\s+)?we\s+(?:have\s+)?(?:received|got))?",
+    re.IGNORECASE,
+)
+_TOP_ACCOUNTS = re.compile(
+    r"^(?:please\s+)?(?:(?:give|show)\s+me\s+|(?:can|could)\s+you\s+(?:please\s+)?(?:give\s+me|show\s+me|provide)\s+|list\s+)?"
+    r"(?:the\s+)?top\s+(?P<n>\d+)\s+(?:accounts|companies|customers)\s+"
+    r"(?:with|by)\s+(?:the\s+)?(?:most|highest\s+number\s+of|number\s+of)\s+reviews$",
+    re.IGNORECASE,
+)
+_CLAUSE_SPLIT = re.compile(r"\s+(?=(?:that\s+(?:come|came)\s+from|(?<!come )(?<!came )from|for|regarding|about)\s)", re.IGNORECASE)
+_CLAUSES = [
+    ("source", re.compile(r"^(?:that\s+(?:come|came)\s+)?from\s+(?:the\s+)?(?P<value>.+?)\s+(?:surveys?|sources?)$", re.IGNORECASE)),
+    ("business_unit", re.compile(r"^from\s+(?:the\s+)?(?P<value>.+?)\s+(?:business\s+units?|bu)$", re.IGNORECASE)),
+    ("geo", re.compile(r"^from\s+(?:the\s+)?(?P<value>.+?)\s+(?:region|geo)$", re.IGNORECASE)),
+    ("product", re.compile(r"^(?:for|regarding|about)\s+(?:the\s+)?(?:products?\s+)?(?P<value>.+?)(?:\s+products?)?$", re.IGNORECASE)),
+    ("account_name", re.compile(
+        r"^from\s+(?:the\s+)?(?:(?:companies|company|customers?|accounts?)\s*:?\s*)?(?P<value>.+)$", re.IGNORECASE | re.DOTALL
+    )),
+]
+# Separators of several names in one clause, tried in order once the whole phrase did not resolve
+_NAME_SEPARATORS = [
+    re.compile(r"\s*\b\d+\s*[.)]\s*"),
+    re.compile(r"\s*,\s*|\s+and\s+|\s*&\s*"),
+    re.compile(r"\s*/\s*"),
+]
+
+
+class EntityResolver:
+    """Resolves names written in a question to the values of a column, unambiguously or not at all."""
+
+    def __init__(self, index: EntityValueIndex):
+        self.index = index
+
+    def resolve(self, column: str, phrase: str, level: int = 0) -> Optional[List[str]]:
+        """The column values the phrase names, None if any name in it is unknown or ambiguous."""
+        resolved = self._resolve_one(column, phrase)
+        if resolved is not None or level >= len(_NAME_SEPARATORS):
+            return resolved
+        parts = [part for part in _NAME_SEPARATORS[level].split(phrase) if part and part.strip()]
+        if len(parts) <= 1:
+            return self.resolve(column, phrase, level + 1)
+        values = []
+        for part in parts:
+            part_values = self.resolve(column, part, level + 1)
+            if part_values is None:
+                return None
+            values += part_values
+        return sorted(set(values))
+
+    def _resolve_one(self, column: str, phrase: str) -> Optional[List[str]]:
+        key = normalize_name(phrase)
+        if not key:
+            return None
+        values = self.index.values(column)
+        if key in values:
+            return values[key]
+        # "BCL" -> "Business Critical Linux"
+        matches = [name for name in values if " " not in key and len(key) > 1 and initials(name) == key]
+        if not matches:
+            # "Rancher" -> "Rancher Prime", as long as no other value contains it
+            matches = [name for name in values if re.search(rf"\b{re.escape(key)}\b", name)]
+        if len(matches) != 1:
+            return None
+        return values[matches[0]]
+
+
+class FastPathMatch(dict):
+    """{"template": name, "query": SQL, "description": what the query returns}"""
+
+
+class FastPathMatcher:
+    """
+    Turns the common question shapes into SQL without the LLM.
+    `stats` reports the hit rate per template and the time spent matching.
+    """
+
+    def __init__(self, db: CustomSQLDatabase, table: str = DEFAULT_TABLE, entity_index: Optional[EntityValueIndex] = None):
+        self.db = db
+        self.table = table
+        self.resolver = EntityResolver(entity_index or EntityValueIndex(db, table, columns=list(FILTER_COLUMNS)))
+        self._columns: Optional[set] = None
+        self._lock = threading.Lock()
+        self._stats = {"questions": 0, "hits": 0, "unresolved": 0, "match_ms": 0.0, "by_template": {}}
+
+    @property
+    def columns(self) -> set:
+        if self._columns is None:
+            try:
+                self._columns = {
+                    column["name"] for column in inspect(self.db._engine).get_columns(self.table, schema=self.db._schema)
+                }
+            except SQLAlchemyError as e:
+                # No reviews table, every question goes to the LLM
+                print(f"Exception: {e}")
+                self._columns = set()
+        return self._columns
+
+    def match(self, question: str) -> Optional[FastPathMatch]:
+        started = time.perf_counter()
+        result, unresolved = None, False
+        try:
+            question = " ".join(question.split()).strip().rstrip("?.!")
+            result = self._top_accounts(question)
+            if result is None:
+                result, unresolved = self._reviews(question)
+            return result
+        finally:
+            with self._lock:
+                self._stats["questions"] += 1
+                self._stats["match_ms"] += (time.perf_counter() - started) * 1000
+                self._stats["unresolved"] += unresolved
+                if result is not None:
+                    self._stats["hits"] += 1
+                    by_template = self._stats["by_template"]
+                    by_template[result["template"]] = by_template.get(result["template"], 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, by_template=dict(self._stats["by_template"]))
+        stats["hit_rate"] = stats["hits"] / stats["questions"] if stats["questions"] else 0.0
+        stats["match_ms"] = round(stats["match_ms"], 3)
+        return stats
+
+    def _render(self, sql: str, parameters: Dict[str, Any]) -> str:
+        """The SQL with its parameters rendered as literals, quoted by the dialect."""
+        statement = text(sql).bindparams(
+            *(bindparam(name, value, expanding=True) for name, value in parameters.items() if isinstance(value, list)),
+            **{name: value for name, value in parameters.items() if not isinstance(value, list)},
+        )
+        return str(statement.compile(dialect=self.db._engine.dialect, compile_kwargs={"literal_binds": True}))
+
+    def _quote(self, name: str) -> str:
+        return self.db._engine.dialect.identifier_preparer.quote(name)
+
+    def _table(self) -> str:
+        if self.db._schema:
+            return f"{self._quote(self.db._schema)}.{self._quote(self.table)}"
+        return self._quote(self.table)
+
+    def _top_accounts(self, question: str) -> Optional[FastPathMatch]:
+        match = _TOP_ACCOUNTS.match(question)
+        if match is None or "account_name" not in self.columns:
+            return None
+        n = int(match.group("n"))
+        if not 0 < n <= MAX_TOP_N:
+            return None
+        account = self._quote("account_name")
+        sql = (
+            f'SELECT {account} AS "Account name", COUNT(*) AS "Reviews" FROM {self._table()} '
+            f"WHERE {account} IS NOT NULL AND {account} <> '' "
+            f"GROUP BY {account} ORDER BY COUNT(*) DESC LIMIT :n"
+        )
+        return FastPathMatch(
+            template="top_accounts",
+            query=self._render(sql, {"n": n}),
+            description=f"The top {n} accounts by number of reviews.",
+        )
+
+    def _reviews(self, question: str) -> Tuple[Optional[FastPathMatch], bool]:
+        """Review listing filtered by the question's clauses, and whether a clause named an unknown value."""
+        request = _REQUEST.match(question)
+        if request is None or not {"date", "account_name", "summary"} <= self.columns:
+            return None, False
+        rest = question[request.end():].strip()
+        if not rest:
+            return None, False
+
+        filters: Dict[str, List[str]] = {}
+        for clause in _CLAUSE_SPLIT.split(rest):
+            for column, pattern in _CLAUSES:
+                match = pattern.match(clause.strip())
+                if match is not None:
+                    break
+            else:
+                return None, False
+            if column in filters or column not in self.columns:
+                return None, False
+            values = self.resolver.resolve(column, match.group("value"))
+            if values is None:
+                return None, True
+            filters[column] = values
+
+        columns = [f'{self._quote("date")} AS "Date"', f'{self._quote("account_name")} AS "Account name"', f'{self._quote("summary")} AS "Summary"']
+        columns += [f'{self._quote(column)} AS "{FILTER_COLUMNS[column]}"' for column in filters if column != "account_name"]
+        where = " AND ".join(f"{self._quote(column)} IN :{column}" for column in filters)
+        sql = f"SELECT {', '.join(columns)} FROM {self._table()} WHERE {where} ORDER BY {self._quote('date')} DESC"
+        description = "Reviews where " + "; ".join(
+            f"{FILTER_COLUMNS[column]} is {' or '.join(map(str, values))}" for column, values in filters.items()
+        ) + ", newest first."
+        return FastPathMatch(template="reviews", query=self._render(sql, filters), description=description), False
+
+
+def markdown_table(columns: List[str], rows: List[Dict[str, Any]]) -> List[str]:
+    """The rows as the lines of a markdown table."""
+
+    def cell(value: Any) -> str:
+        return "" if value is None else " ".join(str(value).split()).replace("|", "\\|")
+
+    lines = ["| " + " | ".join(columns) + " |", "|" + " --- |" * len(columns)]
+    return lines + ["| " + " | ".join(cell(row.get(column)) for column in columns) + " |" for row in rows]
+
+
+def format_answer(description: str, columns: List[str], rows: List[Dict[str, Any]], row_count: Optional[int]) -> str:
+    """The user facing answer: what was queried and the rows as a markdown table."""
+    if not rows:
+        return f"{description}\n\nNo reviews match the question."
+
+    lines = [description, ""] + markdown_table(columns, rows)
+    total = str(row_count) if row_count is not None else "more than " + str(len(rows))
+    lines += ["", f"{total} results." if row_count == len(rows) else f"Showing the first {len(rows)} of {total} results."]
+    return "\n".join(lines)
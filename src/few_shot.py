@@ -0,0 +1,185 @@
+# python native packages
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# third party packages
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+# custom packages
+from prompts import FEW_SHOT_EXAMPLES
+from sql_cache import normalize_question
+
+DEFAULT_INDEX_PATH = "few_shot.sqlite"
+DEFAULT_MAX_EXAMPLES = 2000
+DEFAULT_TOP_K = 3
+DEFAULT_MIN_SIMILARITY = 0.3
+N_FEATURES = 2 ** 18
+
+
+class FewShotIndex:
+    """
+    Successful (question, SQL, row count) pairs, retrieved by the TF-IDF
+    similarity of their questions to serve as few-shot examples.
+
+    Questions are vectorized with hashed character n-grams, which need no
+    fitted vocabulary, and the document frequencies are kept up to date as
+    pairs are added, so the index grows one question at a time without a refit.
+    Pairs are stored in SQLite, keyed like the SQL cache by the normalized
+    question and the schema fingerprint, and loaded into memory on first use.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_INDEX_PATH,
+        max_examples: int = DEFAULT_MAX_EXAMPLES,
+        top_k: int = DEFAULT_TOP_K,
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+    ):
+        self.path = path
+        self.max_examples = max_examples
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.vectorizer = HashingVectorizer(
+            analyzer="char_wb", ngram_range=(3, 5), n_features=N_FEATURES, alternate_sign=False, norm=None
+        )
+        self._lock = threading.Lock()
+        self._examples: Optional[List[Dict[str, Any]]] = None
+        self._counts: List[sparse.csr_matrix] = []
+        self._matrix: Optional[sparse.csr_matrix] = None
+        self._document_frequency = np.zeros(N_FEATURES)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS few_shot_examples (
+                    question_key TEXT NOT NULL,
+                    fingerprint  TEXT NOT NULL,
+                    question     TEXT NOT NULL,
+                    sql          TEXT NOT NULL,
+                    row_count    INTEGER,
+                    iterations   INTEGER,
+                    created_at   REAL NOT NULL,
+                    PRIMARY KEY (question_key, fingerprint)
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _vectorize(self, question: str) -> sparse.csr_matrix:
+        return self.vectorizer.transform([normalize_question(question)])
+
+    def _load(self) -> None:
+        """Reads the stored pairs into memory, called with the lock held."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT question_key, fingerprint, question, sql, row_count, iterations FROM few_shot_examples ORDER BY created_at"
+            ).fetchall()
+        keys = ["question_key", "fingerprint", "question", "sql", "row_count", "iterations"]
+        self._examples = [dict(zip(keys, row)) for row in rows]
+        self._counts = [self._vectorize(example["question"]) for example in self._examples]
+        self._document_frequency = np.zeros(N_FEATURES)
+        for counts in self._counts:
+            self._document_frequency[counts.indices] += 1
+        self._matrix = None
+
+    def add(self, question: str, fingerprint: str, sql: str, row_count: Optional[int] = None, iterations: Optional[int] = None) -> None:
+        """Adds or replaces the pair of a question that was answered successfully."""
+        key = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO few_shot_examples VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, fingerprint, question, sql, row_count, iterations, time.time()),
+            )
+            evicted = conn.execute(
+                """
+                DELETE FROM few_shot_examples WHERE rowid IN (
+                    SELECT rowid FROM few_shot_examples ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_examples,),
+            ).rowcount
+
+        with self._lock:
+            if self._examples is None or evicted:
+                self._load()
+                return
+            example = {
+                "question_key": key,
+                "fingerprint": fingerprint,
+                "question": question,
+                "sql": sql,
+                "row_count": row_count,
+                "iterations": iterations,
+            }
+            counts = self._vectorize(question)
+            for i, existing in enumerate(self._examples):
+                if existing["question_key"] == key and existing["fingerprint"] == fingerprint:
+                    self._document_frequency[self._counts[i].indices] -= 1
+                    del self._examples[i], self._counts[i]
+                    break
+            self._examples.append(example)
+            self._counts.append(counts)
+            self._document_frequency[counts.indices] += 1
+            self._matrix = None
+
+    def search(self, question: str, fingerprint: str, k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """The k pairs whose questions are most similar to `question`, most similar first."""
+        k = self.top_k if k is None else k
+        with self._lock:
+            if self._examples is None:
+                self._load()
+            if not self._examples or k <= 0:
+                return []
+            idf = sparse.diags(np.log((1 + len(self._examples)) / (1 + self._document_frequency)) + 1)
+            if self._matrix is None:
+                self._matrix = normalize(sparse.vstack(self._counts).tocsr() @ idf)
+            similarities = (self._matrix @ normalize(self._vectorize(question) @ idf).T).toarray().ravel()
+            examples = self._examples
+
+        ranked = []
+        for i in np.argsort(-similarities):
+            if similarities[i] < self.min_similarity or len(ranked) == k:
+                break
+            if examples[i]["fingerprint"] == fingerprint:
+                ranked.append({**examples[i], "similarity": round(float(similarities[i]), 3)})
+        return ranked
+
+    def invalidate(self, fingerprint: str) -> int:
+        """Drops every pair written against a schema other than `fingerprint`."""
+        with self._connect() as conn:
+            removed = conn.execute("DELETE FROM few_shot_examples WHERE fingerprint != ?", (fingerprint,)).rowcount
+        with self._lock:
+            if removed and self._examples is not None:
+                self._load()
+        return removed
+
+    def stats(self) -> dict:
+        """Number of stored pairs and the mean query generation iterations it took to answer them."""
+        with self._connect() as conn:
+            count, mean_iterations = conn.execute("SELECT COUNT(*), AVG(iterations) FROM few_shot_examples").fetchone()
+        return {"examples": count, "mean_iterations": round(mean_iterations, 3) if mean_iterations is not None else None}
+
+
+def format_examples(examples: List[Dict[str, Any]]) -> str:
+    """The retrieved pairs as the prompt's examples block, empty without examples."""
+    if not examples:
+        return ""
+    blocks = []
+    for example in examples:
+        rows = "" if example.get("row_count") is None else f"\nRows: {example['row_count']}"
+        blocks.append(f"Question: {example['question']}\nSQL: {example['sql']}{rows}")
+    return FEW_SHOT_EXAMPLES.format(examples="\n\n".join(blocks))
@@ -0,0 +1,172 @@
+"""
+Follow-up questions answered from the retained result of the session's last query.
+
+    "show me the next 20"
+    "only the ones from Germany", "only those where product is SLES or SLES for SAP"
+    "sort them by date, oldest first", "newest first"
+
+Next-page questions continue the result's view where the last answer stopped.
+A filter narrows the view to rows whose column equals one of the named values;
+the column is the one named, or else the only column holding every value. A
+sort orders the view by a column. Filters and sorts start again from the first
+row. Anything else, or a name no single column holds, goes to the LLM.
+"""
+# python native packages
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# custom packages
+from fast_path import markdown_table
+from result_store import DEFAULT_PAGE_SIZE, ResultStore
+
+_NEXT = re.compile(
+    r"^(?:(?:please\s+|ok(?:ay)?\s*,?\s+|now\s+)*)(?:(?:show|give)\s+me\s+|(?:can|could)\s+(?:you|i)\s+(?:please\s+)?(?:see|have|get|show\s+me)\s+|list\s+)?"
+    r"(?:the\s+)?(?:next|more)(?:\s+(?P<n>\d+))?(?:\s+(?:results|rows|reviews|ones|entries|records|page))?"
+    r"(?:\s+(?:please|results|rows|reviews))?$",
+    re.IGNORECASE,
+)
+_FILTER = re.compile(
+    r"^(?:(?:please\s+|ok(?:ay)?\s*,?\s+|now\s+)*)(?:(?:show|give)\s+me\s+|keep\s+)?"
+    r"(?:(?:only|just)\s+(?:the\s+ones|those|them|the\s+(?:results|rows|reviews)|ones)|"
+    r"filter\s+(?:them|it|those|the\s+(?:results|rows|reviews))\s+(?:to|by|down\s+to)(?:\s+the\s+ones)?)"
+    r"\s+(?P<condition>.+)$",
+    re.IGNORECASE,
+)
+_CONDITION_WITH_COLUMN = re.compile(
+    r"^(?:where|with|whose|that\s+have)\s+(?:the\s+)?(?P<column>.+?)\s+(?:is|are|=|equals?|of)\s+(?P<values>.+)$",
+    re.IGNORECASE,
+)
+_CONDITION = re.compile(r"^(?:(?:that\s+(?:come|came)\s+)?from|in|for|of|about|regarding|with)\s+(?:the\s+)?(?P<values>.+)$", re.IGNORECASE)
+_SORT = re.compile(
+    r"^(?:(?:please\s+|ok(?:ay)?\s*,?\s+|now\s+)*)(?:sort|order)\s+(?:them\s+|it\s+|those\s+|the\s+(?:results|rows|reviews)\s+)?by\s+"
+    r"(?:the\s+)?(?P<column>.+?)(?:(?:\s*,\s*|\s+)(?:in\s+)?(?P<direction>[a-z]+(?:\s+(?:recent\s+)?first)?)(?:\s+order)?)?$",
+    re.IGNORECASE,
+)
+_SORT_BY_DATE = re.compile(
+    r"^(?:(?:please\s+|ok(?:ay)?\s*,?\s+|now\s+)*)(?:(?:show|give)\s+me\s+)?(?:them\s+|the\s+)?(?P<direction>newest|latest|most\s+recent|oldest|earliest)"
+    r"(?:\s+ones)?\s+first$",
+    re.IGNORECASE,
+)
+# Longer pages are cut, the rest follows with the next page
+MAX_PAGE_SIZE = 500
+_VALUE_SEPARATORS = re.compile(r"\s*,\s*(?:or\s+|and\s+)?|\s+or\s+|\s+and\s+")
+ASCENDING = {"asc", "ascending", "lowest first", "smallest first", "oldest first", "earliest first"}
+DESCENDING = {"desc", "descending", "highest first", "largest first", "newest first", "latest first", "most recent first"}
+
+
+def _words(text: str) -> str:
+    return " ".join(re.sub(r"[_\W]+", " ", text.casefold()).split())
+
+
+def parse_follow_up(question: str) -> Optional[Dict[str, Any]]:
+    """The follow-up the question asks for, None if it is not one."""
+    question = " ".join(question.split()).strip().rstrip("?.!")
+    match = _NEXT.match(question)
+    if match is not None:
+        return {"kind": "next", "n": int(match.group("n")) if match.group("n") else None}
+
+    match = _SORT_BY_DATE.match(question)
+    if match is not None:
+        return {"kind": "sort", "column": "date", "descending": match.group("direction").lower() not in ("oldest", "earliest")}
+    match = _SORT.match(question)
+    if match is not None:
+        column, direction = match.group("column"), (match.group("direction") or "").lower()
+        if direction and direction not in ASCENDING | DESCENDING:
+            # Part of the column's name, e.g. "sort by account name"
+            column, direction = f"{column} {match.group('direction')}", ""
+        return {"kind": "sort", "column": column, "descending": direction in DESCENDING}
+
+    match = _FILTER.match(question)
+    if match is None:
+        return None
+    condition = match.group("condition").strip()
+    match = _CONDITION_WITH_COLUMN.match(condition) or _CONDITION.match(condition)
+    if match is None:
+        return None
+    values = [value.strip(" '\"") for value in _VALUE_SEPARATORS.split(match.group("values")) if value.strip(" '\"")]
+    if not values:
+        return None
+    return {"kind": "filter", "column": match.groupdict().get("column"), "values": values}
+
+
+def match_column(phrase: str, columns: List[str]) -> Optional[str]:
+    """The column the phrase names: same words, or the only column whose name contains them."""
+    key = _words(phrase)
+    exact = [column for column in columns if _words(column) == key]
+    if exact:
+        return exact[0]
+    containing = [column for column in columns if re.search(rf"\b{re.escape(key)}\b", _words(column))]
+    return containing[0] if len(containing) == 1 else None
+
+
+class FollowUpAnswerer:
+    """Answers follow-ups from a `ResultStore`, advancing the session's view of the result."""
+
+    def __init__(self, store: ResultStore, page_size: int = DEFAULT_PAGE_SIZE):
+        self.store = store
+        self.page_size = page_size
+
+    def answer(self, handle: str, view: Dict[str, Any], question: str) -> Optional[Tuple[str, Dict[str, Any], str]]:
+        """The answer, the advanced view and the kind of follow-up, None if the question is not one."""
+        follow_up = parse_follow_up(question)
+        if follow_up is None:
+            return None
+        columns = self.store.columns(handle)
+        if columns is None:
+            # Expired, or never retained
+            return None
+
+        limit = self.page_size
+        if follow_up["kind"] == "next":
+            limit = min(follow_up["n"] or self.page_size, MAX_PAGE_SIZE)
+        elif follow_up["kind"] == "sort":
+            column = match_column(follow_up["column"], columns)
+            if column is None:
+                return None
+            view = dict(view, order_by=column, descending=follow_up["descending"], after=None, after_row=None, shown=0)
+        else:
+            view = self._filtered(handle, view, follow_up, columns)
+            if view is None:
+                return None
+
+        page = self.store.page(handle, view, limit)
+        if page is None:
+            return None
+        return self._format(page), page["view"], follow_up["kind"]
+
+    def _filtered(self, handle: str, view: Dict[str, Any], follow_up: Dict[str, Any], columns: List[str]) -> Optional[Dict[str, Any]]:
+        values = follow_up["values"]
+        if follow_up["column"]:
+            column = match_column(follow_up["column"], columns)
+            if column not in self.store.columns_containing(handle, values):
+                # e.g. an abbreviation of the stored name, left to the LLM
+                return None
+        else:
+            candidates = self.store.columns_containing(handle, values)
+            if not candidates and len(values) == 1 and " " in values[0]:
+                # "from the EMEA region": the last word describes the value
+                values = [values[0].rsplit(" ", 1)[0]]
+                candidates = self.store.columns_containing(handle, values)
+            column = candidates[0] if len(candidates) == 1 else None
+        if column is None:
+            return None
+        # A later filter on the same column replaces the earlier one
+        filters = {**view["filters"], column: values}
+        return dict(view, filters=filters, after=None, after_row=None, shown=0)
+
+    @staticmethod
+    def _format(page: Dict[str, Any]) -> str:
+        view, rows, total = page["view"], page["rows"], page["total"]
+        conditions = [f"{column} is {' or '.join(values)}" for column, values in view["filters"].items()]
+        description = "Results of the previous query"
+        if conditions:
+            description += " where " + "; ".join(conditions)
+        if view["order_by"] is not None:
+            description += f", sorted by {view['order_by']}" + (" descending" if view["descending"] else "")
+        if not rows:
+            return f"{description}.\n\nThere are no {'more ' if page['first'] > 1 else ''}results ({total} in total)."
+
+        last = page["first"] + len(rows) - 1
+        lines = [f"{description}.", ""] + markdown_table(page["columns"], rows)
+        lines += ["", f"Rows {page['first']} to {last} of {total}." + (" Ask for the next ones to see more." if last < total else "")]
+        return "\n".join(lines)
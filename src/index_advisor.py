@@ -0,0 +1,382 @@
+"""
+Recommends indexes for the SQL the agent actually executed.
+
+Usage:
+    python index_advisor.py --top 10
+    python index_advisor.py --top 3 --apply
+
+The statements in the query log (QUERY_LOG_PATH) are parsed for the columns
+they filter on (equality, ranges, LIKE / ILIKE patterns), join on, and order by
+under a LIMIT. Each column becomes a B-tree, BRIN (range filters on a column
+whose values follow the physical row order, e.g. an append-only date) or
+pg_trgm GIN (pattern filters) candidate. Candidates are ranked by the logged
+runtime they are expected to save, estimated from pg_stats selectivities.
+
+With --apply the top candidates are created and the logged statements that use
+them are re-measured with EXPLAIN ANALYZE before and after.
+"""
+# python native packages
+import argparse
+import statistics
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+# third party packages
+import sqlglot
+from pydantic import BaseModel
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlglot import exp
+from sqlglot.optimizer.scope import traverse_scope
+
+# custom packages
+from models import CustomSQLDatabase
+from query_log import read_query_log
+
+# Fraction of the rows a predicate keeps when pg_stats has no better estimate (Postgres' planner defaults)
+DEFAULT_SELECTIVITY = {"equality": 0.005, "join": 0.005, "range": 1 / 3, "pattern": 0.005, "order": 0.1}
+DEFAULT_MIN_ROWS = 10_000
+DEFAULT_MAX_SELECTIVITY = 0.1
+DEFAULT_BRIN_CORRELATION = 0.8
+
+Usage = Tuple[str, str, str]  # table, column, kind
+
+
+class IndexCandidate(BaseModel):
+    table: str
+    column: str
+    method: str  # "btree" | "brin" | "gin_trgm"
+    kinds: List[str]
+    queries: List[str]
+    workload_ms: float  # Logged runtime of the statements that would use the index
+    estimated_saved_ms: float
+
+    @property
+    def name(self) -> str:
+        return f"{self.table}_{self.column}_{self.method}_idx"[:63]
+
+
+def _plain_column(node: Optional[exp.Expression]) -> Optional[exp.Column]:
+    return node if isinstance(node, exp.Column) else None
+
+
+def extract_usages(query: str) -> set:
+    """(table, column, kind) of every indexable predicate, join and ORDER BY ... LIMIT column of the query."""
+    try:
+        statements = sqlglot.parse(query, read="postgres")
+    except sqlglot.errors.ParseError:
+        return set()
+
+    usages = set()
+    for statement in statements:
+        if statement is None:
+            continue
+        for scope in traverse_scope(statement):
+            select = scope.expression
+            if not isinstance(select, exp.Select):
+                continue
+            tables = {alias.lower(): source.name.lower() for alias, source in scope.sources.items() if isinstance(source, exp.Table)}
+
+            def resolve(column: Optional[exp.Column]) -> Optional[Tuple[str, str]]:
+                if column is None:
+                    return None
+                if column.table:
+                    table = tables.get(column.table.lower())
+                else:
+                    # Unqualified columns are only unambiguous with a single table in scope
+                    table = next(iter(tables.values())) if len(tables) == 1 else None
+                return (table, column.name.lower()) if table else None
+
+            def add(column: Optional[exp.Column], kind: str) -> None:
+                resolved = resolve(column)
+                if resolved:
+                    usages.add((*resolved, kind))
+
+            conditions = [select.args.get("where")] + [join.args.get("on") for join in select.args.get("joins") or []]
+            for condition in filter(None, conditions):
+                for predicate in condition.find_all(
+                    exp.EQ, exp.In, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between, exp.Like, exp.ILike
+                ):
+                    if predicate.find_ancestor(exp.Not):
+                        continue
+                    if isinstance(predicate, exp.EQ):
+                        left, right = _plain_column(predicate.this), _plain_column(predicate.expression)
+                        if left and right:
+                            add(left, "join")
+                            add(right, "join")
+                        elif left and not predicate.expression.find(exp.Column):
+                            add(left, "equality")
+                        elif right and not predicate.this.find(exp.Column):
+                            add(right, "equality")
+                    elif isinstance(predicate, exp.In):
+                        if not predicate.args.get("query"):
+                            add(_plain_column(predicate.this), "equality")
+                    elif isinstance(predicate, (exp.Like, exp.ILike)):
+                        add(_plain_column(predicate.this), "pattern")
+                    elif isinstance(predicate, exp.Between):
+                        add(_plain_column(predicate.this), "range")
+                    else:
+                        left, right = _plain_column(predicate.this), _plain_column(predicate.expression)
+                        if left and not predicate.expression.find(exp.Column):
+                            add(left, "range")
+                        elif right and not predicate.this.find(exp.Column):
+                            add(right, "range")
+
+            # An index in ORDER BY order avoids sorting the whole table for a top-N query
+            order = select.args.get("order")
+            if order and select.args.get("limit"):
+                for ordered in order.expressions:
+                    add(_plain_column(ordered.this), "order")
+    return usages
+
+
+def read_workload(entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Logged runtime per distinct statement. Failed statements only count if they hit the statement timeout."""
+    workload = defaultdict(lambda: {"count": 0, "total_ms": 0.0})
+    for entry in entries:
+        error = entry.get("error")
+        if error and "statement timeout" not in error:
+            continue
+        workload[entry["query"]]["count"] += 1
+        workload[entry["query"]]["total_ms"] += entry["elapsed_ms"]
+    return dict(workload)
+
+
+class IndexAdvisor:
+    """
+    Turns a logged workload into ranked index candidates, and applies them.
+
+    A candidate saves (1 - selectivity) of the runtime of each statement that
+    uses it. B-tree candidates that keep more than `max_selectivity` of the rows
+    are dropped, the planner would not use them over a sequential scan. Tables
+    under `min_rows` rows and columns that already lead an index of the same
+    kind are skipped.
+    """
+
+    def __init__(
+        self,
+        db: CustomSQLDatabase,
+        min_rows: int = DEFAULT_MIN_ROWS,
+        max_selectivity: float = DEFAULT_MAX_SELECTIVITY,
+        brin_correlation: float = DEFAULT_BRIN_CORRELATION,
+        statement_timeout_ms: Optional[int] = None,
+    ):
+        self.db = db
+        self.min_rows = min_rows
+        self.max_selectivity = max_selectivity
+        self.brin_correlation = brin_correlation
+        self.statement_timeout_ms = statement_timeout_ms
+        self._quote = db._engine.dialect.identifier_preparer.quote
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _qualified(self, name: str) -> str:
+        if self.db._schema:
+            return f"{self._quote(self.db._schema)}.{self._quote(name)}"
+        return self._quote(name)
+
+    def _table_stats(self, table: str) -> Dict[str, Any]:
+        """Row estimate, columns, pg_stats of the columns and the leading column of each existing index."""
+        if table in self._stats:
+            return self._stats[table]
+        inspector = inspect(self.db._engine)
+        existing = set()
+        primary_key = inspector.get_pk_constraint(table, schema=self.db._schema).get("constrained_columns") or []
+        if primary_key:
+            existing.add((primary_key[0].lower(), "btree"))
+        for index in inspector.get_indexes(table, schema=self.db._schema):
+            if not index["column_names"] or index["column_names"][0] is None:
+                # Expression index
+                continue
+            options = index.get("dialect_options", {})
+            method = options.get("postgresql_using", "btree")
+            if method == "gin" and "trgm" in str(options.get("postgresql_ops", "")):
+                method = "gin_trgm"
+            existing.add((index["column_names"][0].lower(), method))
+
+        stats = {
+            "rows": None,
+            "columns": {column["name"].lower() for column in inspector.get_columns(table, schema=self.db._schema)},
+            "existing": existing,
+            "pg_stats": {},
+        }
+        if self.db.dialect == "postgresql":
+            with self.db._engine.connect() as connection:
+                stats["rows"] = connection.execute(
+                    text("SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)"),
+                    {"name": self._qualified(table)},
+                ).scalar()
+                for name, n_distinct, correlation in connection.execute(
+                    text(
+                        "SELECT attname, n_distinct, correlation FROM pg_stats "
+                        "WHERE schemaname = coalesce(:schema, current_schema()) AND tablename = :table"
+                    ),
+                    {"schema": self.db._schema, "table": table},
+                ):
+                    stats["pg_stats"][name.lower()] = {"n_distinct": n_distinct, "correlation": correlation}
+        self._stats[table] = stats
+        return stats
+
+    def _method_and_selectivity(self, kind: str, column_stats: Dict[str, Any], rows: Optional[float]) -> Tuple[str, float]:
+        selectivity = DEFAULT_SELECTIVITY[kind]
+        if kind in ("equality", "join") and column_stats.get("n_distinct"):
+            n_distinct = column_stats["n_distinct"]
+            # Negative n_distinct is a fraction of the row count
+            distinct = n_distinct if n_distinct > 0 else -n_distinct * (rows or 0)
+            if distinct:
+                selectivity = 1 / distinct
+        if kind == "pattern":
+            return "gin_trgm", selectivity
+        if kind == "range" and abs(column_stats.get("correlation") or 0) >= self.brin_correlation:
+            return "brin", selectivity
+        return "btree", selectivity
+
+    def recommend(self, entries: List[Dict[str, Any]]) -> List[IndexCandidate]:
+        """Index candidates for the logged statements, most time saved first."""
+        workload = read_workload(entries)
+        usable = {table.lower(): table for table in self.db.get_usable_table_names()}
+        # (table, column, method) -> query -> (saved ms, kinds)
+        savings: Dict[Tuple[str, str, str], Dict[str, Tuple[float, set]]] = defaultdict(dict)
+        for query, runtime in workload.items():
+            for table, column, kind in extract_usages(query):
+                if table not in usable:
+                    continue
+                stats = self._table_stats(usable[table])
+                if column not in stats["columns"]:
+                    # e.g. an output alias in ORDER BY
+                    continue
+                if stats["rows"] is not None and stats["rows"] < self.min_rows:
+                    continue
+                method, selectivity = self._method_and_selectivity(kind, stats["pg_stats"].get(column, {}), stats["rows"])
+                if (column, method) in stats["existing"]:
+                    continue
+                if method == "btree" and kind != "order" and selectivity > self.max_selectivity:
+                    continue
+                saved = runtime["total_ms"] * (1 - selectivity)
+                key = (usable[table], column, method)
+                previous, kinds = savings[key].get(query, (0.0, set()))
+                # One index speeds up a statement once, even if it filters and orders on the column
+                savings[key][query] = (max(previous, saved), kinds | {kind})
+
+        candidates = [
+            IndexCandidate(
+                table=table,
+                column=column,
+                method=method,
+                kinds=sorted(set().union(*(kinds for _, kinds in queries.values()))),
+                queries=sorted(queries),
+                workload_ms=round(sum(workload[query]["total_ms"] for query in queries), 3),
+                estimated_saved_ms=round(sum(saved for saved, _ in queries.values()), 3),
+            )
+            for (table, column, method), queries in savings.items()
+        ]
+        return sorted(candidates, key=lambda candidate: candidate.estimated_saved_ms, reverse=True)
+
+    def ddl(self, candidate: IndexCandidate) -> str:
+        column = self._quote(candidate.column)
+        if candidate.method == "gin_trgm":
+            using = f"USING gin ({column} gin_trgm_ops)"
+        else:
+            using = f"USING {candidate.method} ({column})"
+        return (
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self._quote(candidate.name)} "
+            f"ON {self._qualified(candidate.table)} {using}"
+        )
+
+    def apply(self, candidates: List[IndexCandidate]) -> None:
+        """Creates the indexes without blocking writes and refreshes the table statistics."""
+        if self.db.dialect != "postgresql":
+            raise NotImplementedError("Indexes can only be applied on Postgres")
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with self.db._engine.connect() as connection:
+            connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+            if any(candidate.method == "gin_trgm" for candidate in candidates):
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for candidate in candidates:
+                connection.execute(text(self.ddl(candidate)))
+            for table in sorted({candidate.table for candidate in candidates}):
+                connection.execute(text(f"ANALYZE {self._qualified(table)}"))
+        self._stats.clear()
+
+    def measure(self, queries: List[str], repeat: int = 3) -> Dict[str, Optional[float]]:
+        """
+        Median runtime in ms of each statement over `repeat` runs, None if it
+        failed or timed out. Postgres reports the server side execution time of
+        EXPLAIN ANALYZE, run in a read-only transaction.
+        """
+        runtimes = {}
+        for query in queries:
+            samples = []
+            try:
+                for _ in range(repeat):
+                    samples.append(self._measure_once(query))
+            except SQLAlchemyError as e:
+                print(f"Exception: {e}")
+                runtimes[query] = None
+                continue
+            runtimes[query] = round(statistics.median(samples), 3)
+        return runtimes
+
+    def _measure_once(self, query: str) -> float:
+        with self.db._engine.connect() as connection:
+            with connection.begin():
+                if self.db.dialect != "postgresql":
+                    started = time.perf_counter()
+                    connection.execute(text(query)).fetchall()
+                    return (time.perf_counter() - started) * 1000
+                connection.exec_driver_sql("SET LOCAL transaction_read_only = on")
+                if self.statement_timeout_ms:
+                    connection.exec_driver_sql("SET LOCAL statement_timeout = %s", (int(self.statement_timeout_ms),))
+                if self.db._schema is not None:
+                    connection.exec_driver_sql("SET LOCAL search_path TO %s", (self.db._schema,))
+                plan = connection.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")).scalar()
+                return plan[0]["Execution Time"]
+
+
+def _format_ms(ms: Optional[float]) -> str:
+    return "failed" if ms is None else f"{ms:.1f} ms"
+
+
+def main():
+    from settings import load_settings
+    from text2SQL_demo_code import AgentResources
+
+    parser = argparse.ArgumentParser(description="Recommend indexes for the logged SQL workload.")
+    parser.add_argument("--log", default=None, help="Query log, defaults to QUERY_LOG_PATH")
+    parser.add_argument("--top", type=int, default=10, help="Number of candidates to show (and apply)")
+    parser.add_argument("--apply", action="store_true", help="Create the top candidates and re-measure the workload")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per statement when measuring")
+    args = parser.parse_args()
+
+    settings = load_settings()
+    advisor = IndexAdvisor(AgentResources(settings).db, statement_timeout_ms=settings.query_statement_timeout_ms)
+    candidates = advisor.recommend(read_query_log(args.log or settings.query_log_path))[:args.top]
+    if not candidates:
+        print("No index candidates in the query log")
+        return
+
+    for rank, candidate in enumerate(candidates, start=1):
+        print(
+            f"{rank}. {advisor.ddl(candidate)}\n"
+            f"   {', '.join(candidate.kinds)} in {len(candidate.queries)} statement(s), "
+            f"{_format_ms(candidate.workload_ms)} logged, ~{_format_ms(candidate.estimated_saved_ms)} saved"
+        )
+    if not args.apply:
+        return
+
+    queries = sorted(set().union(*(candidate.queries for candidate in candidates)))
+    before = advisor.measure(queries, repeat=args.repeat)
+    advisor.apply(candidates)
+    after = advisor.measure(queries, repeat=args.repeat)
+
+    print("\nWorkload before -> after:")
+    for query in queries:
+        print(f"{_format_ms(before[query])} -> {_format_ms(after[query])}  {' '.join(query.split())[:120]}")
+    measured = [query for query in queries if before[query] is not None and after[query] is not None]
+    total_before = sum(before[query] for query in measured)
+    total_after = sum(after[query] for query in measured)
+    print(f"Total over {len(measured)} statement(s): {_format_ms(total_before)} -> {_format_ms(total_after)}")
+
+
+if __name__ == "__main__":
+    main()
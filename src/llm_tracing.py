@@ -0,0 +1,51 @@
+# python native packages
+from typing import Dict
+from uuid import UUID
+
+# third party packages
+from langchain_core.callbacks import BaseCallbackHandler
+
+# custom packages
+from tracing import Span, tracer
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records every call of the chat model it is attached to as a span, with the
+    token usage reported by the model and the number of retries.
+    """
+
+    run_inline = True  # Keeps the caller's context, so the call is a child of the current span
+
+    def __init__(self, name: str):
+        self.name = name
+        self._spans: Dict[UUID, Span] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        if tracer.enabled:
+            self._spans[run_id] = tracer.start_span(self.name)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs) -> None:
+        if tracer.enabled:
+            self._spans[run_id] = tracer.start_span(self.name)
+
+    def on_retry(self, retry_state, *, run_id: UUID, **kwargs) -> None:
+        span = self._spans.get(run_id)
+        if span is not None:
+            span.add("retries")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                span.add("input_tokens", usage.get("input_tokens", 0))
+                span.add("output_tokens", usage.get("output_tokens", 0))
+        tracer.finish_span(span)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            tracer.finish_span(span, error=error)
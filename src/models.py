@@ -1,41 +1,373 @@
 # python native packages
+import hashlib
+import json
+import operator
+import threading
+import time
+import uuid
 from typing_extensions import TypedDict
-from typing import Annotated, Any, Dict, Literal, Optional, Sequence, Union
+from typing import Annotated, Any, Dict, Iterable, Iterator, List, Literal, Optional, Sequence, Union
 
 # third party packages
 from langchain_community.utilities.sql_database import SQLDatabase, truncate_word
 from langgraph.graph.message import add_messages
-from sqlalchemy.engine import Result
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Result
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.sql.expression import Executable
 
+# custom packages
+from tracing import tracer
+
+DEFAULT_STREAM_BATCH_SIZE = 1000
+
+
+class _WaitCountingMixin:
+    """Counts the callers currently inside a pool checkout, i.e. waiting for a connection."""
+
+    waiting = 0
+    _waiting_lock = threading.Lock()
+
+    def _do_get(self):
+        with self._waiting_lock:
+            self.waiting += 1
+        try:
+            return super()._do_get()
+        finally:
+            with self._waiting_lock:
+                self.waiting -= 1
+
+
+class MeteredQueuePool(_WaitCountingMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(_WaitCountingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_engine_args(
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_recycle: int = 1800,
+    pool_pre_ping: bool = True,
+    statement_timeout_ms: Optional[int] = None,
+    is_async: bool = False,
+) -> Dict[str, Any]:
+    """
+    Builds `create_engine` / `create_async_engine` keyword arguments for a sized,
+    metered connection pool. `statement_timeout_ms` is set per session through
+    the driver's connect arguments (psycopg2 options or asyncpg server settings).
+    """
+    engine_args = {
+        "poolclass": MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": pool_recycle,
+        "pool_pre_ping": pool_pre_ping,
+    }
+    if statement_timeout_ms:
+        if is_async:
+            engine_args["connect_args"] = {"server_settings": {"statement_timeout": str(statement_timeout_ms)}}
+        else:
+            engine_args["connect_args"] = {"options": f"-c statement_timeout={statement_timeout_ms}"}
+    return engine_args
+
+
+def _pool_metrics(pool) -> Dict[str, Any]:
+    if not isinstance(pool, QueuePool):
+        return {"status": pool.status()}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "waiting": getattr(pool, "waiting", 0),
+    }
+
+
+class ResultStream:
+    """Query result read lazily from a server-side cursor in `fetchmany` batches.
+
+    The stream owns its connection until it is exhausted or closed. Rows are kept
+    untruncated; `preview` returns the first rows truncated for the LLM and buffers
+    them so that iterating the stream afterwards still yields every row once.
+    """
+
+    from_cache = False
+
+    def __init__(
+        self,
+        connection: Connection,
+        result: Result[Any],
+        batch_size: int = DEFAULT_STREAM_BATCH_SIZE,
+        max_string_length: int = 300,
+    ):
+        self._connection = connection
+        self._result = result
+        self._batch_size = batch_size
+        self._max_string_length = max_string_length
+        self.columns = list(result.keys()) if result.returns_rows else []
+        self._buffer: List[List[Dict[str, Any]]] = []
+        self._source = self._read_chunks()
+        # Receive every chunk read and the columns once exhausted, e.g. to cache or retain the result
+        self._recorders: List[Any] = []
+        self.rows_read = 0
+        self.fetch_ms = 0.0
+        self.exhausted = False
+        # Spans the stream's lifetime, the time actually spent fetching is in fetch_ms
+        self._span = tracer.start_span("db.stream") if tracer.enabled else None
+
+    def _read_chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        try:
+            if self._result.returns_rows:
+                started = time.perf_counter()
+                for partition in self._result.mappings().partitions(self._batch_size):
+                    chunk = [dict(row) for row in partition]
+                    self.fetch_ms += (time.perf_counter() - started) * 1000
+                    self._record(chunk)
+                    self.rows_read += len(chunk)
+                    yield chunk
+                    started = time.perf_counter()
+            self._finish()
+        finally:
+            self.close()
+
+    def _record(self, chunk: List[Dict[str, Any]], recorders: Optional[List[Any]] = None) -> None:
+        for recorder in list(self._recorders if recorders is None else recorders):
+            try:
+                recorder.add(chunk)
+            except Exception as e:
+                # A failing recorder must not fail the query, it just stops recording
+                print(f"Exception: {e}")
+                self._recorders.remove(recorder)
+
+    def _finish(self, recorders: Optional[List[Any]] = None) -> None:
+        self.exhausted = True
+        for recorder in self._recorders if recorders is None else recorders:
+            try:
+                recorder.finish(self.columns)
+            except Exception as e:
+                print(f"Exception: {e}")
+
+    def add_recorder(self, recorder: Any) -> None:
+        """Feeds `recorder.add` every chunk and then calls `recorder.finish`, must be added before iterating."""
+        self._recorders.append(recorder)
+        for chunk in list(self._buffer):
+            self._record(chunk, [recorder])
+        if self.exhausted and recorder in self._recorders:
+            self._finish([recorder])
+
+    def preview(self, n: int) -> List[Dict[str, Any]]:
+        """Return up to `n` leading rows, truncated like `CustomSQLDatabase.run`."""
+        while sum(len(chunk) for chunk in self._buffer) < n:
+            chunk = next(self._source, None)
+            if chunk is None:
+                break
+            self._buffer.append(chunk)
+
+        rows = [row for chunk in self._buffer for row in chunk][:n]
+        return [
+            {
+                column: truncate_word(value, length=self._max_string_length)
+                for column, value in row.items()
+            }
+            for row in rows
+        ]
+
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        while self._buffer:
+            yield self._buffer.pop(0)
+        yield from self._source
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for chunk in self:
+            yield from chunk
+
+    def close(self) -> None:
+        if not self._connection.closed:
+            self._result.close()
+            self._connection.close()
+        if self._span is not None:
+            self._span.set(rows=self.rows_read, fetch_ms=round(self.fetch_ms, 3), exhausted=self.exhausted)
+            tracer.finish_span(self._span)
+            self._span = None
+
+
+class CachedResultStream(ResultStream):
+    """`ResultStream` over rows served by the result cache, without a connection."""
+
+    from_cache = True
+
+    def __init__(
+        self,
+        columns: List[str],
+        rows: List[Dict[str, Any]],
+        batch_size: int = DEFAULT_STREAM_BATCH_SIZE,
+        max_string_length: int = 300,
+    ):
+        self._rows = rows
+        self._batch_size = batch_size
+        self._max_string_length = max_string_length
+        self.columns = columns
+        self._buffer = []
+        self._source = self._read_chunks()
+        self._recorders = []
+        self.rows_read = 0
+        self.fetch_ms = 0.0
+        self.exhausted = False
+        self._span = None
+
+    def _read_chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        for start in range(0, len(self._rows), self._batch_size):
+            chunk = self._rows[start:start + self._batch_size]
+            self._record(chunk)
+            self.rows_read += len(chunk)
+            yield chunk
+        self._finish()
+
+    def close(self) -> None:
+        self._source.close()
+
+
+class ResultRegistry:
+    """Thread-safe map of opaque handle ids to open `ResultStream`s.
+
+    Graph state only carries the handle id, so it stays serializable while the
+    live cursor is kept here.
+    """
+
+    def __init__(self):
+        self._results: Dict[str, ResultStream] = {}
+        self._lock = threading.Lock()
+
+    def register(self, result: ResultStream) -> str:
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._results[handle] = result
+        return handle
+
+    def get(self, handle: Optional[str]) -> Optional[ResultStream]:
+        with self._lock:
+            return self._results.get(handle)
+
+    def pop(self, handle: Optional[str]) -> Optional[ResultStream]:
+        with self._lock:
+            return self._results.pop(handle, None)
+
 
 class CustomSQLDatabase(SQLDatabase):
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        async_database_uri: Optional[str] = None,
+        async_engine_args: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ):
+        self._materialized_views: set = set()
         super().__init__(*args, **kwargs)
-        self._usable_tables.union(set(self._inspector.get_materialized_view_names()))
-        self._all_tables.union(set(self._inspector.get_materialized_view_names()))
+        # The async engine is only created on the first arun call
+        self._async_database_uri = async_database_uri
+        self._async_engine_args = async_engine_args or {}
+        self._async_engine: Optional[AsyncEngine] = None
+        # Set to a `result_cache.ResultCache` to reuse the results of repeated queries
+        self.result_cache = None
+        self.refresh_materialized_views()
+
+    def refresh_materialized_views(self) -> set:
+        """Makes the schema's materialized views (e.g. the rollups) usable tables."""
+        try:
+            self._materialized_views = set(inspect(self._engine).get_materialized_view_names(schema=self._schema))
+        except NotImplementedError:
+            # e.g. SQLite has no materialized views
+            self._materialized_views = set()
+        self._usable_tables |= self._materialized_views
+        self._all_tables |= self._materialized_views
+        return self._materialized_views
+
+    def get_usable_table_names(self) -> Iterable[str]:
+        # include_tables only lists base tables, the materialized views are added on top
+        return sorted(set(super().get_usable_table_names()) | self._materialized_views)
+
+    def schema_fingerprint(self) -> str:
+        """Hash of the usable tables' columns and types, read from a fresh inspector."""
+        inspector = inspect(self._engine)
+        schema = {
+            table: [
+                [column["name"], str(column["type"])]
+                for column in inspector.get_columns(table, schema=self._schema)
+            ]
+            for table in sorted(self._usable_tables)
+        }
+        return hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
 
     def run(
         self,
         command: Union[str, Executable],
-        fetch: Literal["all", "one", "cursor"] = "all",
+        fetch: Literal["all", "one", "cursor", "stream"] = "all",
         include_columns: bool = False,
         *,
         parameters: Optional[Dict[str, Any]] = None,
         execution_options: Optional[Dict[str, Any]] = None,
-    ) -> Union[str, Sequence[Dict[str, Any]], Result[Any]]:
+        batch_size: int = DEFAULT_STREAM_BATCH_SIZE,
+        read_only: bool = False,
+        statement_timeout_ms: Optional[int] = None,
+    ) -> Union[str, Sequence[Dict[str, Any]], Result[Any], ResultStream]:
         """Execute a SQL command and return a list of items representing the results.
 
         If the statement returns rows, a list of the results is returned.
         If the statement returns no rows, an empty list is returned.
+
+        With fetch="stream" a `ResultStream` is returned instead, which reads the
+        rows through a server-side cursor `batch_size` rows at a time. Its
+        transaction can be made read-only and given its own statement timeout.
+
+        With a `result_cache`, the results of "all", "one" and "stream" fetches
+        are served from the cache while the tables they read are unchanged.
         """
-        result = self._execute(
-            command, fetch, parameters=parameters, execution_options=execution_options
-        )
+        with tracer.span("db.run", fetch=fetch) as span:
+            cache_key = None
+            if self.result_cache is not None and fetch != "cursor":
+                cache_key = self.result_cache.key(command, parameters, fetch)
+            cached = self.result_cache.get(cache_key) if cache_key is not None else None
+            span.set(cache="hit" if cached is not None else "miss" if cache_key is not None else "off")
 
-        if fetch == "cursor":
-            return result
+            if fetch == "stream":
+                if cached is not None:
+                    return CachedResultStream(*cached, batch_size, self._max_string_length)
+                stream = self._execute_stream(
+                    command,
+                    batch_size,
+                    parameters=parameters,
+                    execution_options=execution_options,
+                    read_only=read_only,
+                    statement_timeout_ms=statement_timeout_ms,
+                )
+                if cache_key is not None:
+                    stream.add_recorder(self.result_cache.recorder(cache_key))
+                return stream
 
+            if cached is not None:
+                result = cached[1]
+            else:
+                result = self._execute(
+                    command, fetch, parameters=parameters, execution_options=execution_options
+                )
+
+            if fetch == "cursor":
+                return result
+
+            if cache_key is not None and cached is None:
+                self.result_cache.put(cache_key, list(result[0]) if result else [], result)
+            rows = self._format_rows(result, include_columns)
+            span.set(rows=len(rows))
+            return rows
+
+    def _format_rows(
+        self, result: Sequence[Dict[str, Any]], include_columns: bool
+    ) -> Sequence[Dict[str, Any]]:
         res = [
             {
                 column: truncate_word(value, length=self._max_string_length)
@@ -52,6 +384,179 @@ class CustomSQLDatabase(SQLDatabase):
         else:
             return res
 
+    @property
+    def async_engine(self) -> AsyncEngine:
+        if self._async_engine is None:
+            if not self._async_database_uri:
+                raise ValueError("async_database_uri is required for the async query path")
+            self._async_engine = create_async_engine(
+                self._async_database_uri, **self._async_engine_args
+            )
+        return self._async_engine
+
+    async def arun(
+        self,
+        command: Union[str, Executable],
+        fetch: Literal["all", "one"] = "all",
+        include_columns: bool = False,
+        *,
+        parameters: Optional[Dict[str, Any]] = None,
+        execution_options: Optional[Dict[str, Any]] = None,
+    ) -> Sequence[Dict[str, Any]]:
+        """Async counterpart of `run`, executed on the async driver's pool.
+
+        If the statement returns rows, a list of the results is returned.
+        If the statement returns no rows, an empty list is returned.
+        """
+        if isinstance(command, str):
+            command = text(command)
+
+        with tracer.span("db.arun", fetch=fetch) as span:
+            async with self.async_engine.begin() as connection:
+                if self._schema is not None and self.dialect == "postgresql":
+                    preparer = self._engine.dialect.identifier_preparer
+                    await connection.exec_driver_sql(
+                        f"SET search_path TO {preparer.quote_schema(self._schema)}"
+                    )
+                cursor = await connection.execute(
+                    command, parameters or {}, execution_options=execution_options or {}
+                )
+                if not cursor.returns_rows:
+                    return []
+                if fetch == "one":
+                    first_result = cursor.mappings().first()
+                    result = [] if first_result is None else [dict(first_result)]
+                else:
+                    result = [dict(row) for row in cursor.mappings().all()]
+            span.set(rows=len(result))
+
+        return self._format_rows(result, include_columns)
+
+    async def arun_no_throw(
+        self,
+        command: str,
+        fetch: Literal["all", "one"] = "all",
+        include_columns: bool = False,
+        *,
+        parameters: Optional[Dict[str, Any]] = None,
+        execution_options: Optional[Dict[str, Any]] = None,
+    ) -> Union[str, Sequence[Dict[str, Any]]]:
+        """Async counterpart of `run_no_throw`.
+
+        If the statement throws an error, the error message is returned.
+        """
+        try:
+            return await self.arun(
+                command,
+                fetch,
+                include_columns,
+                parameters=parameters,
+                execution_options=execution_options,
+            )
+        except SQLAlchemyError as e:
+            """Format the error message"""
+            return f"Error: {e}"
+
+    async def adispose(self) -> None:
+        """Close the async pool's connections, must run on the loop that used them."""
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+            self._async_engine = None
+
+    def pool_metrics(self) -> Dict[str, Any]:
+        """Checked out, checked in, overflow and waiting connections of both pools."""
+        metrics = {"sync": _pool_metrics(self._engine.pool)}
+        if self._async_engine is not None:
+            metrics["async"] = _pool_metrics(self._async_engine.sync_engine.pool)
+        return metrics
+
+    def explain(self, command: str) -> Dict[str, Any]:
+        """Return the planner's estimate for a Postgres query without executing it.
+
+        The top plan node of `EXPLAIN (FORMAT JSON)` is returned, e.g. its
+        "Total Cost" and "Plan Rows".
+        """
+        result = self._execute(f"EXPLAIN (FORMAT JSON) {command}", "all")
+        plan = next(iter(result[0].values()))
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def _execute_stream(
+        self,
+        command: Union[str, Executable],
+        batch_size: int = DEFAULT_STREAM_BATCH_SIZE,
+        *,
+        parameters: Optional[Dict[str, Any]] = None,
+        execution_options: Optional[Dict[str, Any]] = None,
+        read_only: bool = False,
+        statement_timeout_ms: Optional[int] = None,
+    ) -> ResultStream:
+        """Open a connection and execute the command with a server-side cursor.
+
+        `stream_results` makes psycopg2 use a named cursor, so Postgres only ships
+        `max_row_buffer` rows per round trip instead of the whole result.
+        """
+        execution_options = {
+            **(execution_options or {}),
+            "stream_results": True,
+            "max_row_buffer": batch_size,
+        }
+        if isinstance(command, str):
+            command = text(command)
+
+        connection = self._engine.connect()
+        try:
+            if self.dialect == "postgresql":
+                # SET LOCAL only lasts until the stream's transaction ends
+                if read_only:
+                    connection.exec_driver_sql("SET LOCAL transaction_read_only = on")
+                if statement_timeout_ms:
+                    connection.exec_driver_sql(
+                        "SET LOCAL statement_timeout = %s", (int(statement_timeout_ms),)
+                    )
+                if self._schema is not None:
+                    connection.exec_driver_sql("SET search_path TO %s", (self._schema,))
+            result = connection.execute(
+                command, parameters or {}, execution_options=execution_options
+            )
+        except Exception:
+            connection.close()
+            raise
+
+        return ResultStream(connection, result, batch_size, self._max_string_length)
+
+
+def update_exports(left: Optional[list], right: Optional[list]) -> list:
+    """Merge export reports by path, later reports replace earlier ones."""
+    merged = {report["path"]: report for report in left or []}
+    merged.update({report["path"]: report for report in right or []})
+    return list(merged.values())
+
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
+    exports: Annotated[list, update_exports]
+    # Prompt tokens of each query_gen turn, before and after history compaction
+    token_usage: Annotated[list, operator.add]
+    # Per question, reset when a new question enters the graph
+    generated_query: Optional[str]
+    query_result: Optional[str]
+    # tool_call_id of the sql_db_query call whose result is in query_result
+    query_result_call: Optional[str]
+    # The guard's row limit when it bounds query_result, the result then may not be complete
+    row_limit: Optional[int]
+    row_count: Optional[int]
+    rows_shown: Optional[int]
+    cached_sql: Optional[str]
+    # {"template": ..., "description": ...} when the question was answered from a SQL template
+    fast_path_match: Optional[dict]
+    # query_gen turns it took to answer the question
+    query_gen_turns: Optional[int]
+    # Tables selected for the question, the only ones in the prompt's schema
+    relevant_tables: Optional[List[str]]
+    # Per session, kept across questions: the last query's complete result for follow-ups,
+    # the filters, sort and keyset position of the rows shown from it, and the kind of the follow-up answered
+    retained_result: Optional[str]
+    result_view: Optional[dict]
+    follow_up_kind: Optional[str]
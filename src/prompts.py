@@ -4,12 +4,13 @@ Given an input question, create a syntactically correct PostgresSQL query to run
 
 <instructions>
 1. When returning the results, you should always include the 'Date', 'Account name' and 'Summary' columns in that order (make sure you sort them by date in Descending order unless instructed otherwise) as well as any other column you deem relevant to the question in each case (Product etc)
-2. You have access to tools for interacting with the database. Use your tools to fetch the database schema, so that you can generate the query based on the schema. Only use the information returned by the tools to construct your final answer.
-3. You MUST double check your query before executing it. If you get an error while executing a query, rewrite the query and try again.
+2. You have access to tools for interacting with the database. The schema of the available tables is given below in the <schema> section, so generate the query based on it without fetching it again. Only use the information returned by the tools to construct your final answer.
+3. You MUST double check your query before executing it. If you get an error while executing a query, rewrite the query and try again. Queries are checked against the schema before they run: a "query_rejected" error lists each problem with its fix, apply every fix.
 4. Once you are able to provide an answer from the data fetched from the database, don't call any tools again.
 5. Try to explain in a sentence the query you are generating.
 6. For questions that contain dates use the format: dd-mm-yyyy.
 7. For requests involving aggregates per account (e.g., counts per Account name, Product, or Geo), always filter out rows where the grouping column is empty or null.
+8. Before filtering on account, product, business unit, source or geo names, resolve all the names mentioned in the question with a single resolve_entities call and filter on the exact values it returns.
 </instructions>
 
 <Restrictions>
@@ -18,6 +19,20 @@ Given an input question, create a syntactically correct PostgresSQL query to run
 </Restrictions>
 """
 
+SCHEMA_SNAPSHOT = """
+<schema>
+{schema_snapshot}
+</schema>
+"""
+
+FEW_SHOT_EXAMPLES = """
+<examples>
+Similar questions that were answered correctly before, with the SQL that answered them. Reuse their column names, filter values and structure where they apply to the current question.
+
+{examples}
+</examples>
+"""
+
 TREND_PLOT_GEN = """
 You evaluate a dataset for trend analysis plotting.
 The dataset is provided as a JSON array of objects with exactly two keys representing two dimensions.
@@ -0,0 +1,49 @@
+# python native packages
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+DEFAULT_QUERY_LOG_PATH = "query_log.jsonl"
+
+
+class QueryLog:
+    """Appends one JSON line per executed SQL statement: the statement, its runtime and outcome."""
+
+    def __init__(self, path: str = DEFAULT_QUERY_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        query: str,
+        elapsed_ms: float,
+        row_count: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        entry = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "query": query,
+            "elapsed_ms": round(elapsed_ms, 3),
+            "row_count": row_count,
+            "error": error,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+
+def read_query_log(path: str = DEFAULT_QUERY_LOG_PATH) -> List[Dict[str, Any]]:
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Partially written last line
+                continue
+    return entries
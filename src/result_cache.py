@@ -0,0 +1,359 @@
+"""
+Cache of query results shared by every run of the agent, e.g. dashboards
+re-running the same SQL all day.
+
+    cache = ResultCache(db, watermarks=read_watermarks("config.yaml"), cache_dir="result_cache")
+    db.result_cache = cache
+    cache.stats()  # hit ratio, bytes saved
+
+Results are keyed by the normalized SQL (parsed and re-rendered by sqlglot, so
+whitespace, keyword case and comments do not matter) and the bound parameters.
+Only single SELECT statements over the usable tables are cached, and not when
+they call volatile functions such as now() or random().
+
+Each entry keeps the data version of the tables it read. A table's version is a
+cheap watermark: its row count and the max of a column (e.g. date), or a
+configured query such as the max generation of a load table. Versions are read
+at most every `watermark_seconds`, and an entry whose tables changed since it
+was stored is dropped instead of served.
+
+Small results are kept in memory, bounded by bytes and evicted least recently
+used first. Results over `disk_threshold_bytes` are written to `cache_dir`,
+which is bounded by bytes too and kept across processes.
+"""
+# python native packages
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# third party packages
+import sqlglot
+import yaml
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+DEFAULT_MEMORY_BYTES = 64 * 2 ** 20
+DEFAULT_DISK_THRESHOLD_BYTES = 2 ** 20
+DEFAULT_DISK_BYTES = 2 ** 30
+DEFAULT_WATERMARK_SECONDS = 300
+
+# Functions whose result changes from one run to the next
+VOLATILE_FUNCTIONS = {
+    "current_date", "current_time", "current_timestamp", "current_datetime", "localtime", "localtimestamp",
+    "now", "clock_timestamp", "statement_timestamp", "transaction_timestamp", "timeofday",
+    "rand", "random", "uuid", "gen_random_uuid", "nextval", "setseed",
+}
+SQLGLOT_DIALECTS = {"postgresql": "postgres"}
+
+
+class CacheKey(NamedTuple):
+    digest: str
+    # Table -> its data version when the key was made
+    watermarks: Dict[str, Any]
+
+
+def read_watermarks(filename: str) -> Dict[str, Dict[str, str]]:
+    """Reads the `result_cache_watermarks` section of the config: table -> {column: ...} or {query: ...}."""
+    with open(filename, 'r') as file:
+        result = yaml.safe_load(file) or {}
+    return result.get('result_cache_watermarks') or {}
+
+
+class _Recorder:
+    """Collects the chunks of a streamed result and stores them once the stream is exhausted."""
+
+    def __init__(self, cache: "ResultCache", key: CacheKey):
+        self.cache = cache
+        self.key = key
+        self.rows: Optional[List[Dict[str, Any]]] = []
+        self.size = 0
+
+    def add(self, chunk: List[Dict[str, Any]]) -> None:
+        if self.rows is None:
+            return
+        self.size += len(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL))
+        if self.size > self.cache.max_entry_bytes:
+            # Too large to cache, stop holding on to the rows
+            self.rows = None
+            return
+        self.rows.extend(chunk)
+
+    def finish(self, columns: List[str]) -> None:
+        if self.rows is not None:
+            self.cache.put(self.key, columns, self.rows)
+            self.rows = None
+
+
+class ResultCache:
+    def __init__(
+        self,
+        db,
+        watermarks: Optional[Dict[str, Dict[str, str]]] = None,
+        aliases: Optional[Dict[str, str]] = None,
+        memory_bytes: int = DEFAULT_MEMORY_BYTES,
+        cache_dir: Optional[str] = None,
+        disk_threshold_bytes: int = DEFAULT_DISK_THRESHOLD_BYTES,
+        disk_bytes: int = DEFAULT_DISK_BYTES,
+        watermark_seconds: float = DEFAULT_WATERMARK_SECONDS,
+    ):
+        self.db = db
+        self.watermark_specs = watermarks or {}
+        # Table -> the table whose version it follows, e.g. a rollup view -> its base table
+        self.aliases = aliases or {}
+        self.memory_bytes = memory_bytes
+        self.cache_dir = cache_dir or None
+        self.disk_threshold_bytes = disk_threshold_bytes if self.cache_dir else memory_bytes
+        self.disk_bytes = disk_bytes if self.cache_dir else 0
+        # No single result may take more than a quarter of its tier
+        self.max_entry_bytes = (disk_bytes if self.cache_dir else memory_bytes) // 4
+        self.watermark_seconds = watermark_seconds
+        self._dialect = SQLGLOT_DIALECTS.get(db.dialect, db.dialect)
+        self._lock = threading.RLock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk: Optional["OrderedDict[str, int]"] = None
+        self._disk_size = 0
+        self._watermarks: Dict[str, Tuple[Any, float]] = {}
+        self._stats = {
+            "lookups": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "invalidations": 0,
+            "uncacheable": 0, "stores": 0, "evictions": 0, "bytes_saved": 0,
+        }
+
+    # Keys
+
+    def _tables(self, expression: exp.Expression) -> Optional[List[str]]:
+        """The usable tables the statement reads, None if it reads anything else."""
+        ctes = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+        usable = set(self.db.get_usable_table_names())
+        tables = set()
+        for table in expression.find_all(exp.Table):
+            name = table.name if table.this.quoted else table.name.lower()
+            if not name or (name in ctes and not table.db):
+                continue
+            if name not in usable or (table.db and self.db._schema and table.db != self.db._schema):
+                return None
+            tables.add(name)
+        return sorted(tables)
+
+    def key(self, command: Any, parameters: Optional[Dict[str, Any]], fetch: str) -> Optional[CacheKey]:
+        """The cache key of a statement, None if its result must not be cached."""
+        with self._lock:
+            self._stats["lookups"] += 1
+        if not isinstance(command, str):
+            return self._uncacheable()
+        try:
+            expressions = sqlglot.parse(command, read=self._dialect)
+        except SqlglotError:
+            return self._uncacheable()
+        if len(expressions) != 1 or not isinstance(expressions[0], (exp.Select, exp.SetOperation)):
+            return self._uncacheable()
+        expression = expressions[0]
+        for function in expression.find_all(exp.Func):
+            name = function.name if isinstance(function, exp.Anonymous) else function.sql_name()
+            if name.lower() in VOLATILE_FUNCTIONS:
+                return self._uncacheable()
+        if any(not column.table and column.name.lower() in VOLATILE_FUNCTIONS for column in expression.find_all(exp.Column)):
+            return self._uncacheable()
+        tables = self._tables(expression)
+        if tables is None:
+            return self._uncacheable()
+
+        normalized = expression.sql(dialect=self._dialect, comments=False)
+        payload = json.dumps(
+            [normalized, parameters or {}, fetch == "one", self.db._schema], sort_keys=True, default=str
+        )
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        try:
+            return CacheKey(digest, {table: self._watermark(table) for table in tables})
+        except Exception as e:
+            # Without a data version the result could go stale, run the query uncached
+            print(f"Exception: {e}")
+            return self._uncacheable()
+
+    def _uncacheable(self) -> None:
+        with self._lock:
+            self._stats["uncacheable"] += 1
+        return None
+
+    # Data versions
+
+    def _quote(self, name: str) -> str:
+        return self.db._engine.dialect.identifier_preparer.quote(name)
+
+    def _qualified(self, name: str) -> str:
+        if self.db._schema:
+            return f"{self._quote(self.db._schema)}.{self._quote(name)}"
+        return self._quote(name)
+
+    def _watermark(self, table: str) -> Any:
+        """The table's data version, re-read at most every `watermark_seconds`."""
+        table = self.aliases.get(table, table)
+        with self._lock:
+            cached = self._watermarks.get(table)
+            if cached is not None and time.monotonic() - cached[1] < self.watermark_seconds:
+                return cached[0]
+        spec = self.watermark_specs.get(table) or {}
+        if spec.get("query"):
+            sql = spec["query"]
+        else:
+            columns = "COUNT(*)"
+            if spec.get("column"):
+                columns += f", MAX({self._quote(spec['column'])})"
+            sql = f"SELECT {columns} FROM {self._qualified(table)}"
+        # Read directly, not through the cache
+        rows = self.db._execute(sql, "all")
+        watermark = json.loads(json.dumps([list(row.values()) for row in rows], default=str))
+        with self._lock:
+            self._watermarks[table] = (watermark, time.monotonic())
+        return watermark
+
+    # Lookups
+
+    def get(self, key: CacheKey) -> Optional[Tuple[List[str], List[Dict[str, Any]]]]:
+        """The cached (columns, rows) of the key, None on a miss or if its tables changed."""
+        with self._lock:
+            payload = self._memory.get(key.digest)
+            if payload is not None:
+                self._memory.move_to_end(key.digest)
+                tier = "memory_hits"
+        if payload is None:
+            payload = self._read_disk(key.digest)
+            tier = "disk_hits"
+        if payload is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+
+        entry = pickle.loads(payload)
+        if entry["watermarks"] != key.watermarks:
+            self._drop(key.digest)
+            with self._lock:
+                self._stats["invalidations"] += 1
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._stats[tier] += 1
+            self._stats["bytes_saved"] += len(payload)
+        return entry["columns"], entry["rows"]
+
+    def put(self, key: CacheKey, columns: List[str], rows: List[Dict[str, Any]]) -> None:
+        try:
+            payload = pickle.dumps(
+                {"watermarks": key.watermarks, "columns": columns, "rows": rows}, pickle.HIGHEST_PROTOCOL
+            )
+            if len(payload) > self.max_entry_bytes:
+                return
+            if len(payload) > self.disk_threshold_bytes:
+                self._write_disk(key.digest, payload)
+            else:
+                with self._lock:
+                    self._memory_size -= len(self._memory.pop(key.digest, b""))
+                    self._memory[key.digest] = payload
+                    self._memory_size += len(payload)
+                    while self._memory_size > self.memory_bytes:
+                        _, evicted = self._memory.popitem(last=False)
+                        self._memory_size -= len(evicted)
+                        self._stats["evictions"] += 1
+            with self._lock:
+                self._stats["stores"] += 1
+        except Exception as e:
+            # The result was already returned, it is only not cached
+            print(f"Exception: {e}")
+
+    def recorder(self, key: CacheKey) -> _Recorder:
+        """Stores a streamed result once it has been read to the end."""
+        return _Recorder(self, key)
+
+    def _drop(self, digest: str) -> None:
+        with self._lock:
+            self._memory_size -= len(self._memory.pop(digest, b""))
+            if self._disk is not None and digest in self._disk:
+                self._disk_size -= self._disk.pop(digest)
+                self._remove_file(digest)
+
+    def invalidate(self) -> None:
+        """Drops every entry and forgets the data versions read so far."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            self._watermarks.clear()
+            for digest in list(self._disk_index()):
+                self._remove_file(digest)
+            self._disk.clear()
+            self._disk_size = 0
+
+    # Disk tier
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.pkl")
+
+    def _disk_index(self) -> "OrderedDict[str, int]":
+        """Digest -> size of the entries on disk, least recently used first. Called with the lock held."""
+        if self._disk is None:
+            self._disk = OrderedDict()
+            if self.cache_dir and os.path.isdir(self.cache_dir):
+                files = []
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith(".pkl"):
+                        stat = os.stat(os.path.join(self.cache_dir, name))
+                        files.append((stat.st_mtime, name[:-4], stat.st_size))
+                for _, digest, size in sorted(files):
+                    self._disk[digest] = size
+                    self._disk_size += size
+        return self._disk
+
+    def _remove_file(self, digest: str) -> None:
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _read_disk(self, digest: str) -> Optional[bytes]:
+        if not self.cache_dir:
+            return None
+        with self._lock:
+            if digest not in self._disk_index():
+                return None
+            self._disk.move_to_end(digest)
+        try:
+            with open(self._path(digest), "rb") as file:
+                payload = file.read()
+            # The modification time orders the entries for eviction in the next process
+            os.utime(self._path(digest))
+            return payload
+        except FileNotFoundError:
+            self._drop(digest)
+            return None
+
+    def _write_disk(self, digest: str, payload: bytes) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(payload)
+        os.replace(temporary, self._path(digest))
+        with self._lock:
+            disk = self._disk_index()
+            self._disk_size += len(payload) - disk.pop(digest, 0)
+            disk[digest] = len(payload)
+            while self._disk_size > self.disk_bytes and len(disk) > 1:
+                evicted, size = disk.popitem(last=False)
+                self._disk_size -= size
+                self._remove_file(evicted)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_size
+            stats["disk_entries"] = len(self._disk) if self._disk is not None else 0
+            stats["disk_bytes"] = self._disk_size
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_ratio"] = round(hits / (hits + stats["misses"]), 3) if hits + stats["misses"] else 0.0
+        return stats
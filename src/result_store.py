@@ -0,0 +1,261 @@
+"""
+Full results of the sessions' last queries, kept for follow-up questions.
+
+    store = ResultStore("retained_results", ttl_seconds=3600)
+    handle = store.retain(result_stream)  # before the stream is read
+    view = initial_view(rows_shown=5)
+    page = store.page(handle, view, limit=20)  # rows 6-25, page["view"] continues from there
+
+The rows of a query result are spilled, as they are streamed to the summary
+and the export, into a SQLite file of their own, so follow-ups are answered
+without the database or the LLM. A view over the result holds its filters
+(column equal to one of some values), its sort column and a keyset cursor: the
+sort key and row number of the last row shown, so each page is an index seek
+instead of an OFFSET scan. Results expire `ttl_seconds` after they were last
+read, and results over `max_rows` are not retained.
+"""
+# python native packages
+import datetime
+import decimal
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_STORE_DIR = "retained_results"
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_ROWS = 1_000_000
+DEFAULT_PAGE_SIZE = 20
+
+# Position of the row in the query result, the tie breaker of every sort
+ROW_COLUMN = "_result_row"
+# NULLs sort as an empty blob, after every number and text: last ascending and first descending, as in Postgres
+NULL_SORT_KEY = b""
+
+
+def initial_view(rows_shown: int = 0) -> Dict[str, Any]:
+    """The view of a freshly retained result, continuing after the rows the answer showed."""
+    return {"filters": {}, "order_by": None, "descending": False, "after": None, "after_row": rows_shown, "shown": rows_shown}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _columns(conn: sqlite3.Connection) -> List[str]:
+    return [row[1] for row in conn.execute("PRAGMA table_info(result)") if row[1] != ROW_COLUMN]
+
+
+def _storable(value: Any) -> Any:
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if isinstance(value, (datetime.date, datetime.time)):
+        # ISO strings sort like the dates they represent
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+class _SpillWriter:
+    """Writes the chunks of a streamed result into the handle's file, published once complete."""
+
+    def __init__(self, store: "ResultStore", handle: str):
+        self.store = store
+        self.handle = handle
+        self.path = store._path(handle) + ".tmp"
+        self.conn: Optional[sqlite3.Connection] = None
+        self.columns: Optional[List[str]] = None
+        self.rows = 0
+
+    def _create(self, columns: List[str]) -> None:
+        os.makedirs(self.store.directory, exist_ok=True)
+        # Written from whichever thread reads the stream, one at a time
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.columns = columns
+        definitions = ", ".join([f"{ROW_COLUMN} INTEGER PRIMARY KEY"] + [_quote(column) for column in columns])
+        self.conn.execute(f"CREATE TABLE result ({definitions})")
+
+    def add(self, chunk: List[Dict[str, Any]]) -> None:
+        if not chunk or self.rows < 0:
+            return
+        if self.conn is None:
+            self._create(list(chunk[0]))
+        if self.rows + len(chunk) > self.store.max_rows:
+            # Too large to retain, follow-ups go through the LLM
+            self.abandon()
+            return
+        placeholders = ", ".join("?" * (len(self.columns) + 1))
+        self.conn.executemany(
+            f"INSERT INTO result VALUES ({placeholders})",
+            (
+                [self.rows + i + 1] + [_storable(row.get(column)) for column in self.columns]
+                for i, row in enumerate(chunk)
+            ),
+        )
+        self.rows += len(chunk)
+
+    def finish(self, columns: List[str]) -> None:
+        if self.rows < 0:
+            return
+        if self.conn is None:
+            self._create(columns)
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.path, self.store._path(self.handle))
+
+    def abandon(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+        self.rows = -1
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ResultStore:
+    def __init__(
+        self,
+        directory: str = DEFAULT_STORE_DIR,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_rows: int = DEFAULT_MAX_ROWS,
+    ):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    def _path(self, handle: str) -> str:
+        return os.path.join(self.directory, f"{handle}.sqlite")
+
+    def retain(self, result) -> str:
+        """Spills the stream's rows as it is read, the handle is usable once the stream is exhausted."""
+        self.cleanup()
+        handle = uuid.uuid4().hex
+        result.add_recorder(_SpillWriter(self, handle))
+        return handle
+
+    def discard(self, handle: Optional[str]) -> None:
+        if handle:
+            for path in (self._path(handle), self._path(handle) + ".tmp"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def cleanup(self) -> None:
+        """Removes the expired results, at most once a minute."""
+        with self._lock:
+            if time.monotonic() - self._last_cleanup < 60 or not os.path.isdir(self.directory):
+                return
+            self._last_cleanup = time.monotonic()
+        expired_before = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < expired_before:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _connect(self, handle: Optional[str]) -> Iterator[Optional[sqlite3.Connection]]:
+        """The result's database, None if it was never completed or has expired."""
+        path = self._path(handle) if handle else None
+        if path is None or not os.path.exists(path) or os.path.getmtime(path) < time.time() - self.ttl_seconds:
+            yield None
+            return
+        # Reading the result extends its expiry
+        os.utime(path)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def columns(self, handle: Optional[str]) -> Optional[List[str]]:
+        with self._connect(handle) as conn:
+            if conn is None:
+                return None
+            return _columns(conn)
+
+    def columns_containing(self, handle: Optional[str], values: List[str]) -> List[str]:
+        """The columns holding each of `values`, compared case-insensitively."""
+        with self._connect(handle) as conn:
+            if conn is None:
+                return []
+            return [
+                column
+                for column in _columns(conn)
+                if all(
+                    conn.execute(f"SELECT 1 FROM result WHERE {_quote(column)} = ? COLLATE NOCASE LIMIT 1", (value,)).fetchone()
+                    for value in values
+                )
+            ]
+
+    def page(self, handle: Optional[str], view: Dict[str, Any], limit: int = DEFAULT_PAGE_SIZE) -> Optional[Dict[str, Any]]:
+        """
+        The next `limit` rows of the view, the number of rows it holds, and the
+        view advanced past the returned rows. None if the result is gone.
+        """
+        with self._connect(handle) as conn:
+            if conn is None:
+                return None
+            columns = _columns(conn)
+            where, parameters = [], []
+            for column, values in view["filters"].items():
+                if column not in columns:
+                    return None
+                where.append(f"{_quote(column)} COLLATE NOCASE IN ({', '.join('?' * len(values))})")
+                parameters += values
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM result {'WHERE ' + ' AND '.join(where) if where else ''}", parameters
+            ).fetchone()[0]
+
+            order_by = view.get("order_by")
+            if order_by is not None and order_by not in columns:
+                return None
+            if order_by is None:
+                if view.get("after_row") is not None:
+                    where.append(f"{ROW_COLUMN} > ?")
+                    parameters.append(view["after_row"])
+                order = ROW_COLUMN
+            else:
+                key = f"IFNULL({_quote(order_by)}, x'')"
+                # Backs the keyset seeks of the pages sorted by this column
+                self._index(handle, order_by)
+                if view.get("after_row") is not None:
+                    operator = "<" if view.get("descending") else ">"
+                    where.append(f"({key} {operator} ? OR ({key} = ? AND {ROW_COLUMN} > ?))")
+                    after = NULL_SORT_KEY if view.get("after") is None else view["after"]
+                    parameters += [after, after, view["after_row"]]
+                order = f"{key} {'DESC' if view.get('descending') else 'ASC'}, {ROW_COLUMN}"
+
+            selected = ", ".join([ROW_COLUMN] + [_quote(column) for column in columns])
+            sql = f"SELECT {selected} FROM result {'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY {order} LIMIT ?"
+            records = conn.execute(sql, parameters + [limit]).fetchall()
+
+        rows = [dict(zip(columns, record[1:])) for record in records]
+        advanced = dict(view, shown=view.get("shown", 0) + len(rows))
+        if records:
+            advanced["after_row"] = records[-1][0]
+            advanced["after"] = rows[-1][order_by] if order_by is not None else None
+        return {"columns": columns, "rows": rows, "total": total, "first": view.get("shown", 0) + 1, "view": advanced}
+
+    def _index(self, handle: str, column: str) -> None:
+        conn = sqlite3.connect(self._path(handle))
+        try:
+            name = "sort_" + "".join(char if char.isalnum() else "_" for char in column)
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {_quote(name)} ON result (IFNULL({_quote(column)}, x''), {ROW_COLUMN})"
+            )
+            conn.commit()
+        finally:
+            conn.close()
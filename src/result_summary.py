@@ -0,0 +1,99 @@
+# python native packages
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+# custom packages
+from models import ResultStream
+from utils import count_tokens
+
+DEFAULT_TOKEN_BUDGET = 1000
+DEFAULT_SAMPLE_ROWS = 10_000
+MAX_CELL_CHARS = 120
+TOP_VALUES = 3
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    text = " ".join(str(value).split())
+    return text if len(text) <= MAX_CELL_CHARS else text[: MAX_CELL_CHARS - 3] + "..."
+
+
+def column_stats(rows: List[Dict[str, Any]], column: str) -> str:
+    """One line of null / distinct counts plus min/max for dates and numbers or top values otherwise."""
+    values = [row.get(column) for row in rows]
+    present = [value for value in values if value is not None]
+    parts = [f"{len(values) - len(present)} nulls"]
+    if not present:
+        return f"- {column}: " + ", ".join(parts)
+
+    try:
+        parts.append(f"{len(set(present))} distinct")
+    except TypeError:
+        # Unhashable values, e.g. JSON columns
+        pass
+
+    if all(isinstance(value, (date, datetime)) for value in present) or all(
+        isinstance(value, (int, float, Decimal)) and not isinstance(value, bool) for value in present
+    ):
+        parts.append(f"min {_cell(min(present))}, max {_cell(max(present))}")
+    else:
+        top = Counter(_cell(value)[:40] for value in present).most_common(TOP_VALUES)
+        if top and top[0][1] > 1:
+            parts.append("top " + ", ".join(f"'{value}' ({count})" for value, count in top))
+
+    return f"- {column}: " + ", ".join(parts)
+
+
+class ResultSummarizer:
+    """
+    Builds the LLM-facing payload of a query result within a token budget:
+    row count, per-column statistics and as many rows as still fit, as a
+    header-once table instead of one dict per row.
+
+    Statistics are computed over at most `sample_rows` rows, which are buffered
+    in the stream, so the full result is still available to the exporter.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, sample_rows: int = DEFAULT_SAMPLE_ROWS):
+        self.token_budget = token_budget
+        self.sample_rows = sample_rows
+
+    def summarize(self, result: ResultStream) -> Dict[str, Any]:
+        """
+        Returns the payload `content`, the exact `row_count` (None when the result has
+        more than `sample_rows` rows) and `rows_shown`.
+        """
+        rows = result.preview(self.sample_rows + 1)
+        complete = len(rows) <= self.sample_rows
+        rows = rows[: self.sample_rows]
+        columns = result.columns or (list(rows[0].keys()) if rows else [])
+
+        if not rows:
+            return {"content": "The query returned no rows.", "row_count": 0, "rows_shown": 0}
+
+        row_count = len(rows) if complete else None
+        lines = [f"Rows: {len(rows)}" if complete else f"Rows: more than {self.sample_rows}"]
+
+        stats_scope = "all rows" if complete else f"the first {self.sample_rows} rows"
+        stats = [f"Column statistics over {stats_scope}:"] + [column_stats(rows, column) for column in columns]
+        # Statistics are dropped if they alone would use most of the budget
+        if len(rows) > 1 and count_tokens("\n".join(lines + stats)) < self.token_budget * 0.6:
+            lines += stats
+
+        header = " | ".join(columns)
+        used = count_tokens("\n".join(lines + [header])) + 10
+        table = []
+        for row in rows:
+            line = " | ".join(_cell(row.get(column)) for column in columns)
+            used += count_tokens(line) + 1
+            # At least one row is always shown
+            if table and used > self.token_budget:
+                break
+            table.append(line)
+
+        lines.append(f"Showing {len(table)} of {len(rows) if complete else 'more than ' + str(self.sample_rows)} rows:")
+        lines += [header] + table
+        return {"content": "\n".join(lines), "row_count": row_count, "rows_shown": len(table)}
@@ -0,0 +1,347 @@
+# python native packages
+import argparse
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# third party packages
+import sqlglot
+import yaml
+from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlglot import exp
+
+# custom packages
+from models import CustomSQLDatabase
+
+COUNT_COLUMN = "review_count"
+# How often the router re-checks which rollups are fresh
+DEFAULT_FRESHNESS_SECONDS = 60
+
+
+class Rollup(BaseModel):
+    """
+    A materialized view holding COUNT(*) of `table` grouped by `dimensions`.
+
+    `dimensions` maps each rollup column to the SQL expression it is computed
+    from, e.g. {"account_name": '"account_name"', "month": "date_trunc('month', \\"date\\")"}.
+    """
+
+    name: str
+    table: str
+    dimensions: Dict[str, str]
+    watermark_column: Optional[str] = None
+
+    @property
+    def definition_hash(self) -> str:
+        return hashlib.sha256(self.model_dump_json().encode("utf-8")).hexdigest()[:16]
+
+
+def read_rollups(filename: str) -> List[Rollup]:
+    """Reads the `rollups` section of the config. A dimension is a column name or a {name: expression} mapping."""
+    with open(filename, 'r') as file:
+        result = yaml.safe_load(file) or {}
+    rollups = []
+    for rollup in result.get('rollups') or []:
+        dimensions = {}
+        for dimension in rollup['dimensions']:
+            if isinstance(dimension, dict):
+                dimensions.update(dimension)
+            else:
+                dimensions[dimension] = f'"{dimension}"'
+        rollups.append(Rollup(
+            name=rollup['name'],
+            table=rollup['table'],
+            dimensions=dimensions,
+            watermark_column=rollup.get('watermark_column'),
+        ))
+    return rollups
+
+
+class RollupManager:
+    """
+    Creates and refreshes the declared rollups as Postgres materialized views.
+
+    Each view gets a unique index over its dimensions so it can be refreshed
+    concurrently, without blocking the agent's reads. The definition hash and
+    the base table watermark (row count, max of `watermark_column`) of the last
+    refresh are kept in the view's comment: a changed definition recreates the
+    view, an unchanged watermark skips the refresh. A `router` in the same process
+    re-checks the rollups' freshness after each create or refresh.
+    """
+
+    def __init__(self, db: CustomSQLDatabase, rollups: List[Rollup], router: Optional["RollupRouter"] = None):
+        self.db = db
+        self.rollups = rollups
+        self.router = router
+        self._quote = db._engine.dialect.identifier_preparer.quote
+
+    def _qualified(self, name: str) -> str:
+        if self.db._schema:
+            return f"{self._quote(self.db._schema)}.{self._quote(name)}"
+        return self._quote(name)
+
+    def _read_state(self, connection, rollup: Rollup) -> Optional[Dict[str, Any]]:
+        """The comment of the materialized view, None if the view does not exist."""
+        exists = connection.execute(
+            text("SELECT 1 FROM pg_matviews WHERE matviewname = :name AND schemaname = coalesce(:schema, current_schema())"),
+            {"name": rollup.name, "schema": self.db._schema},
+        ).first()
+        if exists is None:
+            return None
+        comment = connection.execute(
+            text("SELECT obj_description(CAST(:name AS regclass), 'pg_class')"),
+            {"name": self._qualified(rollup.name)},
+        ).scalar()
+        try:
+            return json.loads(comment) if comment else {}
+        except ValueError:
+            return {}
+
+    def _write_state(self, connection, rollup: Rollup, watermark: List[Any]) -> None:
+        state = json.dumps({"definition": rollup.definition_hash, "watermark": watermark}, default=str)
+        # COMMENT does not take bind parameters
+        literal = "'" + state.replace("'", "''") + "'"
+        connection.execute(text(f"COMMENT ON MATERIALIZED VIEW {self._qualified(rollup.name)} IS {literal}"))
+
+    def _watermark(self, connection, rollup: Rollup) -> List[Any]:
+        columns = "count(*)"
+        if rollup.watermark_column:
+            columns += f", max({self._quote(rollup.watermark_column)})"
+        row = connection.execute(text(f"SELECT {columns} FROM {self._qualified(rollup.table)}")).first()
+        return json.loads(json.dumps(list(row), default=str))
+
+    def _create(self, connection, rollup: Rollup) -> None:
+        select = ", ".join(f"{expression} AS {self._quote(name)}" for name, expression in rollup.dimensions.items())
+        group_by = ", ".join(str(i) for i in range(1, len(rollup.dimensions) + 1))
+        connection.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {self._qualified(rollup.name)}"))
+        connection.execute(text(
+            f"CREATE MATERIALIZED VIEW {self._qualified(rollup.name)} AS "
+            f"SELECT {select}, count(*) AS {COUNT_COLUMN} "
+            f"FROM {self._qualified(rollup.table)} GROUP BY {group_by}"
+        ))
+        # REFRESH ... CONCURRENTLY needs a unique index over plain columns
+        index_columns = ", ".join(self._quote(name) for name in rollup.dimensions)
+        connection.execute(text(
+            f"CREATE UNIQUE INDEX {self._quote(rollup.name + '_dimensions')} "
+            f"ON {self._qualified(rollup.name)} ({index_columns})"
+        ))
+
+    def create_missing(self) -> Dict[str, str]:
+        """Creates the missing rollups and recreates the ones whose definition changed."""
+        status = {}
+        for rollup in self.rollups:
+            with self.db._engine.begin() as connection:
+                state = self._read_state(connection, rollup)
+                if state is not None and state.get("definition") == rollup.definition_hash:
+                    status[rollup.name] = "exists"
+                    continue
+                watermark = self._watermark(connection, rollup)
+                self._create(connection, rollup)
+                self._write_state(connection, rollup, watermark)
+                status[rollup.name] = "created" if state is None else "recreated"
+        self.db.refresh_materialized_views()
+        if self.router is not None:
+            self.router.invalidate()
+        return status
+
+    def refresh(self, force: bool = False) -> Dict[str, str]:
+        """Refreshes the rollups whose base table changed since their last refresh."""
+        status = {}
+        for rollup in self.rollups:
+            # REFRESH ... CONCURRENTLY cannot run inside a transaction block
+            with self.db._engine.connect() as connection:
+                connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+                state = self._read_state(connection, rollup)
+                if state is None:
+                    status[rollup.name] = "missing"
+                    continue
+                watermark = self._watermark(connection, rollup)
+                if not force and state.get("watermark") == watermark:
+                    status[rollup.name] = "fresh"
+                    continue
+                connection.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {self._qualified(rollup.name)}"))
+                self._write_state(connection, rollup, watermark)
+                status[rollup.name] = "refreshed"
+        if self.router is not None:
+            self.router.invalidate()
+        return status
+
+
+def _expression_key(expression: exp.Expression) -> str:
+    """SQL of the expression without table qualifiers or identifier quoting, for matching."""
+
+    def strip(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.Column):
+            return exp.column(node.name.lower())
+        if isinstance(node, exp.Identifier):
+            return exp.to_identifier(node.name.lower())
+        return node
+
+    return expression.transform(strip).sql(dialect="postgres")
+
+
+class RollupRouter:
+    """
+    Rewrites COUNT(*) queries over a rollup's base table to read the rollup instead.
+
+    A query is routed when it selects from the base table alone (no joins,
+    subqueries, CTEs, windows or DISTINCT), its only aggregate is COUNT(*) and
+    every column it references is one of the rollup's dimensions, in the select
+    list, WHERE, GROUP BY, HAVING or ORDER BY. The smallest covering rollup is used
+    and COUNT(*) becomes the SUM of review_count. Anything else is left untouched.
+
+    Only fresh rollups are used: the base table watermark recorded at the
+    rollup's last refresh must equal the current one. After a data load, queries
+    read the base table until the rollup is refreshed. Freshness is re-checked
+    every `freshness_seconds`.
+    """
+
+    def __init__(self, db: CustomSQLDatabase, rollups: List[Rollup], freshness_seconds: float = DEFAULT_FRESHNESS_SECONDS):
+        self.db = db
+        self.freshness_seconds = freshness_seconds
+        # Fewest dimensions first, so the smallest covering rollup wins
+        self.rollups = sorted(rollups, key=lambda rollup: len(rollup.dimensions))
+        self._manager = RollupManager(db, self.rollups)
+        self._keys = {
+            rollup.name: {
+                _expression_key(sqlglot.parse_one(expression, read="postgres")): name
+                for name, expression in rollup.dimensions.items()
+            }
+            for rollup in self.rollups
+        }
+        self._lock = threading.Lock()
+        self._available: Optional[set] = None
+        self._checked_at = 0.0
+
+    def available(self) -> set:
+        """Names of the declared rollups that exist in the database and are up to date with their base table."""
+        with self._lock:
+            if self._available is None or time.monotonic() - self._checked_at >= self.freshness_seconds:
+                self._available = self._fresh()
+                self._checked_at = time.monotonic()
+            return self._available
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._available = None
+
+    def _fresh(self) -> set:
+        existing = self.db.refresh_materialized_views()
+        fresh = set()
+        watermarks = {}
+        try:
+            with self.db._engine.connect() as connection:
+                for rollup in self.rollups:
+                    if rollup.name not in existing:
+                        continue
+                    state = self._manager._read_state(connection, rollup)
+                    key = (rollup.table, rollup.watermark_column)
+                    if key not in watermarks:
+                        watermarks[key] = self._manager._watermark(connection, rollup)
+                    # A view without a recorded watermark was not built by the manager, its freshness is unknown
+                    if state and state.get("watermark") == watermarks[key]:
+                        fresh.add(rollup.name)
+        except SQLAlchemyError as e:
+            print(f"Exception: {e}")
+        return fresh
+
+    def route(self, query: str) -> Optional[str]:
+        """The query rewritten against a rollup, or None if no rollup can answer it."""
+        try:
+            statements = sqlglot.parse(query, read="postgres")
+        except sqlglot.errors.ParseError:
+            return None
+        if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+            return None
+        select = statements[0]
+        if (
+            select.args.get("joins")
+            or select.args.get("with")
+            or select.args.get("distinct")
+            or select.find(exp.Subquery, exp.Window, exp.Union)
+        ):
+            return None
+        tables = list(select.find_all(exp.Table))
+        if len(tables) != 1:
+            return None
+        aggregates = list(select.find_all(exp.AggFunc))
+        if not aggregates or not all(self._is_count_star(aggregate) for aggregate in aggregates):
+            return None
+
+        available = self.available()
+        for rollup in self.rollups:
+            if rollup.name not in available or tables[0].name.lower() != rollup.table.lower():
+                continue
+            rewritten = self._rewrite(select, rollup)
+            if rewritten is not None:
+                return rewritten.sql(dialect="postgres")
+        return None
+
+    @staticmethod
+    def _is_count_star(aggregate: exp.AggFunc) -> bool:
+        if not isinstance(aggregate, exp.Count) or aggregate.find(exp.Distinct):
+            return False
+        argument = aggregate.this
+        return isinstance(argument, exp.Star) or (isinstance(argument, exp.Literal) and not argument.is_string)
+
+    def _rewrite(self, select: exp.Select, rollup: Rollup) -> Optional[exp.Select]:
+        keys = self._keys[rollup.name]
+        aliases = {projection.alias.lower() for projection in select.expressions if isinstance(projection, exp.Alias)}
+
+        def replace(node: exp.Expression) -> exp.Expression:
+            if isinstance(node, exp.Count):
+                total = exp.Sum(this=exp.column(COUNT_COLUMN))
+                return exp.cast(exp.Coalesce(this=total, expressions=[exp.Literal.number(0)]), "bigint")
+            if isinstance(node, (exp.Column, exp.Func)) and not isinstance(node, exp.AggFunc):
+                dimension = keys.get(_expression_key(node))
+                if dimension is not None:
+                    return exp.column(dimension)
+            return node
+
+        rewritten = select.copy()
+        for key in ("expressions", "where", "group", "having", "order"):
+            value = rewritten.args.get(key)
+            if isinstance(value, list):
+                rewritten.set(key, [child.transform(replace) for child in value])
+            elif value is not None:
+                rewritten.set(key, value.transform(replace))
+
+        # Every column left must be a dimension, GROUP BY, HAVING and ORDER BY may also use output aliases
+        allowed = set(rollup.dimensions) | {COUNT_COLUMN}
+        for column in rewritten.find_all(exp.Column):
+            name = column.name.lower()
+            if column.table:
+                return None
+            if name not in allowed and not (name in aliases and column.find_ancestor(exp.Group, exp.Order, exp.Having)):
+                return None
+
+        table = rewritten.find(exp.Table)
+        table.set("this", exp.to_identifier(rollup.name))
+        return rewritten
+
+
+def main():
+    from settings import load_settings
+    from text2SQL_demo_code import AgentResources
+
+    parser = argparse.ArgumentParser(description="Create or refresh the rollup materialized views.")
+    parser.add_argument("command", choices=["create", "refresh"])
+    parser.add_argument("--force", action="store_true", help="Refresh even if the base table did not change")
+    args = parser.parse_args()
+
+    settings = load_settings()
+    manager = RollupManager(AgentResources(settings).db, read_rollups(settings.include_tables_yaml_filepath))
+    if args.command == "create":
+        status = manager.create_missing()
+    else:
+        status = manager.refresh(force=args.force)
+    for name, state in status.items():
+        print(f"{name}: {state}")
+
+
+if __name__ == "__main__":
+    main()
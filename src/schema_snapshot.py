@@ -0,0 +1,153 @@
+# python native packages
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# third party packages
+from langchain_community.utilities.sql_database import truncate_word
+from sqlalchemy import inspect, text
+
+# custom packages
+from models import CustomSQLDatabase
+
+DEFAULT_SNAPSHOT_PATH = "schema_snapshot.json"
+DEFAULT_SAMPLE_ROWS = 3
+# Bumped when the snapshot gains fields, so older files are rebuilt
+SNAPSHOT_VERSION = 2
+
+
+def _object_names(inspector, method: str, schema: Optional[str]) -> set:
+    try:
+        return set(getattr(inspector, method)(schema=schema))
+    except NotImplementedError:
+        # e.g. SQLite has no materialized views
+        return set()
+
+
+def _table_comment(inspector, table: str, schema: Optional[str]) -> Optional[str]:
+    try:
+        return inspector.get_table_comment(table, schema=schema).get("text")
+    except NotImplementedError:
+        return None
+
+
+def build_schema_snapshot(
+    db: CustomSQLDatabase,
+    tables: Optional[List[str]] = None,
+    sample_rows: int = DEFAULT_SAMPLE_ROWS,
+) -> Dict[str, Any]:
+    """
+    Introspects the given tables (defaults to the usable ones) once:
+    object kind (table, view, materialized view), comments, column names and
+    types, foreign keys and a few sample rows.
+    """
+    tables = sorted(tables or db.get_usable_table_names())
+    inspector = inspect(db._engine)
+    views = _object_names(inspector, "get_view_names", db._schema)
+    materialized_views = _object_names(inspector, "get_materialized_view_names", db._schema)
+    preparer = db._engine.dialect.identifier_preparer
+
+    snapshot_tables = []
+    for table in tables:
+        if table in materialized_views:
+            kind = "materialized view"
+        elif table in views:
+            kind = "view"
+        else:
+            kind = "table"
+
+        columns = [
+            {
+                "name": column["name"],
+                "type": str(column["type"]),
+                "nullable": column.get("nullable", True),
+                "comment": column.get("comment"),
+            }
+            for column in inspector.get_columns(table, schema=db._schema)
+        ]
+        foreign_keys = [
+            {
+                "columns": foreign_key["constrained_columns"],
+                "referred_table": foreign_key["referred_table"],
+                "referred_columns": foreign_key["referred_columns"],
+            }
+            for foreign_key in (inspector.get_foreign_keys(table, schema=db._schema) if kind == "table" else [])
+        ]
+
+        qualified_name = preparer.quote(table)
+        if db._schema:
+            qualified_name = f"{preparer.quote_schema(db._schema)}.{qualified_name}"
+        rows = []
+        if sample_rows:
+            with db._engine.connect() as connection:
+                result = connection.execute(text(f"SELECT * FROM {qualified_name} LIMIT {int(sample_rows)}"))
+                rows = [[truncate_word(str(value), length=100) for value in row] for row in result]
+
+        snapshot_tables.append(
+            {
+                "name": table,
+                "kind": kind,
+                "comment": _table_comment(inspector, table, db._schema),
+                "columns": columns,
+                "foreign_keys": foreign_keys,
+                "sample_rows": rows,
+            }
+        )
+
+    return {
+        "version": SNAPSHOT_VERSION,
+        "fingerprint": db.schema_fingerprint(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "schema": db._schema,
+        "tables": snapshot_tables,
+    }
+
+
+def load_schema_snapshot(
+    db: CustomSQLDatabase,
+    path: str = DEFAULT_SNAPSHOT_PATH,
+    sample_rows: int = DEFAULT_SAMPLE_ROWS,
+) -> Dict[str, Any]:
+    """
+    Returns the snapshot persisted at `path`, introspecting the database again
+    only when the schema fingerprint (or the snapshot format) has changed since it was written.
+    """
+    fingerprint = db.schema_fingerprint()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            snapshot = json.load(file)
+        if snapshot.get("fingerprint") == fingerprint and snapshot.get("version") == SNAPSHOT_VERSION:
+            return snapshot
+
+    snapshot = build_schema_snapshot(db, sample_rows=sample_rows)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(snapshot, file, indent=2, default=str)
+    return snapshot
+
+
+def format_schema_snapshot(snapshot: Dict[str, Any], tables: Optional[List[str]] = None) -> str:
+    """
+    Renders the snapshot in the CREATE TABLE + sample rows shape of `sql_db_schema`,
+    only for `tables` when given.
+    """
+    blocks = []
+    for table in snapshot["tables"]:
+        if tables is not None and table["name"] not in tables:
+            continue
+        column_lines = [f'\t"{column["name"]}" {column["type"]}' for column in table["columns"]]
+        column_lines += [
+            f'\tFOREIGN KEY({", ".join(foreign_key["columns"])}) '
+            f'REFERENCES "{foreign_key["referred_table"]}"({", ".join(foreign_key["referred_columns"])})'
+            for foreign_key in table.get("foreign_keys", [])
+        ]
+        column_lines = ",\n".join(column_lines)
+        block = f'{table["kind"].upper()} "{table["name"]}" (\n{column_lines}\n)'
+        if table.get("comment"):
+            block = f'-- {table["comment"]}\n{block}'
+        if table["sample_rows"]:
+            header = "\t".join(column["name"] for column in table["columns"])
+            rows = "\n".join("\t".join(row) for row in table["sample_rows"])
+            block += f'\n\n/*\n{len(table["sample_rows"])} rows from {table["name"]} table:\n{header}\n{rows}\n*/'
+        blocks.append(block)
+    return "\n\n".join(blocks)
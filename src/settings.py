@@ -0,0 +1,110 @@
+# python native packages
+from dotenv import load_dotenv
+
+# third party packages
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class AgentSettings(BaseSettings):
+    """
+    Agent configuration, each field is read from the environment variable
+    of the same name in upper case (e.g. db_host <- DB_HOST).
+    """
+
+    model_config = SettingsConfigDict(extra="ignore")
+
+    # Database
+    db_host: str = "localhost"
+    db_port: int = 5432
+    db_name: str = ""
+    db_user: str = ""
+    db_password: str = ""
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: int = 60000
+    include_tables_yaml_filepath: str = "agent/src/config.yaml"
+
+    # Query results
+    result_token_budget: int = 1000  # Token budget of the result summary shown to the LLM
+    result_sample_rows: int = 10_000  # Rows the summary statistics are computed over
+    history_token_budget: int = 8000  # Token budget of the message history sent to the model
+    stream_batch_size: int = 1000
+    export_dir: str = "exports"
+    export_format: str = "csv.gz"  # "csv.gz" | "parquet"
+
+    # Pre-execution guard for LLM written SQL
+    query_max_cost: float = 5_000_000  # Postgres planner cost units
+    query_row_limit: int = 100_000
+    query_statement_timeout_ms: int = 30_000
+    sql_validation_enabled: bool = True  # Check tables, columns and literal types against the schema snapshot first
+    query_gen_max_turns: int = 8  # Model turns per question before it is told no query could be written
+    tool_max_workers: int = 4  # Tool calls of one model turn run concurrently, keep it within the db pool size
+    tool_call_timeout_seconds: float = 60  # Per tool call, also caps the query statement timeout
+    rollup_freshness_seconds: float = 60  # How often the rollups are checked against their base table's watermark
+    query_log_path: str = "query_log.jsonl"  # Executed SQL and runtimes for the index advisor, "" disables it
+    fast_path_enabled: bool = True  # Answer the common question shapes from SQL templates, without the LLM
+    entity_index_refresh_seconds: int = 3600  # How often the resolve_entities tool re-reads the distinct names
+    follow_up_enabled: bool = True  # "show me the next 20", "only the ones from Germany" answered from the last result
+    follow_up_page_size: int = 20
+    retained_result_dir: str = "retained_results"  # Complete result of each session's last query, for follow-ups
+    retained_result_ttl_seconds: int = 3600  # Since it was last read
+    retained_result_max_rows: int = 1_000_000
+
+    # Caches
+    sql_cache_path: str = "sql_cache.sqlite"
+    sql_cache_max_entries: int = 1000
+    sql_cache_ttl_seconds: int = 7 * 24 * 3600
+    schema_snapshot_path: str = "schema_snapshot.json"
+    table_top_k: int = 5  # Tables (plus their foreign key neighbours) shown to the model per question, 0 shows all
+    few_shot_path: str = "few_shot.sqlite"  # Answered (question, SQL) pairs retrieved as prompt examples
+    few_shot_k: int = 3  # Examples added to the prompt, 0 disables them
+    few_shot_max_examples: int = 2000
+    few_shot_min_similarity: float = 0.3
+    result_cache_enabled: bool = True  # Query results reused until the tables they read change
+    result_cache_memory_bytes: int = 64 * 2 ** 20
+    result_cache_dir: str = "result_cache"  # Results over the threshold are kept here across runs, "" keeps them in memory
+    result_cache_disk_threshold_bytes: int = 2 ** 20
+    result_cache_disk_bytes: int = 2 ** 30
+    result_cache_watermark_seconds: int = 300  # How often the tables' data versions are re-read
+
+    # Sessions
+    checkpointer: str = "none"  # "memory" | "sqlite" | "none", with a checkpointer every invocation needs a thread_id
+    checkpoint_path: str = "checkpoints.sqlite"
+
+    # Tracing
+    tracing_enabled: bool = False
+    trace_path: str = "traces.jsonl"  # Finished spans as JSON lines, "" disables the file
+    metrics_port: int = 0  # Prometheus text endpoint on :port/metrics, 0 disables it
+
+    # Vertex AI
+    gcp_project: str = "voice-of-customer-ai-194353"
+    gcp_location: str = "us-central1"
+    gemini_model: str = "gemini-2.5-pro"
+    vertex_requests_per_minute: float = 60
+    vertex_max_burst: float = 5
+
+    @property
+    def db_url(self) -> str:
+        return f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
+
+    @property
+    def async_db_url(self) -> str:
+        return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
+
+    @property
+    def pool_settings(self) -> dict:
+        return dict(
+            pool_size=self.db_pool_size,
+            max_overflow=self.db_max_overflow,
+            pool_recycle=self.db_pool_recycle,
+            pool_pre_ping=self.db_pool_pre_ping,
+            statement_timeout_ms=self.db_statement_timeout_ms,
+        )
+
+
+def load_settings(**overrides) -> AgentSettings:
+    """Loads .env into the environment and builds the settings, `overrides` take precedence."""
+    load_dotenv()
+    return AgentSettings(**overrides)
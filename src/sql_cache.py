@@ -0,0 +1,125 @@
+# python native packages
+import hashlib
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+DEFAULT_CACHE_PATH = "sql_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+
+def normalize_question(question: str) -> str:
+    """Folds case, punctuation and whitespace so that trivially different phrasings share a key."""
+    question = question.lower()
+    question = re.sub(r"[^\w\s]", " ", question)
+    return " ".join(question.split())
+
+
+class SQLCache:
+    """
+    On-disk question -> SQL cache backed by SQLite.
+
+    Entries are keyed by the normalized question and the schema fingerprint of
+    the included tables, so a schema change never serves SQL written for the old
+    schema. Entries expire after `ttl_seconds` and the least recently used ones
+    are evicted once there are more than `max_entries`.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: int = DEFAULT_TTL_SECONDS,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sql_cache (
+                    question_key TEXT NOT NULL,
+                    fingerprint  TEXT NOT NULL,
+                    question     TEXT NOT NULL,
+                    sql          TEXT NOT NULL,
+                    created_at   REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    PRIMARY KEY (question_key, fingerprint)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sql_cache_last_used ON sql_cache (last_used_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per call keeps the cache usable from any thread
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+    def get(self, question: str, fingerprint: str) -> Optional[str]:
+        now = time.time()
+        key = self._key(question)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT sql, created_at FROM sql_cache WHERE question_key = ? AND fingerprint = ?",
+                (key, fingerprint),
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute(
+                        "DELETE FROM sql_cache WHERE question_key = ? AND fingerprint = ?", (key, fingerprint)
+                    )
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE sql_cache SET last_used_at = ? WHERE question_key = ? AND fingerprint = ?",
+                (now, key, fingerprint),
+            )
+        self.hits += 1
+        return row[0]
+
+    def put(self, question: str, fingerprint: str, sql: str) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sql_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(question), fingerprint, question, sql, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM sql_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            """
+            DELETE FROM sql_cache WHERE rowid IN (
+                SELECT rowid FROM sql_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def invalidate(self, fingerprint: str) -> int:
+        """Drops every entry written against a schema other than `fingerprint`."""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM sql_cache WHERE fingerprint != ?", (fingerprint,)).rowcount
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,173 @@
+# python native packages
+import json
+import re
+from typing import Any, Dict, Optional
+
+# third party packages
+import sqlglot
+from sqlalchemy.exc import SQLAlchemyError
+from sqlglot import exp
+
+# custom packages
+from models import CustomSQLDatabase
+
+DEFAULT_MAX_COST = 5_000_000
+DEFAULT_ROW_LIMIT = 100_000
+DEFAULT_STATEMENT_TIMEOUT_MS = 30_000
+
+READ_ONLY_FIRST_KEYWORDS = {"select", "with", "values", "table"}
+# Statements that may appear after a leading SELECT/WITH, e.g. data-modifying CTEs
+WRITE_KEYWORDS = {
+    "insert", "update", "delete", "merge", "drop", "create", "alter", "truncate",
+    "grant", "revoke", "copy", "call", "vacuum", "refresh", "reindex", "cluster",
+}
+
+# Comments, quoted identifiers and string literals, removed before looking at keywords
+_NON_CODE = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\$\$.*?\$\$", re.DOTALL)
+_TRAILING_LIMIT = re.compile(
+    r"\blimit\s+(\d+|all)(\s+offset\s+\d+)?\s*$|\boffset\s+\d+\s+limit\s+(\d+|all)\s*$",
+    re.IGNORECASE,
+)
+
+
+class QueryRejected(Exception):
+    """Raised for a query the guard will not execute, `message` is meant for the LLM."""
+
+    def __init__(self, reason: str, hint: str, **details):
+        self.reason = reason
+        self.hint = hint
+        self.details = details
+        super().__init__(self.message)
+
+    @property
+    def message(self) -> str:
+        return "Error: " + json.dumps(
+            {"error": "query_rejected", "reason": self.reason, **self.details, "hint": self.hint},
+            default=str,
+        )
+
+
+def strip_sql(query: str) -> str:
+    return query.strip().rstrip(";").strip()
+
+
+def code_only(query: str) -> str:
+    """
+    The query with comments and literals blanked out, so keywords inside strings are not matched.
+    Offsets are preserved, positions found in the result are valid in the original query.
+    """
+    return _NON_CODE.sub(lambda match: " " * len(match.group(0)), query)
+
+
+def check_read_only(query: str) -> None:
+    """Mechanical version of the 'no DML statements' rule of QUERY_GEN_SYSTEM."""
+    code = code_only(query).lower()
+    if ";" in code:
+        raise QueryRejected("multiple_statements", "Send a single SELECT statement without ';' separators.")
+
+    words = re.findall(r"[a-z_]+", code)
+    if not words or words[0] not in READ_ONLY_FIRST_KEYWORDS:
+        raise QueryRejected("not_read_only", "Only SELECT (or WITH ... SELECT) queries are allowed.")
+
+    forbidden = sorted(WRITE_KEYWORDS.intersection(words))
+    if forbidden:
+        raise QueryRejected(
+            "not_read_only",
+            "Only SELECT (or WITH ... SELECT) queries are allowed.",
+            forbidden_keywords=forbidden,
+        )
+
+
+def _top_level_fetch(query: str) -> Optional[exp.Fetch]:
+    """The statement's FETCH FIRST / NEXT clause, a second limit clause after it is a syntax error."""
+    if not re.search(r"\bfetch\b", code_only(query), re.IGNORECASE):
+        return None
+    try:
+        statement = sqlglot.parse_one(query, read="postgres")
+    except sqlglot.errors.ParseError:
+        return None
+    limit = statement.args.get("limit")
+    return limit if isinstance(limit, exp.Fetch) else None
+
+
+def apply_row_limit(query: str, row_limit: int) -> str:
+    """Appends `LIMIT row_limit`, or tightens a trailing LIMIT or FETCH FIRST that is larger."""
+    match = _TRAILING_LIMIT.search(code_only(query))
+    if not match:
+        fetch = _top_level_fetch(query)
+        if fetch is None:
+            return f"{query}\nLIMIT {row_limit}"
+        count = fetch.args.get("count")
+        # FETCH FIRST ROW ONLY is one row, a non literal count is left to the database
+        if count is None or not isinstance(count, exp.Literal) or int(count.this) <= row_limit:
+            return query
+        fetch.set("count", exp.Literal.number(row_limit))
+        return fetch.root().sql(dialect="postgres")
+
+    current = match.group(1) or match.group(3)
+    if current.lower() != "all" and int(current) <= row_limit:
+        return query
+    start, end = match.span(1) if match.group(1) else match.span(3)
+    return f"{query[:start]}{row_limit}{query[end:]}"
+
+
+class QueryGuard:
+    """
+    Pre-execution stage for LLM written SQL: enforces read-only single statements,
+    rejects queries whose planner cost is over `max_cost` and caps the number of
+    returned rows. The statement timeout is applied by the caller when executing.
+    With a `validator` (see sql_validator.SQLValidator), queries naming unknown
+    tables or columns, or comparing them with the wrong types, are rejected
+    before they reach the database.
+    """
+
+    def __init__(
+        self,
+        db: CustomSQLDatabase,
+        max_cost: float = DEFAULT_MAX_COST,
+        row_limit: Optional[int] = DEFAULT_ROW_LIMIT,
+        statement_timeout_ms: Optional[int] = DEFAULT_STATEMENT_TIMEOUT_MS,
+        validator=None,
+    ):
+        self.db = db
+        self.max_cost = max_cost
+        self.row_limit = row_limit
+        self.statement_timeout_ms = statement_timeout_ms
+        self.validator = validator
+
+    def prepare(self, query: str) -> Dict[str, Any]:
+        """
+        Returns the query to execute with the planner's estimates and the row
+        limit it was given (None if the query's own limit is lower), or raises
+        QueryRejected with a message the model can act on.
+        """
+        query = strip_sql(query)
+        check_read_only(query)
+        if self.validator is not None:
+            self.validator.validate(query)
+
+        estimate = {"estimated_rows": None, "estimated_cost": None}
+        if self.db.dialect == "postgresql":
+            try:
+                plan = self.db.explain(query)
+            except SQLAlchemyError:
+                # Let the execution report the actual database error
+                plan = None
+            if plan:
+                estimate = {"estimated_rows": plan.get("Plan Rows"), "estimated_cost": plan.get("Total Cost")}
+                if self.max_cost and estimate["estimated_cost"] > self.max_cost:
+                    raise QueryRejected(
+                        "estimated_cost_too_high",
+                        "Add selective WHERE filters (e.g. a date range, product or account), "
+                        "aggregate with GROUP BY, or avoid joins without a join condition.",
+                        max_cost=self.max_cost,
+                        **estimate,
+                    )
+
+        # Set when the guard's limit bounds the result, which then may not be complete
+        row_limit = None
+        if self.row_limit:
+            limited = apply_row_limit(query, self.row_limit)
+            if limited != query:
+                query, row_limit = limited, self.row_limit
+        return {"query": query, "row_limit": row_limit, **estimate}
@@ -0,0 +1,425 @@
+"""
+Static checks of LLM written SQL against the schema snapshot, without the database.
+
+    validator = SQLValidator(snapshot)
+    validator.validate('SELECT "Account name" FROM qualtrics_enriched_data')
+    # QueryRejected: unknown_column, with the closest existing column as the fix
+
+The query is parsed as PostgreSQL with sqlglot and checked for:
+- MySQL / SQL Server habits Postgres rejects: backticks, single quoted aliases,
+  TOP n, LIMIT offset, count and functions such as IFNULL or DATE_FORMAT
+- syntax errors, reported with the position of the unexpected token
+- statements other than a single read-only SELECT
+- unknown tables and columns, per scope, so CTEs, subqueries, table aliases and
+  output aliases in ORDER BY / GROUP BY resolve like they do in Postgres
+- comparisons of a column with a literal of the wrong type: non ISO date
+  literals, numbers compared with text and LIKE on non-text columns
+
+Every problem found is returned at once, each with a fix the model can apply.
+"""
+# python native packages
+import difflib
+import re
+import threading
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+
+# third party packages
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, SqlglotError, TokenError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+from sqlglot.tokens import TokenType
+
+# custom packages
+from sql_guard import QueryRejected, code_only
+
+DIALECT = "postgres"
+
+# Functions of other dialects -> their Postgres replacement
+FOREIGN_FUNCTIONS = {
+    "IFNULL": "COALESCE(value, fallback)",
+    "ISNULL": "COALESCE(value, fallback)",
+    "NVL": "COALESCE(value, fallback)",
+    "DATE_FORMAT": "to_char(date, 'YYYY-MM')",
+    "STR_TO_DATE": "to_date(text, 'DD-MM-YYYY')",
+    "DATEDIFF": "date1 - date2 (days) or age(date1, date2)",
+    "DATEADD": "date + INTERVAL '1 month'",
+    "GETDATE": "CURRENT_DATE or now()",
+    "SYSDATE": "CURRENT_DATE or now()",
+    "CURDATE": "CURRENT_DATE",
+    "YEAR": "EXTRACT(YEAR FROM date)",
+    "MONTH": "EXTRACT(MONTH FROM date)",
+    "DAY": "EXTRACT(DAY FROM date)",
+    "GROUP_CONCAT": "string_agg(value, ', ')",
+    "LEN": "length(text)",
+    "CHARINDEX": "strpos(text, substring)",
+}
+TEMPORAL_TYPES = ("DATE", "TIME", "INTERVAL")
+NUMERIC_TYPES = ("INT", "NUMERIC", "DECIMAL", "FLOAT", "REAL", "DOUBLE", "SERIAL", "MONEY")
+TEXT_TYPES = ("CHAR", "TEXT", "STRING", "CITEXT", "UUID", "NAME")
+# Date input strings Postgres accepts besides ISO dates
+SPECIAL_DATE_LITERALS = {"now", "today", "tomorrow", "yesterday", "infinity", "-infinity", "epoch", "allballs"}
+
+_ISO_DATETIME = re.compile(
+    r"^(?P<date>\d{4}-\d{2}-\d{2})(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:\s*(?:Z|[+-]\d{2}(?::?\d{2})?))?$"
+)
+_DAY_FIRST_DATE = re.compile(r"^(?P<day>\d{1,2})[-/.](?P<month>\d{1,2})[-/.](?P<year>\d{4})$")
+# sqlglot describes tokens by their repr, the model only needs the text
+_TOKEN_REPR = re.compile(r"<Token token_type: [\w.]+, text: (.*?), line: .*?>")
+_NUMBER = re.compile(r"^\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?\s*$", re.IGNORECASE)
+
+
+def type_category(column_type: str) -> Optional[str]:
+    """"temporal", "numeric" or "text" for a type name of the snapshot, None for any other type."""
+    upper = column_type.upper()
+    if upper.startswith("INTERVAL"):
+        return None
+    for category, names in (("temporal", TEMPORAL_TYPES), ("numeric", NUMERIC_TYPES), ("text", TEXT_TYPES)):
+        if any(name in upper for name in names):
+            return category
+    return None
+
+
+def _identifier(node: exp.Expression) -> str:
+    """The name Postgres looks up: unquoted identifiers are folded to lower case."""
+    if isinstance(node, exp.Identifier) and not node.quoted:
+        return node.name.lower()
+    return node.name
+
+
+def _closest(name: str, candidates: List[str]) -> List[str]:
+    by_folded = {candidate.casefold(): candidate for candidate in candidates}
+    exact = by_folded.get(name.casefold())
+    if exact is not None:
+        return [exact]
+    words = re.sub(r"[_\W]+", "_", name.casefold()).strip("_")
+    if words in by_folded:
+        return [by_folded[words]]
+    return difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+
+
+def _quoted(name: str) -> str:
+    return name if re.fullmatch(r"[a-z_][a-z0-9_$]*", name) else '"' + name.replace('"', '""') + '"'
+
+
+class SQLValidator:
+    """
+    Validates queries against the tables and columns of a schema snapshot.
+    `extra_tables` exist without being in the snapshot, e.g. the rollups queries
+    are routed to, their columns are not checked.
+    """
+
+    def __init__(self, snapshot: Dict[str, Any], extra_tables: Iterable[str] = ()):
+        self.schema = snapshot.get("schema")
+        self.tables: Dict[str, Optional[Dict[str, str]]] = {
+            table["name"]: {column["name"]: column["type"] for column in table["columns"]}
+            for table in snapshot["tables"]
+        }
+        for table in extra_tables:
+            self.tables.setdefault(table, None)
+        self._lock = threading.Lock()
+        self._stats = {"checked": 0, "rejected": 0, "by_reason": {}}
+
+    def validate(self, query: str) -> None:
+        """Raises QueryRejected listing every problem found, with a fix for each."""
+        problems = self.problems(query)
+        with self._lock:
+            self._stats["checked"] += 1
+            if problems:
+                self._stats["rejected"] += 1
+                by_reason = self._stats["by_reason"]
+                by_reason[problems[0]["reason"]] = by_reason.get(problems[0]["reason"], 0) + 1
+        if problems:
+            raise QueryRejected(
+                problems[0]["reason"],
+                "Fix every problem listed, then run the corrected query.",
+                problems=[{"problem": problem["problem"], "fix": problem["fix"]} for problem in problems],
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, by_reason=dict(self._stats["by_reason"]))
+
+    def problems(self, query: str) -> List[Dict[str, str]]:
+        problems = self._dialect_problems(query)
+        if problems:
+            # Parsing would only report the same mistakes less clearly
+            return problems
+        try:
+            expressions = [expression for expression in sqlglot.parse(query, read=DIALECT) if expression is not None]
+        except ParseError as e:
+            error = e.errors[0] if e.errors else {}
+            near = (error.get("start_context", "")[-30:] + error.get("highlight", "")).strip()
+            description = _TOKEN_REPR.sub(lambda match: match.group(1), str(error.get("description", e)))
+            return [_problem(
+                "syntax_error",
+                f"Syntax error at line {error.get('line')}, column {error.get('col')}, near \"{near}\": {description}.",
+                "Correct the SQL syntax there, following PostgreSQL.",
+            )]
+        except (TokenError, SqlglotError) as e:
+            return [_problem("syntax_error", f"The query could not be read: {e}", "Correct the SQL syntax, following PostgreSQL.")]
+
+        if len(expressions) != 1:
+            return [_problem("multiple_statements", "The query holds several statements.", "Send a single SELECT statement.")]
+        expression = expressions[0]
+        if not isinstance(expression, (exp.Select, exp.SetOperation)) or expression.find(
+            exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Command
+        ):
+            return [_problem("not_read_only", "Only SELECT (or WITH ... SELECT) queries are allowed.", "Rewrite it as a single SELECT.")]
+
+        problems = []
+        column_types: Dict[int, str] = {}
+        checked = set()
+        for scope in traverse_scope(expression):
+            problems += self._scope_problems(scope, column_types, checked)
+        # Only the resolved columns have types
+        problems += self._type_problems(expression, column_types)
+        return problems
+
+    # Dialect
+
+    def _dialect_problems(self, query: str) -> List[Dict[str, str]]:
+        problems = []
+        if "`" in code_only(query):
+            problems.append(_problem(
+                "wrong_quoting",
+                "Backticks are not identifier quotes in PostgreSQL.",
+                'Quote identifiers with double quotes, e.g. "Account name", or leave lower case names unquoted.',
+            ))
+        try:
+            tokens = sqlglot.tokenize(query, read=DIALECT)
+        except (TokenError, SqlglotError):
+            return problems
+        for previous, token, following in zip([None] + tokens[:-1], tokens, tokens[1:] + [None]):
+            text = token.text.upper()
+            if token.token_type == TokenType.ALIAS and following is not None and following.token_type == TokenType.STRING:
+                problems.append(_problem(
+                    "wrong_quoting",
+                    f"The alias '{following.text}' is in single quotes, which make a string value.",
+                    f'Quote aliases with double quotes: AS "{following.text}".',
+                ))
+            elif text == "TOP" and previous is not None and previous.token_type in (TokenType.SELECT, TokenType.DISTINCT):
+                problems.append(_problem("wrong_dialect", "PostgreSQL has no SELECT TOP n.", "Use LIMIT n at the end of the query."))
+            elif token.token_type == TokenType.LIMIT and following is not None:
+                index = tokens.index(following)
+                if following.token_type == TokenType.NUMBER and index + 1 < len(tokens) and tokens[index + 1].token_type == TokenType.COMMA:
+                    problems.append(_problem(
+                        "wrong_dialect", "PostgreSQL has no LIMIT offset, count.", "Use LIMIT count OFFSET offset."
+                    ))
+            elif text in FOREIGN_FUNCTIONS and following is not None and following.token_type == TokenType.L_PAREN and (
+                previous is None or previous.token_type != TokenType.DOT
+            ):
+                problems.append(_problem(
+                    "wrong_dialect", f"PostgreSQL has no {text}() function.", f"Use {FOREIGN_FUNCTIONS[text]} instead."
+                ))
+            elif token.token_type == TokenType.EQ and following is not None and following.token_type == TokenType.EQ:
+                problems.append(_problem("wrong_dialect", "PostgreSQL compares with =, not ==.", "Replace == with =."))
+        return problems
+
+    # Tables and columns
+
+    def _scope_problems(self, scope: Scope, column_types: Dict[int, str], checked: set) -> List[Dict[str, str]]:
+        problems = []
+        for source in scope.sources.values():
+            if not isinstance(source, exp.Table) or not isinstance(source.this, exp.Identifier):
+                # Derived tables and CTEs are their own scopes, table functions have no fixed columns
+                continue
+            name = _identifier(source.this)
+            schema = _identifier(source.args["db"]) if source.args.get("db") else None
+            if name in self.tables and (schema is None or self.schema is None or schema == self.schema):
+                continue
+            suggestions = _closest(name, list(self.tables))
+            problems.append(_problem(
+                "unknown_table",
+                f'The table "{source.sql(dialect=DIALECT)}" does not exist.',
+                f"Use {' or '.join(_quoted(table) for table in suggestions)}." if suggestions
+                else f"The tables are: {', '.join(_quoted(table) for table in self.tables)}.",
+            ))
+
+        select_aliases = set()
+        if isinstance(scope.expression, exp.Select):
+            select_aliases = {_identifier(select.args["alias"]) for select in scope.expression.expressions if select.args.get("alias")}
+        for column in scope.columns:
+            # Inner scopes come first, an outer scope also lists the columns its subqueries take from it
+            if isinstance(column.this, exp.Star) or id(column) in checked:
+                continue
+            checked.add(id(column))
+            problem = self._column_problem(scope, column, select_aliases, column_types)
+            if problem is not None:
+                problems.append(problem)
+        return problems
+
+    def _source_columns(self, source: Any) -> Optional[Dict[str, Optional[str]]]:
+        """Column -> type of a scope's source, None when its columns are unknown."""
+        if isinstance(source, exp.Table):
+            if not isinstance(source.this, exp.Identifier):
+                return None
+            return self.tables.get(_identifier(source.this))
+        if isinstance(source, Scope) and isinstance(source.expression, (exp.Select, exp.SetOperation)):
+            selects = source.expression.selects
+            if not selects or any(select.is_star for select in selects):
+                return None
+            return {_identifier(select.args["alias"]) if select.args.get("alias") else select.alias_or_name: None for select in selects}
+        return None
+
+    def _column_problem(
+        self, scope: Scope, column: exp.Column, select_aliases: set, column_types: Dict[int, str]
+    ) -> Optional[Dict[str, str]]:
+        name = _identifier(column.this)
+        if column.table:
+            table = _identifier(column.args["table"])
+            source = None
+            # Correlated subqueries may refer to the outer query's tables
+            outer: Optional[Scope] = scope
+            while outer is not None and source is None:
+                source = outer.sources.get(table)
+                outer = outer.parent
+            if source is None:
+                aliases = list(scope.sources)
+                return _problem(
+                    "unknown_table",
+                    f'"{table}" in {column.sql(dialect=DIALECT)} is not a table or alias of the query.',
+                    f"Refer to one of: {', '.join(aliases)}." if aliases else "Add the table to the FROM clause.",
+                )
+            sources = [source]
+        else:
+            sources = []
+            outer = scope
+            while outer is not None:
+                sources += [source for _, source in outer.selected_sources.values()]
+                outer = outer.parent
+
+        known: Dict[str, Optional[str]] = {}
+        for source in sources:
+            columns = self._source_columns(source)
+            if columns is None:
+                # A source with unknown columns could hold it
+                return None
+            if name in columns:
+                if columns[name] is not None:
+                    column_types[id(column)] = columns[name]
+                return None
+            known.update(columns)
+
+        if not column.table and name in select_aliases:
+            if column.find_ancestor(exp.Order, exp.Group) is not None:
+                return None
+            return _problem(
+                "alias_in_where",
+                f'The output alias "{name}" cannot be used in {"HAVING" if column.find_ancestor(exp.Having) else "WHERE"}.',
+                "Repeat the expression the alias names instead of the alias.",
+            )
+
+        comparison = column.parent if isinstance(column.parent, (exp.EQ, exp.NEQ)) else None
+        if column.this.quoted and comparison is not None and isinstance(comparison.left, exp.Column) and isinstance(comparison.right, exp.Column):
+            return _problem(
+                "wrong_quoting",
+                f'"{column.this.name}" is in double quotes, which name a column.',
+                f"Write values in single quotes: '{column.this.name}'.",
+            )
+        suggestions = _closest(name, list(known))
+        if suggestions:
+            fix = f"Use {' or '.join(_quoted(suggestion) for suggestion in suggestions)}."
+            if column.this.quoted and suggestions[0].casefold() == name.casefold().replace(" ", "_"):
+                fix += " Output titles such as \"Account name\" are aliases: select the column AS the title."
+        else:
+            fix = f"The columns are: {', '.join(_quoted(name) for name in list(known)[:40])}."
+        where = f' in "{_identifier(column.args["table"])}"' if column.table else ""
+        return _problem("unknown_column", f'The column "{name}" does not exist{where}.', fix)
+
+    # Types
+
+    def _type_problems(self, expression: exp.Expression, column_types: Dict[int, str]) -> List[Dict[str, str]]:
+        problems = []
+
+        def category(node: exp.Expression) -> Optional[str]:
+            return type_category(column_types[id(node)]) if id(node) in column_types else None
+
+        for node in expression.find_all(exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between, exp.In, exp.Like, exp.ILike):
+            if isinstance(node, (exp.Between, exp.In)):
+                column, literals = node.this, (
+                    [node.args["low"], node.args["high"]] if isinstance(node, exp.Between) else node.expressions
+                )
+            elif isinstance(node.right, exp.Column) and not isinstance(node.left, exp.Column):
+                column, literals = node.right, [node.left]
+            else:
+                column, literals = node.left, [node.right]
+            column_category = category(column)
+            if column_category is None:
+                continue
+            if isinstance(node, (exp.Like, exp.ILike)):
+                if column_category != "text":
+                    problems.append(_problem(
+                        "type_mismatch",
+                        f"LIKE needs text, {column.sql(dialect=DIALECT)} is a {column_category} column.",
+                        f"Compare with a range, e.g. {column.sql(dialect=DIALECT)} >= '2024-01-01' AND "
+                        f"{column.sql(dialect=DIALECT)} < '2024-02-01', or cast it: {column.sql(dialect=DIALECT)}::text."
+                        if column_category == "temporal" else f"Cast it: {column.sql(dialect=DIALECT)}::text.",
+                    ))
+                continue
+            for literal in literals:
+                problem = self._literal_problem(column, column_category, literal)
+                if problem is not None:
+                    problems.append(problem)
+
+        # DATE '...' and CAST('...' AS DATE) must be valid dates too
+        for cast in expression.find_all(exp.Cast):
+            if isinstance(cast.this, exp.Literal) and cast.this.is_string and type_category(cast.to.sql(dialect=DIALECT)) == "temporal":
+                problem = _date_literal_problem(cast.this.this, cast.sql(dialect=DIALECT))
+                if problem is not None:
+                    problems.append(problem)
+        return problems
+
+    def _literal_problem(self, column: exp.Column, column_category: str, literal: exp.Expression) -> Optional[Dict[str, str]]:
+        if isinstance(literal, exp.Neg):
+            literal = literal.this
+        if not isinstance(literal, exp.Literal):
+            return None
+        name = column.sql(dialect=DIALECT)
+        if column_category == "temporal":
+            if not literal.is_string:
+                return _problem(
+                    "type_mismatch",
+                    f"{name} is a date column compared with the number {literal.this}.",
+                    f"Compare it with a date literal such as '2024-01-31', or use EXTRACT(YEAR FROM {name}) = {literal.this}.",
+                )
+            return _date_literal_problem(literal.this, name)
+        if column_category == "numeric" and literal.is_string and not _NUMBER.match(literal.this):
+            return _problem(
+                "type_mismatch", f"{name} is a numeric column compared with the text '{literal.this}'.", "Compare it with a number."
+            )
+        if column_category == "text" and not literal.is_string:
+            return _problem(
+                "type_mismatch",
+                f"{name} is a text column compared with the number {literal.this}.",
+                f"Quote the value: '{literal.this}'.",
+            )
+        return None
+
+
+def _date_literal_problem(value: str, context: str) -> Optional[Dict[str, str]]:
+    value = value.strip()
+    if value.lower() in SPECIAL_DATE_LITERALS:
+        return None
+    match = _ISO_DATETIME.match(value)
+    if match is not None:
+        try:
+            date.fromisoformat(match.group("date"))
+            return None
+        except ValueError:
+            return _problem("invalid_date", f"'{value}' in {context} is not a valid date.", "Use an existing date, e.g. the last day of the month.")
+    day_first = _DAY_FIRST_DATE.match(value)
+    if day_first is not None:
+        try:
+            iso = date(int(day_first.group("year")), int(day_first.group("month")), int(day_first.group("day"))).isoformat()
+            fix = f"Write dates as 'YYYY-MM-DD' in SQL: '{iso}'."
+        except ValueError:
+            fix = "Write dates as 'YYYY-MM-DD' in SQL."
+    else:
+        fix = "Write dates as 'YYYY-MM-DD' in SQL, e.g. '2024-01-31'."
+    return _problem("invalid_date", f"'{value}' in {context} is not an ISO date, PostgreSQL may misread it.", fix)
+
+
+def _problem(reason: str, problem: str, fix: str) -> Dict[str, str]:
+    return {"reason": reason, "problem": problem, "fix": fix}
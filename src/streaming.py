@@ -0,0 +1,137 @@
+"""
+Streams the agent's progress, first result rows and answer tokens as they happen.
+
+Usage:
+    python streaming.py "Give me the top 5 accounts with the most reviews"
+
+`stream_answer` wraps `graph.astream_events` and yields plain dict events:
+
+    {"type": "progress", "stage": "follow_up", "kind": "next" | "filter" | "sort"}
+    {"type": "progress", "stage": "cache_hit", "query": ...}
+    {"type": "progress", "stage": "fast_path", "template": ..., "query": ...}
+    {"type": "progress", "stage": "tool_call", "tool": "sql_db_schema", "args": {...}}
+    {"type": "progress", "stage": "schema_fetched", "tables": [...]}
+    {"type": "progress", "stage": "sql_generated", "query": ...}
+    {"type": "progress", "stage": "rows_counted", "row_count": ...}
+    {"type": "preview", "query": ..., "columns": [...], "rows": [...], "row_count": ..., "rows_shown": ...}
+    {"type": "token", "text": ...}
+    {"type": "final", "answer": ..., "sql": ..., "row_count": ..., "exports": [...]}
+
+The preview is sent as soon as the query tool has read the first rows, before
+the model writes its answer about them. Tokens are the text chunks of the
+model's final answer; answers written from a fast path template or from the
+previous result come whole in the final event.
+"""
+# python native packages
+import argparse
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+# custom packages
+from models import State
+from tools import PREVIEW_EVENT
+
+# The graph's own run, its end event carries the final state
+GRAPH_RUN_NAME = "LangGraph"
+
+
+def _final_event(state: State) -> Dict[str, Any]:
+    return {
+        "type": "final",
+        "answer": state["messages"][-1].content,
+        "sql": state.get("generated_query"),
+        "row_count": state.get("row_count"),
+        "exports": state.get("exports", []),
+    }
+
+
+def _chunk_text(chunk) -> str:
+    # Gemini chunks may carry a list of content parts instead of a string
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(
+        part if isinstance(part, str) else part.get("text", "")
+        for part in chunk.content
+        if isinstance(part, str) or part.get("type") == "text"
+    )
+
+
+def _tool_call_events(message) -> list:
+    events = []
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        if tool_call["name"] == "sql_db_query":
+            events.append({"type": "progress", "stage": "sql_generated", "query": tool_call["args"].get("query")})
+        else:
+            events.append({"type": "progress", "stage": "tool_call", "tool": tool_call["name"], "args": tool_call["args"]})
+    return events
+
+
+async def stream_answer(graph, question: str, config: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Runs the question through the graph, yielding events as they happen."""
+    inputs = {"messages": [{"role": "user", "content": question}]}
+    async for event in graph.astream_events(inputs, config, version="v2"):
+        kind, name = event["event"], event["name"]
+        node = event.get("metadata", {}).get("langgraph_node")
+
+        if kind == "on_chat_model_stream" and node == "query_gen":
+            # Tool call turns stream no text, only the answer does
+            text = _chunk_text(event["data"]["chunk"])
+            if text:
+                yield {"type": "token", "text": text}
+
+        elif kind == "on_chain_end" and name in ("follow_up", "sql_cache", "fast_path", "query_gen") and name == node:
+            output = event["data"].get("output") or {}
+            if not isinstance(output, dict):
+                continue
+            if output.get("follow_up_kind"):
+                yield {"type": "progress", "stage": "follow_up", "kind": output["follow_up_kind"]}
+            elif output.get("cached_sql"):
+                yield {"type": "progress", "stage": "cache_hit", "query": output["cached_sql"]}
+            elif output.get("fast_path_match"):
+                query = output["messages"][-1].tool_calls[0]["args"]["query"]
+                yield {"type": "progress", "stage": "fast_path", "template": output["fast_path_match"]["template"], "query": query}
+            elif name == "query_gen":
+                for message in output.get("messages", [])[-1:]:
+                    for tool_event in _tool_call_events(message):
+                        yield tool_event
+
+        elif kind == "on_tool_end" and name == "sql_db_schema":
+            tables = event["data"].get("input", {}).get("table_names", "")
+            yield {"type": "progress", "stage": "schema_fetched", "tables": [t.strip() for t in tables.split(",") if t.strip()]}
+
+        elif kind == "on_custom_event" and name == PREVIEW_EVENT:
+            yield {"type": "progress", "stage": "rows_counted", "row_count": event["data"]["row_count"]}
+            yield {"type": "preview", **event["data"]}
+
+        elif kind == "on_chain_end" and name == GRAPH_RUN_NAME and not event.get("parent_ids"):
+            yield _final_event(event["data"]["output"])
+
+
+async def _print_stream(question: str) -> None:
+    from settings import load_settings
+    from text2SQL_demo_code import build_graph, export_status, session_checkpointer
+
+    settings = load_settings()
+    graph = build_graph(settings, checkpointer=session_checkpointer(settings))
+    config = {"configurable": {"thread_id": "streaming"}}
+    async for event in stream_answer(graph, question, config):
+        if event["type"] == "token":
+            print(event["text"], end="", flush=True)
+        elif event["type"] == "final":
+            print(f"\n\nGenerated Query:\n{event['sql']}")
+            for report in event["exports"]:
+                print(export_status(report))
+        else:
+            print(json.dumps(event, default=str))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask the Text2SQL agent a question and stream its answer.")
+    parser.add_argument("question")
+    args = parser.parse_args()
+    asyncio.run(_print_stream(args.question))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Selects the tables relevant to a question from the schema snapshot.
+
+Each table is indexed as one document: its name, comment, column names and
+comments, and sample values. The question is scored against the documents by
+TF-IDF cosine similarity over character n-grams, which also matches plural
+forms and the parts of snake_case names.
+The top-k tables are selected, together with the tables they reference or are
+referenced by through foreign keys, so joins stay possible.
+
+With a catalogue no larger than k, every table is selected and nothing is scored.
+"""
+# python native packages
+import re
+from typing import Any, Dict, List, Set
+
+# third party packages
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+DEFAULT_TOP_K = 5
+# Tables scoring below this share of the best table's score are not selected
+MIN_RELATIVE_SCORE = 0.2
+
+
+def _words(text: Any) -> str:
+    return re.sub(r"[_\W]+", " ", str(text)).strip().lower()
+
+
+def table_document(table: Dict[str, Any]) -> str:
+    parts = [table["name"], table.get("comment") or ""]
+    for column in table["columns"]:
+        parts += [column["name"], column.get("comment") or ""]
+    for row in table.get("sample_rows", []):
+        parts += [value for value in row if value and not value.replace(".", "").isdigit()]
+    return " ".join(_words(part) for part in parts if part)
+
+
+class TableRetriever:
+    def __init__(self, snapshot: Dict[str, Any], top_k: int = DEFAULT_TOP_K):
+        self.top_k = top_k
+        self.tables = [table["name"] for table in snapshot["tables"]]
+        self.neighbours: Dict[str, Set[str]] = {name: set() for name in self.tables}
+        for table in snapshot["tables"]:
+            for foreign_key in table.get("foreign_keys", []):
+                referred = foreign_key["referred_table"]
+                if referred in self.neighbours and referred != table["name"]:
+                    self.neighbours[table["name"]].add(referred)
+                    self.neighbours[referred].add(table["name"])
+
+        self.vectorizer = None
+        if len(self.tables) > top_k:
+            self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5), sublinear_tf=True)
+            self.matrix = self.vectorizer.fit_transform([table_document(table) for table in snapshot["tables"]])
+
+    def scores(self, question: str) -> Dict[str, float]:
+        if self.vectorizer is None:
+            return {name: 1.0 for name in self.tables}
+        similarities = (self.matrix @ normalize(self.vectorizer.transform([_words(question)])).T).toarray().ravel()
+        return dict(zip(self.tables, similarities.tolist()))
+
+    def select(self, question: str) -> List[str]:
+        """The top-k tables for the question and their foreign key neighbours, in catalogue order."""
+        if self.vectorizer is None:
+            return list(self.tables)
+        scores = self.scores(question)
+        ranked = sorted(self.tables, key=lambda name: -scores[name])
+        best = scores[ranked[0]]
+        selected = {name for name in ranked[: self.top_k] if best > 0 and scores[name] >= best * MIN_RELATIVE_SCORE}
+        if not selected:
+            # Nothing in the question points at a table, the most general guess is the best one
+            selected = set(ranked[: self.top_k])
+        for name in list(selected):
+            selected |= self.neighbours[name]
+        return [name for name in self.tables if name in selected]
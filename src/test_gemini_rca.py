@@ -6,6 +6,8 @@ from pathlib import Path
 import re
 import json
 
+from settings import load_settings
+from tracing import configure_tracing, tracer
 from VoC_RCA_Prompt_iterations import prompt_template_00, prompt_template_01, prompt_template_02, prompt_template_03, prompt_template_04, prompt_template_05
 
 file_path = os.path.abspath(__file__)
@@ -264,74 +266,78 @@ def build_prompt(
 
 # ------------------------ MAIN ------------------------
 
-model_name = 'gemini-2.5-pro'
-credentials_path = os.path.join(config_folder, 'vertex.json')
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+def main():
+    configure_tracing(load_settings())
+    model_name = 'gemini-2.5-pro'
+    credentials_path = os.path.join(config_folder, 'vertex.json')
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
 
-client = Client(
-    vertexai=True,
-    project="voice-of-customer-ai-194353",
-    location="us-central1"
-)
-
-use_case = USE_CASES.use_case_1_viseca
-data_path = os.path.join(data_folder, use_case)
-
-df        = pd.read_csv(os.path.join(data_path,'data.csv'), index_col=0)
-# df = df.iloc[:min(len(df), 3), :]
-df = preprocess_df(df)
-print_sentiment_counts(df)
-question_str  = read_text_file(os.path.join(data_path, 'user_question.txt'))
-filters_str   = read_text_file(os.path.join(data_path, 'filters.txt'))
-
-irrelevant_q1 = "What has the stock market been like the past week in Europe?"
-irrelevant_q2 = "Best laptops available under 1000$"
-irrelevant_q3 = "Can I have a summary of the reviews of the 'Rancher Prime' product"
-irrelevant_q4 = "Please analyze the customer Feedback from 'Viseca Payment Services SA"
-
-question_str = irrelevant_q4
-
-prompt_initial = build_prompt(
-    template=prompt_template_00,
-    data_df=df,
-    data_format="html",
-    question=question_str,
-    filters=filters_str
-)
-prompt_updated = build_prompt(
-    template=prompt_template_05,
-    data_df=df,
-    data_format = "markdown",
-    question=question_str,
-    filters=filters_str
-)
-
-# print(f"INITIAL PROMPT: \n\n{prompt_initial}")
-# print(f"IMPROVED PROMPT: \n\n{prompt_updated}")
-
-# response_init_prompt = client.models.generate_content(
-#             model=model_name,
-#             contents=prompt_initial
-# )
-#
-# print(f"RESPONSE WITH INITIAL PROMPT:")
-# print(response_init_prompt.text)
-
-response_updated_prompt = client.models.generate_content(
-            model=model_name,
-            contents=prompt_updated,
-)
+    client = Client(
+        vertexai=True,
+        project="voice-of-customer-ai-194353",
+        location="us-central1"
+    )
 
-response_json = parse_gemini_response_to_json(response_text=response_updated_prompt.text)
-dashboard_text = format_dashboard_text(data=response_json)
+    use_case = USE_CASES.use_case_1_viseca
+    data_path = os.path.join(data_folder, use_case)
+
+    df        = pd.read_csv(os.path.join(data_path,'data.csv'), index_col=0)
+    # df = df.iloc[:min(len(df), 3), :]
+    df = preprocess_df(df)
+    print_sentiment_counts(df)
+    question_str  = read_text_file(os.path.join(data_path, 'user_question.txt'))
+    filters_str   = read_text_file(os.path.join(data_path, 'filters.txt'))
+
+    irrelevant_q1 = "What has the stock market been like the past week in Europe?"
+    irrelevant_q2 = "Best laptops available under 1000$"
+    irrelevant_q3 = "Can I have a summary of the reviews of the 'Rancher Prime' product"
+    irrelevant_q4 = "Please analyze the customer Feedback from 'Viseca Payment Services SA"
+
+    question_str = irrelevant_q4
+
+    prompt_initial = build_prompt(
+        template=prompt_template_00,
+        data_df=df,
+        data_format="html",
+        question=question_str,
+        filters=filters_str
+    )
+    prompt_updated = build_prompt(
+        template=prompt_template_05,
+        data_df=df,
+        data_format = "markdown",
+        question=question_str,
+        filters=filters_str
+    )
 
+    # print(f"INITIAL PROMPT: \n\n{prompt_initial}")
+    # print(f"IMPROVED PROMPT: \n\n{prompt_updated}")
 
-print(f"\n\nRESPONSE WITH UPDATED PROMPT:")
-print(dashboard_text)
-print()
+    # response_init_prompt = client.models.generate_content(
+    #             model=model_name,
+    #             contents=prompt_initial
+    # )
+    #
+    # print(f"RESPONSE WITH INITIAL PROMPT:")
+    # print(response_init_prompt.text)
 
+    with tracer.span("genai", model=model_name) as span:
+        response_updated_prompt = client.models.generate_content(
+                    model=model_name,
+                    contents=prompt_updated,
+        )
+        usage = response_updated_prompt.usage_metadata
+        if usage is not None:
+            span.set(input_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
 
+    response_json = parse_gemini_response_to_json(response_text=response_updated_prompt.text)
+    dashboard_text = format_dashboard_text(data=response_json)
 
 
+    print(f"\n\nRESPONSE WITH UPDATED PROMPT:")
+    print(dashboard_text)
+    print()
 
 
+if __name__ == "__main__":
+    main()
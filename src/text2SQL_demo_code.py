@@ -1,118 +1,655 @@
 # python native packages
 import os
-from dotenv import load_dotenv
+import threading
+import uuid
+from functools import partial, wraps
+from typing import Optional
 
 # third party packages
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_google_vertexai import ChatVertexAI
-from langgraph.prebuilt import ToolNode, tools_condition
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langgraph.prebuilt import tools_condition
 from langgraph.graph import END, StateGraph
+from langchain_core.messages.ai import AIMessage
 from langchain_core.messages.tool import ToolMessage
+from langchain_core.runnables import RunnableConfig
 
 # custom packages
-from prompts import QUERY_GEN_SYSTEM
-from models import CustomSQLDatabase, State
-from utils import export_dicts_to_csv, read_include_tables, extract_sql_query, get_vertex_path
-from trend_analysis import trend_analysis_plot
-load_dotenv()
-
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
-db_name = os.getenv("DB_NAME")
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-
-include_tables_yaml_filepath = os.getenv("INCLUDE_TABLES_YAML_FILEPATH", 'agent/src/config.yaml')
-include_tables, schema = read_include_tables(include_tables_yaml_filepath)
-
-# Connection to Postgresql db
-db_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-db = CustomSQLDatabase.from_uri(
-    db_url, 
-    view_support=True, 
-    include_tables=include_tables if include_tables else None,
-    schema=schema
+from prompts import QUERY_GEN_SYSTEM, SCHEMA_SNAPSHOT
+from models import State
+from fast_path import FAST_PATH_TOOL_CALL_PREFIX, format_answer
+from result_store import initial_view
+from compaction import compact_messages
+from settings import AgentSettings, load_settings
+from utils import (
+    read_include_tables, extract_sql_query, extract_question, get_vertex_path, is_standalone_question,
+)
+from tracing import configure_tracing, traced, tracer
+
+
+def lazy(factory):
+    """Like cached_property, but builds the value only once when first used from several threads."""
+    name = factory.__name__
+
+    @property
+    @wraps(factory)
+    def getter(self):
+        if name not in self.__dict__:
+            with self._lock:
+                if name not in self.__dict__:
+                    self.__dict__[name] = factory(self)
+        return self.__dict__[name]
+
+    return getter
+
+
+class AgentResources:
+    """
+    Database, LLM clients and helpers used by the graph nodes.
+    Each one is created on first use, so building the graph connects to nothing.
+    """
+
+    def __init__(self, settings: AgentSettings):
+        self.settings = settings
+        self._lock = threading.RLock()
+
+    @lazy
+    def db(self):
+        from models import CustomSQLDatabase, pool_engine_args
+
+        include_tables, schema = read_include_tables(self.settings.include_tables_yaml_filepath)
+
+        # Connection to Postgresql db
+        db = CustomSQLDatabase.from_uri(
+            self.settings.db_url,
+            engine_args=pool_engine_args(**self.settings.pool_settings),
+            view_support=True,
+            include_tables=include_tables if include_tables else None,
+            schema=schema,
+            async_database_uri=self.settings.async_db_url,
+            async_engine_args=pool_engine_args(**self.settings.pool_settings, is_async=True),
+        )
+        if self.settings.result_cache_enabled:
+            from result_cache import ResultCache, read_watermarks
+            from rollups import read_rollups
+
+            config = self.settings.include_tables_yaml_filepath
+            db.result_cache = ResultCache(
+                db,
+                watermarks=read_watermarks(config),
+                # A rollup's data changes with its base table
+                aliases={rollup.name: rollup.table for rollup in read_rollups(config)},
+                memory_bytes=self.settings.result_cache_memory_bytes,
+                cache_dir=self.settings.result_cache_dir,
+                disk_threshold_bytes=self.settings.result_cache_disk_threshold_bytes,
+                disk_bytes=self.settings.result_cache_disk_bytes,
+                watermark_seconds=self.settings.result_cache_watermark_seconds,
+            )
+        return db
+
+    @lazy
+    def schema_fingerprint(self) -> str:
+        return self.db.schema_fingerprint()
+
+    @lazy
+    def sql_cache(self):
+        from sql_cache import SQLCache
+
+        # Question -> SQL cache, entries written against another schema are dropped
+        sql_cache = SQLCache(
+            self.settings.sql_cache_path,
+            max_entries=self.settings.sql_cache_max_entries,
+            ttl_seconds=self.settings.sql_cache_ttl_seconds,
+        )
+        sql_cache.invalidate(self.schema_fingerprint)
+        return sql_cache
+
+    @lazy
+    def few_shot_index(self):
+        from few_shot import FewShotIndex
+
+        # Past (question, SQL) pairs, pairs written against another schema are dropped
+        few_shot_index = FewShotIndex(
+            self.settings.few_shot_path,
+            max_examples=self.settings.few_shot_max_examples,
+            top_k=self.settings.few_shot_k,
+            min_similarity=self.settings.few_shot_min_similarity,
+        )
+        few_shot_index.invalidate(self.schema_fingerprint)
+        return few_shot_index
+
+    def few_shot_examples(self, question: str) -> str:
+        """The prompt's examples block for the question, empty when there are none."""
+        from few_shot import format_examples
+
+        if not self.settings.few_shot_k or not question:
+            return ""
+        return format_examples(self.few_shot_index.search(question, self.schema_fingerprint))
+
+    @lazy
+    def schema_snapshot(self) -> dict:
+        from schema_snapshot import load_schema_snapshot
+
+        # Schema snapshot for the system prompt, re-introspected only when the fingerprint changes
+        return load_schema_snapshot(self.db, self.settings.schema_snapshot_path)
+
+    @lazy
+    def table_retriever(self):
+        from table_retrieval import TableRetriever
+
+        # With TABLE_TOP_K=0 every table is selected
+        return TableRetriever(self.schema_snapshot, top_k=self.settings.table_top_k or len(self.schema_snapshot["tables"]))
+
+    def schema_prompt(self, tables: list) -> str:
+        from schema_snapshot import format_schema_snapshot
+
+        return format_schema_snapshot(self.schema_snapshot, tables)
+
+    @lazy
+    def rate_limiter(self):
+        from langchain_core.rate_limiters import InMemoryRateLimiter
+
+        # Token bucket shared by every Gemini request, sized to the Vertex AI quota
+        return InMemoryRateLimiter(
+            requests_per_second=self.settings.vertex_requests_per_minute / 60,
+            max_bucket_size=self.settings.vertex_max_burst,
+        )
+
+    def chat_model(self):
+        from langchain_google_vertexai import ChatVertexAI
+        from llm_tracing import TracingCallbackHandler
+
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = get_vertex_path()
+        return ChatVertexAI(
+            model=self.settings.gemini_model,
+            temperature=0,
+            project=self.settings.gcp_project,
+            location=self.settings.gcp_location,
+            rate_limiter=self.rate_limiter,
+            callbacks=[TracingCallbackHandler("gemini")],
+        )
+
+    @lazy
+    def result_registry(self):
+        from models import ResultRegistry
+
+        return ResultRegistry()
+
+    @lazy
+    def exporter(self):
+        from exporter import ResultExporter
+
+        return ResultExporter(export_dir=self.settings.export_dir, export_format=self.settings.export_format)
+
+    @lazy
+    def sql_validator(self):
+        from rollups import read_rollups
+        from sql_validator import SQLValidator
+
+        if not self.settings.sql_validation_enabled:
+            return None
+        # Queries are routed to the rollups before they are validated
+        rollups = read_rollups(self.settings.include_tables_yaml_filepath)
+        return SQLValidator(self.schema_snapshot, extra_tables=[rollup.name for rollup in rollups])
+
+    @lazy
+    def tools(self) -> list:
+        from langchain_community.agent_toolkits import SQLDatabaseToolkit
+        from query_log import QueryLog
+        from result_summary import ResultSummarizer
+        from rollups import RollupRouter, read_rollups
+        from sql_guard import QueryGuard
+        from tools import RelevantTablesListTool, ResolveEntitiesTool, StreamingQuerySQLDatabaseTool
+
+        # SQL Manipulation Tools
+        toolkit = SQLDatabaseToolkit(db=self.db, llm=self.chat_model())
+        rollups = read_rollups(self.settings.include_tables_yaml_filepath)
+        # The streaming query tool replaces the toolkit's sql_db_query, so each query runs once
+        sql_db_query_tool = StreamingQuerySQLDatabaseTool(
+            db=self.db,
+            registry=self.result_registry,
+            guard=QueryGuard(
+                self.db,
+                max_cost=self.settings.query_max_cost,
+                row_limit=self.settings.query_row_limit,
+                # The database gives up on the statement once its tool call has timed out
+                statement_timeout_ms=min(
+                    self.settings.query_statement_timeout_ms, int(self.settings.tool_call_timeout_seconds * 1000)
+                ),
+                validator=self.sql_validator,
+            ),
+            rollup_router=RollupRouter(self.db, rollups, freshness_seconds=self.settings.rollup_freshness_seconds)
+            if rollups else None,
+            query_log=QueryLog(self.settings.query_log_path) if self.settings.query_log_path else None,
+            summarizer=ResultSummarizer(
+                token_budget=self.settings.result_token_budget,
+                sample_rows=self.settings.result_sample_rows,
+            ),
+            batch_size=self.settings.stream_batch_size,
+        )
+        # sql_db_list_tables only lists the tables selected for the question
+        replacements = {tool.name: tool for tool in [sql_db_query_tool, RelevantTablesListTool(db=self.db)]}
+        return [
+            replacements.get(tool.name, tool)
+            for tool in toolkit.get_tools()
+        ] + [ResolveEntitiesTool(index=self.entity_index)]
+
+    @lazy
+    def entity_index(self):
+        from entity_index import EntityValueIndex
+
+        # Distinct account, product, business unit, source and geo names, shared by the fast path and resolve_entities
+        return EntityValueIndex(self.db, refresh_seconds=self.settings.entity_index_refresh_seconds)
+
+    @lazy
+    def fast_path(self):
+        from fast_path import FastPathMatcher
+
+        return FastPathMatcher(self.db, entity_index=self.entity_index)
+
+    @lazy
+    def result_store(self):
+        from result_store import ResultStore
+
+        return ResultStore(
+            self.settings.retained_result_dir,
+            ttl_seconds=self.settings.retained_result_ttl_seconds,
+            max_rows=self.settings.retained_result_max_rows,
+        )
+
+    @lazy
+    def follow_ups(self):
+        from follow_up import FollowUpAnswerer
+
+        return FollowUpAnswerer(self.result_store, page_size=self.settings.follow_up_page_size)
+
+    @lazy
+    def tool_node(self):
+        from tool_executor import ParallelToolExecutor
+
+        return ParallelToolExecutor(
+            self.tools,
+            registry=self.result_registry,
+            max_workers=self.settings.tool_max_workers,
+            timeout_seconds=self.settings.tool_call_timeout_seconds,
+        )
+
+    @lazy
+    def query_gen_model(self):
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+        # The schema holds only the question's relevant tables, filled in per question
+        query_gen_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", QUERY_GEN_SYSTEM + SCHEMA_SNAPSHOT + "{few_shot_examples}"),
+                MessagesPlaceholder(variable_name="messages"),
+            ]
+        )
+        return query_gen_prompt | self.chat_model().bind_tools(tools=self.tools)
+
+
+@traced("follow_up")
+def follow_up_node(state: State, resources: AgentResources):
+    if not resources.settings.follow_up_enabled or not state.get("retained_result"):
+        return {"follow_up_kind": None}
+    try:
+        answered = resources.follow_ups.answer(
+            state["retained_result"], state.get("result_view") or initial_view(), state["messages"][-1].content
+        )
+    except Exception as e:
+        print(f"Exception: {e}")
+        answered = None
+    if answered is None:
+        return {"follow_up_kind": None}
+    # Answered from the retained result, neither the database nor the LLM is involved
+    answer, view, kind = answered
+    return {"messages": [AIMessage(content=answer)], "result_view": view, "follow_up_kind": kind, "query_gen_turns": 0}
+
+
+def route_follow_up(state: State) -> str:
+    return END if state.get("follow_up_kind") else "sql_cache"
+
+
+@traced("sql_cache")
+def sql_cache_node(state: State, resources: AgentResources):
+    question = state["messages"][-1].content
+    # A new question starts, clear the previous question's per-query state
+    update = {
+        "generated_query": None,
+        "query_result": None,
+        "query_result_call": None,
+        "row_limit": None,
+        "row_count": None,
+        "rows_shown": None,
+        "cached_sql": None,
+        "fast_path_match": None,
+        "query_gen_turns": 0,
+        "relevant_tables": None,
+    }
+    cached_sql = resources.sql_cache.get(question, resources.schema_fingerprint)
+    if cached_sql:
+        # Skip the query generation loop and run the cached SQL directly
+        tool_call = {"name": "sql_db_query", "args": {"query": cached_sql}, "id": f"cached_sql_query_{uuid.uuid4().hex}"}
+        update.update({"messages": [AIMessage(content="", tool_calls=[tool_call])], "cached_sql": cached_sql})
+    return update
+
+
+@traced("fast_path")
+def fast_path_node(state: State, resources: AgentResources):
+    if not resources.settings.fast_path_enabled:
+        return {}
+    try:
+        match = resources.fast_path.match(state["messages"][-1].content)
+    except Exception as e:
+        print(f"Exception: {e}")
+        match = None
+    if match is None:
+        return {}
+    # Run the template's SQL directly, its answer is written without the LLM
+    tool_call = {"name": "sql_db_query", "args": {"query": match["query"]}, "id": f"{FAST_PATH_TOOL_CALL_PREFIX}{uuid.uuid4().hex}"}
+    return {
+        "messages": [AIMessage(content="", tool_calls=[tool_call])],
+        "fast_path_match": {"template": match["template"], "description": match["description"]},
+    }
+
+
+def trailing_tool_messages(messages: list) -> list:
+    """The tool results of the model's last turn, in call order."""
+    tool_messages = []
+    for message in reversed(messages):
+        if not isinstance(message, ToolMessage):
+            break
+        tool_messages.insert(0, message)
+    return tool_messages
+
+
+def take_query_result(state: State, resources: AgentResources):
+    """The last query's result handle, and whether the tool's summary left some of its rows out."""
+    query_results = resources.result_registry.pop(state.get("query_result"))
+    row_count, rows_shown = state.get("row_count"), state.get("rows_shown") or 0
+    return query_results, query_results is not None and (row_count is None or row_count > rows_shown)
+
+
+def retain_query_result(query_results, state: State, update: dict, resources: AgentResources) -> None:
+    """Keeps the complete result for follow-ups, in place of the session's previous one. Call before exporting."""
+    if query_results is None or not resources.settings.follow_up_enabled:
+        return
+    resources.result_store.discard(state.get("retained_result"))
+    update["retained_result"] = resources.result_store.retain(query_results)
+    update["result_view"] = initial_view(state.get("rows_shown") or 0)
+
+
+def export_query_result(query_results, state: State, question: str, resources: AgentResources) -> dict:
+    # Store the complete query results on a background thread
+    export_path = resources.exporter.submit(query_results, question=question, columns=query_results.columns)
+    return {"path": export_path, "rows": None, "error": None, "row_limit": state.get("row_limit")}
+
+
+def export_status(report: dict) -> str:
+    """One line on an export, which may still be running when the answer is returned."""
+    if report["error"]:
+        return f"Export to {report['path']} failed: {report['error']}"
+    if report["rows"] is None:
+        return f"Exporting to {report['path']} in the background"
+    return f"Exported {report['rows']} rows to {report['path']}" + (" (row limit reached)" if report.get("truncated") else "")
+
+
+def export_note(report: dict, state: State) -> str:
+    """Where the results are exported, and whether the guard's row limit cut them short."""
+    row_limit, row_count = report.get("row_limit"), state.get("row_count")
+    if not row_limit or (row_count is not None and row_count < row_limit):
+        return f'The complete results are exported to the "{report["path"]}" file.'
+    if row_count is not None:
+        return (
+            f'The first {row_limit} rows are exported to the "{report["path"]}" file. '
+            f"The query reached the {row_limit} row limit, so these are not the complete results."
+        )
+    return (
+        f'The results are exported to the "{report["path"]}" file, up to the {row_limit} row limit. '
+        f"If the file holds {row_limit} rows, the limit was reached and the results are not complete."
     )
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = get_vertex_path()
-GCP_PROJECT = "voice-of-customer-ai-194353"
-GCP_LOCATION = "us-central1"
-
-# SQL Manipulation Tools
-toolkit = SQLDatabaseToolkit(
-    db=db,
-    llm=ChatVertexAI(
-        model="gemini-2.5-pro",
-        temperature=0,
-        project=GCP_PROJECT,
-        location=GCP_LOCATION
-    ),
-)
-sql_db_toolkit_tools = toolkit.get_tools()
 
-query_gen_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", QUERY_GEN_SYSTEM),
-        MessagesPlaceholder(variable_name="messages"),
+def poll_exports(state: State, update: dict, exports: list, resources: AgentResources) -> list:
+    """Collects the row counts of the exports that have finished, without waiting for the others."""
+    exports = [
+        _polled_export(report, resources)
+        for report in state.get("exports", []) + exports
+        if report["rows"] is None and report["error"] is None
     ]
-)
-query_gen_model = query_gen_prompt | ChatVertexAI(
-        model="gemini-2.5-pro",
-        temperature=0,
-        project=GCP_PROJECT,
-        location=GCP_LOCATION,
-    ).bind_tools(tools=sql_db_toolkit_tools)
+    # Still running, the file is written after the answer is returned
+    if exports and exports[-1]["rows"] is not None and update.get("row_count", state.get("row_count")) is None:
+        update["row_count"] = exports[-1]["rows"]
+    return exports
 
-graph_builder = StateGraph(State)
 
-GENERATED_QUERY = ''
+def _polled_export(report: dict, resources: AgentResources) -> dict:
+    polled = resources.exporter.report(report["path"], timeout=0)
+    if polled["rows"] is None and polled["error"] is None:
+        # Not finished yet, polled again by the next node that answers
+        return report
+    row_limit = report.get("row_limit")
+    # Stopped at the guard's row limit, the query matched more rows
+    polled["truncated"] = bool(row_limit) and polled["rows"] is not None and polled["rows"] >= row_limit
+    return polled
 
-def query_gen_node(state: State):
+
+@traced("query_gen")
+def query_gen_node(state: State, resources: AgentResources):
     last_message = state["messages"][-1]
-    global GENERATED_QUERY
+    messages = state["messages"]
+    question = extract_question(state)
+    # The model takes over from a template whose query failed
+    update = {"fast_path_match": None, "query_gen_turns": (state.get("query_gen_turns") or 0) + 1}
+    exports = []
 
     # SQL query results limiter
-    if isinstance(last_message, ToolMessage):
-        if last_message.name == "sql_db_query":
-            # The sql_db_query tool was called right before
-            query = extract_sql_query(state)
-            if query:
-                GENERATED_QUERY = query
-                query_results_list = db.run_no_throw(query, include_columns=True)
-
-                # trend_analysis_plot(query_results_list)
-
-                items_threshold = 5  # Max number of items to consider
-                if len(query_results_list) > items_threshold:
-                    # Store query results in csv
-                    # export_dicts_to_csv(query_results_list, "query_results.csv")
-
-                    # Limit the content passed to the LLM
-                    updated_content = str(query_results_list[:items_threshold])
-                    updated_content += \
-                        "\nInform the user that only the first {items_threshold}\
-                        results are displayed and also note that the complete results\
-                        are exported automatically in the \"query_result.csv\" file.\n"
-                    state["messages"][-1].content = updated_content
-    message = query_gen_model.invoke(state["messages"])
-
-    return {"messages": [message]}
-
-
-graph_builder.add_node("query_gen", query_gen_node)
-query_gen_tools_node = ToolNode(tools=sql_db_toolkit_tools)
-graph_builder.add_node("query_gen_tools", query_gen_tools_node)
-
-graph_builder.add_conditional_edges(
-    "query_gen",
-    tools_condition,
-    {"tools": "query_gen_tools", END: END},
-)
+    # The tool calls of a turn may run concurrently, the sql_db_query result is not necessarily the last message
+    tool_messages = trailing_tool_messages(messages)
+    if any(message.name == "sql_db_query" for message in tool_messages):
+        # Reuse the result of the tool's execution instead of running the query again.
+        # Popped even when every query failed, so no cursor is left open in the registry
+        query_results, partial_result = take_query_result(state, resources)
+        # The call whose result was kept, a failed call after it does not replace it
+        result_message = next(
+            (message for message in tool_messages if message.tool_call_id == state.get("query_result_call")), None
+        )
+        if query_results is not None and result_message is None:
+            query_results.close()
+        elif query_results is not None:
+            update["generated_query"] = extract_sql_query(state, tool_call_id=result_message.tool_call_id)
+            rows_shown = state.get("rows_shown") or 0
+            retain_query_result(query_results, state, update, resources)
+
+            if partial_result:
+                exports.append(export_query_result(query_results, state, question, resources))
+
+                # The tool's summary only shows part of the rows
+                updated_content = result_message.content
+                updated_content += \
+                    f"\nInform the user that only the first {rows_shown}\
+                    results are displayed and also tell them: {export_note(exports[-1], state)}\n"
+                # Same id, so the reducer replaces the tool message instead of appending
+                limited_message = result_message.model_copy(update={"content": updated_content})
+                messages = [limited_message if message is result_message else message for message in messages]
+                update["messages"] = [limited_message]
+            else:
+                query_results.close()
+    max_turns = resources.settings.query_gen_max_turns
+    if max_turns and update["query_gen_turns"] > max_turns:
+        # Out of attempts, answer without another model call
+        message = AIMessage(
+            content=f"I could not write a working SQL query for this question within {max_turns} attempts. "
+            "Please rephrase it or narrow it down, e.g. to a product, an account or a date range."
+        )
+        update["messages"] = update.get("messages", []) + [message]
+        update["exports"] = poll_exports(state, update, exports, resources)
+        return update
+    # Drop stale tool output before resending the history
+    messages, token_usage = compact_messages(messages, resources.settings.history_token_budget)
+    # Only the tables relevant to the question go into the prompt, selected once per question
+    relevant_tables = state.get("relevant_tables")
+    if relevant_tables is None:
+        relevant_tables = update["relevant_tables"] = resources.table_retriever.select(question or "")
+    # Similar questions answered before, so the model gets filter values and columns right sooner
+    few_shot_examples = resources.few_shot_examples(question)
+    message = resources.query_gen_model.invoke(
+        {
+            "messages": messages,
+            "schema_snapshot": resources.schema_prompt(relevant_tables),
+            "few_shot_examples": few_shot_examples,
+        }
+    )
+    update["messages"] = update.get("messages", []) + [message]
+    update["token_usage"] = [token_usage]
+
+    if not message.tool_calls:
+        # Final answer, cache the SQL that produced it unless it came from the cache.
+        # Follow-ups like "and for EMEA?" depend on the earlier turns, they are not cached
+        exports = poll_exports(state, update, exports, resources)
+        query = update.get("generated_query", state.get("generated_query"))
+        if query and state.get("query_result") and not state.get("cached_sql") and is_standalone_question(state):
+            resources.sql_cache.put(question, resources.schema_fingerprint, query)
+            if resources.settings.few_shot_k:
+                resources.few_shot_index.add(
+                    question,
+                    resources.schema_fingerprint,
+                    query,
+                    row_count=update.get("row_count", state.get("row_count")),
+                    iterations=update["query_gen_turns"],
+                )
+
+    update["exports"] = exports
+    return update
+
+
+@traced("fast_path_answer")
+def fast_path_answer_node(state: State, resources: AgentResources):
+    question = extract_question(state)
+    query_results, partial_result = take_query_result(state, resources)
+    rows = query_results.preview(state.get("rows_shown") or 0) if query_results is not None else []
+    columns = (query_results.columns if query_results is not None else None) or (list(rows[0]) if rows else [])
+    answer = format_answer(state["fast_path_match"]["description"], columns, rows, state.get("row_count"))
+
+    update = {"generated_query": extract_sql_query(state, tool_call_id=state.get("query_result_call"))}
+    retain_query_result(query_results, state, update, resources)
+    exports = []
+    if partial_result:
+        exports.append(export_query_result(query_results, state, question, resources))
+        answer += " " + export_note(exports[-1], state)
+    elif query_results is not None:
+        query_results.close()
+
+    # Built last, so the answer carries the export note
+    update["messages"] = [AIMessage(content=answer)]
+    # The export has just started, it goes into state as pending and the answer does not wait for it
+    update["exports"] = poll_exports(state, update, [], resources) + exports
+    return update
+
+
+def route_query_results(state: State) -> str:
+    """Answers from the template when its query succeeded, the model handles everything else."""
+    if state.get("fast_path_match") and state.get("query_result"):
+        return "fast_path_answer"
+    return "query_gen"
+
+
+@traced("query_gen_tools")
+def query_gen_tools_node(state: State, config: RunnableConfig, resources: AgentResources):
+    # The tool executor needs the tools, which need the database, so it is built on first use.
+    # The turn's tool calls run concurrently, each with its own timeout.
+    configurable = {**config.get("configurable", {}), "relevant_tables": state.get("relevant_tables")}
+    return resources.tool_node.invoke(state, {**config, "configurable": configurable})
+
+
+def build_checkpointer(settings: AgentSettings):
+    """
+    Per-thread state persistence, sessions are selected with
+    config={"configurable": {"thread_id": ...}} on every invocation.
+    """
+    if settings.checkpointer == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+
+        return MemorySaver()
+    if settings.checkpointer == "sqlite":
+        import sqlite3
+        from langgraph.checkpoint.sqlite import SqliteSaver
+
+        # SqliteSaver serializes access to the connection itself
+        return SqliteSaver(sqlite3.connect(settings.checkpoint_path, check_same_thread=False))
+    if settings.checkpointer == "none":
+        return None
+    raise ValueError("checkpointer must be 'memory', 'sqlite' or 'none'")
+
+
+def session_checkpointer(settings: AgentSettings):
+    """The configured checkpointer, in memory if none is: for callers that always pass a thread_id."""
+    from langgraph.checkpoint.memory import MemorySaver
+
+    return build_checkpointer(settings) or MemorySaver()
+
+
+def build_graph(settings: Optional[AgentSettings] = None, checkpointer=None):
+    """
+    Builds and compiles the Text2SQL agent graph.
+    No database connection or LLM client is created until the graph first runs.
+    All sessions (thread ids) of the returned graph share its database pool and clients.
+    """
+    settings = settings or load_settings()
+    resources = AgentResources(settings)
+
+    graph_builder = StateGraph(State)
+    graph_builder.add_node("follow_up", partial(follow_up_node, resources=resources))
+    graph_builder.add_node("sql_cache", partial(sql_cache_node, resources=resources))
+    graph_builder.add_node("query_gen", partial(query_gen_node, resources=resources))
+    graph_builder.add_node("query_gen_tools", partial(query_gen_tools_node, resources=resources))
+    graph_builder.add_node("fast_path", partial(fast_path_node, resources=resources))
+    graph_builder.add_node("fast_path_answer", partial(fast_path_answer_node, resources=resources))
+
+    graph_builder.add_conditional_edges("follow_up", route_follow_up, {END: END, "sql_cache": "sql_cache"})
+
+    graph_builder.add_conditional_edges(
+        "sql_cache",
+        tools_condition,
+        {"tools": "query_gen_tools", END: "fast_path"},
+    )
+
+    graph_builder.add_conditional_edges(
+        "fast_path",
+        tools_condition,
+        {"tools": "query_gen_tools", END: "query_gen"},
+    )
+
+    graph_builder.add_conditional_edges(
+        "query_gen",
+        tools_condition,
+        {"tools": "query_gen_tools", END: END},
+    )
+
+    graph_builder.add_conditional_edges(
+        "query_gen_tools",
+        route_query_results,
+        {"fast_path_answer": "fast_path_answer", "query_gen": "query_gen"},
+    )
+    graph_builder.add_edge("fast_path_answer", END)
+    graph_builder.set_entry_point("follow_up")
+    graph = graph_builder.compile(checkpointer=checkpointer or build_checkpointer(settings))
+    graph.resources = resources
+    return graph
+
+
+_default_graph = None
+_default_graph_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # `graph` is built on first access instead of at import time
+    global _default_graph
+    if name == "graph":
+        with _default_graph_lock:
+            if _default_graph is None:
+                _default_graph = build_graph()
+        return _default_graph
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-graph_builder.add_edge("query_gen_tools", "query_gen")
-graph_builder.set_entry_point("query_gen")
-graph = graph_builder.compile()
 
 QUESTIONS = [
     # 'Give me the top 5 accounts with the most reviews',
@@ -132,18 +669,32 @@ QUESTIONS = [
 
     """Please provide all the reviews from January 2024 regarding Rancher and SUSE Multi-Linux Manager Products, from customers from the EMEA region"""
 ]
-for q_no,QUESTION in enumerate(QUESTIONS,1):
+if __name__ == "__main__":
+    settings = load_settings()
+    configure_tracing(settings)
+    # Each question is its own session, follow-ups within it see its history
+    graph = build_graph(settings, checkpointer=session_checkpointer(settings))
+    for q_no,QUESTION in enumerate(QUESTIONS,1):
 
-    inputs = {"messages": [{"role": "user", "content": QUESTION}]}
-    answer = graph.invoke(inputs)
+        inputs = {"messages": [{"role": "user", "content": QUESTION}]}
+        config = {"configurable": {"thread_id": f"question_{q_no}"}}
+        # One trace per question, the node, LLM and database spans nest under it
+        with tracer.span("question", thread_id=f"question_{q_no}"):
+            answer = graph.invoke(inputs, config)
 
-    print(f" ~~~ QUESTION {q_no} ~~~ ")
-    print(f"Q: {QUESTION}\n")
-    print(f"A: {answer['messages'][-1].content}")
-    print(f"\nGenerated Query:")
-    print(GENERATED_QUERY)
-    print("\n\n")
+        print(f" ~~~ QUESTION {q_no} ~~~ ")
+        print(f"Q: {QUESTION}\n")
+        print(f"A: {answer['messages'][-1].content}")
+        if answer.get("follow_up_kind"):
+            print(f"(answered from the previous result: {answer['follow_up_kind']})")
+        elif answer.get("fast_path_match"):
+            print(f"(answered from the {answer['fast_path_match']['template']} template)")
+        print(f"query_gen turns: {answer.get('query_gen_turns')}")
+        print(f"\nGenerated Query:")
+        print(answer.get("generated_query"))
+        for report in answer.get("exports", []):
+            print(export_status(report))
+        print("\n\n")
 
 # Exported for external use
-__all__ = ["graph"]
-
+__all__ = ["graph", "build_graph"]
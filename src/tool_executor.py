@@ -0,0 +1,162 @@
+"""
+Concurrent execution of the tool calls of one model turn.
+
+    executor = ParallelToolExecutor(tools, max_workers=4, timeout_seconds=60)
+    update = executor.invoke(state, config)
+
+The calls of a turn (e.g. sql_db_schema for several tables, or a few
+sql_db_query probes) are submitted together to a bounded thread pool, which
+the database connection pool is sized for, so the turn takes about as long as
+its slowest call. Each call gets its own timeout, counted from when it starts
+running: a call still running by then is answered with an error message, and
+whatever it returns later is discarded and its result handle closed. The
+database stops the statement itself through the query tool's statement timeout.
+
+The tool messages are returned in the order of the model's tool calls, and
+the Command updates of the calls are merged into one state update, which
+keeps the result of the last successful sql_db_query call.
+"""
+# python native packages
+import contextvars
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Sequence
+
+# third party packages
+from langchain_core.messages import AIMessage
+from langchain_core.messages.tool import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import get_config_list
+from langchain_core.tools import BaseTool
+from langgraph.errors import GraphBubbleUp
+from langgraph.types import Command
+
+# custom packages
+from models import ResultRegistry
+from tracing import tracer
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_TIMEOUT_SECONDS = 60.0
+# Tools that only read, and so may run next to each other
+READ_ONLY_TOOLS = {"sql_db_query", "sql_db_schema", "sql_db_list_tables", "sql_db_query_checker", "resolve_entities"}
+# State keys describing the query result of a sql_db_query call
+RESULT_KEYS = ("query_result", "query_result_call", "row_limit", "row_count", "rows_shown")
+
+
+class ParallelToolExecutor:
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        registry: Optional[ResultRegistry] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS,
+        read_only_tools: Optional[set] = None,
+    ):
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.registry = registry
+        self.timeout_seconds = timeout_seconds
+        self.read_only_tools = READ_ONLY_TOOLS if read_only_tools is None else read_only_tools
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool_call")
+
+    def _run_one(self, call: Dict[str, Any], config: RunnableConfig) -> Any:
+        tool = self.tools_by_name.get(call["name"])
+        if tool is None:
+            return ToolMessage(
+                f"Error: {call['name']} is not a valid tool, try one of [{', '.join(self.tools_by_name)}].",
+                name=call["name"],
+                tool_call_id=call["id"],
+                status="error",
+            )
+        with tracer.span("tool", tool=call["name"]):
+            try:
+                return tool.invoke({**call, "type": "tool_call"}, config)
+            except GraphBubbleUp:
+                raise
+            except Exception as e:
+                # Same message as the prebuilt ToolNode, the model fixes its call and retries
+                return ToolMessage(
+                    f"Error: {repr(e)}\n Please fix your mistakes.",
+                    name=call["name"],
+                    tool_call_id=call["id"],
+                    status="error",
+                )
+
+    def _discard(self, future: Future) -> None:
+        """Closes the result of a call that finished after its timeout."""
+        try:
+            output = future.result()
+        except Exception:
+            return
+        if isinstance(output, Command) and self.registry is not None:
+            result = self.registry.pop((output.update or {}).get("query_result"))
+            if result is not None:
+                result.close()
+
+    def _run_timed(self, i: int, started: Dict[int, float], call: Dict[str, Any], config: RunnableConfig) -> Any:
+        started[i] = time.monotonic()
+        return self._run_one(call, config)
+
+    def _wait(self, future: Future, i: int, started: Dict[int, float], call: Dict[str, Any]) -> Any:
+        """The call's output, or an error message once it has run for longer than the timeout."""
+        while True:
+            # A call waiting for a free worker has not used any of its time yet
+            elapsed = time.monotonic() - started[i] if i in started else 0.0
+            try:
+                return future.result(timeout=max(0.0, self.timeout_seconds - elapsed))
+            except FutureTimeoutError:
+                if i in started and time.monotonic() - started[i] >= self.timeout_seconds:
+                    break
+        if not future.cancel():
+            future.add_done_callback(self._discard)
+        return ToolMessage(
+            f"Error: the {call['name']} call did not finish within {self.timeout_seconds:g} seconds "
+            "and was cancelled. Simplify it or split it into smaller calls.",
+            name=call["name"],
+            tool_call_id=call["id"],
+            status="error",
+        )
+
+    def invoke(self, state: Dict[str, Any], config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        message = state["messages"][-1]
+        calls: List[Dict[str, Any]] = message.tool_calls if isinstance(message, AIMessage) else []
+        configs = get_config_list(config, len(calls))
+
+        # Read-only calls run concurrently, any other call runs alone in the calling thread
+        started: Dict[int, float] = {}
+        futures: Dict[int, Future] = {}
+        for i, call in enumerate(calls):
+            if call["name"] in self.read_only_tools:
+                # The tool's spans nest under the node's span
+                futures[i] = self._pool.submit(contextvars.copy_context().run, self._run_timed, i, started, call, configs[i])
+
+        outputs: List[Any] = [None] * len(calls)
+        for i, call in enumerate(calls):
+            if i not in futures:
+                outputs[i] = self._run_one(call, configs[i])
+        for i, future in futures.items():
+            outputs[i] = self._wait(future, i, started, calls[i])
+        return self._merge(outputs)
+
+    def _merge(self, outputs: List[Any]) -> Dict[str, Any]:
+        """One state update from the calls' messages and Commands, in the order of the tool calls."""
+        update: Dict[str, Any] = {"messages": []}
+        for output in outputs:
+            if not isinstance(output, Command):
+                update["messages"].append(output)
+                continue
+            command_update = dict(output.update or {})
+            update["messages"] += command_update.pop("messages", [])
+            if command_update.get("query_result") is None and update.get("query_result"):
+                # A failed query does not replace the result of an earlier one
+                for key in RESULT_KEYS:
+                    command_update.pop(key, None)
+            elif command_update.get("query_result") and self.registry is not None:
+                # A later query's result replaces this one, close the superseded cursor
+                superseded = self.registry.pop(update.get("query_result"))
+                if superseded is not None:
+                    superseded.close()
+            update.update(command_update)
+        return update
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
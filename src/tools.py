@@ -0,0 +1,210 @@
+# python native packages
+import time
+from typing import List, Optional, Type
+
+# third party packages
+from langchain_community.tools.sql_database.tool import ListSQLDatabaseTool, QuerySQLDatabaseTool
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks.manager import dispatch_custom_event
+from langchain_core.messages.tool import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool, InjectedToolCallId
+from langgraph.types import Command
+from pydantic import BaseModel, Field
+from sqlalchemy.exc import SQLAlchemyError
+from typing_extensions import Annotated
+
+# custom packages
+from entity_index import ENTITY_COLUMNS, EntityValueIndex
+from models import DEFAULT_STREAM_BATCH_SIZE, ResultRegistry
+from query_log import QueryLog
+from result_summary import ResultSummarizer
+from rollups import RollupRouter
+from sql_guard import QueryGuard, QueryRejected
+
+# Custom event carrying the first rows of a query result
+PREVIEW_EVENT = "query_preview"
+
+
+class _StreamingQueryInput(BaseModel):
+    query: str = Field(..., description="A detailed and correct SQL query.")
+    tool_call_id: Annotated[str, InjectedToolCallId]
+
+
+class StreamingQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """Drop-in `sql_db_query` that executes the query exactly once.
+
+    The LLM only sees the token-budgeted summary built by `summarizer`. The open
+    result is kept in `registry` and its handle is written to the `query_result`
+    state key, so later nodes can read the full result without running the query again.
+
+    With a `guard`, the query is checked (read-only, planner cost) and row
+    limited before it runs, in a read-only transaction with its own timeout.
+    The row limit the guard applied is written to the `row_limit` state key.
+    With a `rollup_router`, COUNT(*) queries that a rollup covers read the rollup
+    instead of the base table. With a `query_log`, every executed statement is
+    logged with its runtime, for the index advisor, unless the result came from
+    the database's result cache. The first `preview_rows` rows
+    are sent as a PREVIEW_EVENT custom event, for streaming clients.
+    """
+
+    args_schema: Type[BaseModel] = _StreamingQueryInput
+    registry: ResultRegistry = Field(exclude=True)
+    guard: Optional[QueryGuard] = Field(default=None, exclude=True)
+    rollup_router: Optional[RollupRouter] = Field(default=None, exclude=True)
+    query_log: Optional[QueryLog] = Field(default=None, exclude=True)
+    summarizer: ResultSummarizer = Field(default_factory=ResultSummarizer, exclude=True)
+    batch_size: int = DEFAULT_STREAM_BATCH_SIZE
+    preview_rows: int = 20
+
+    def _run(
+        self,
+        query: str,
+        tool_call_id: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> Command:
+        """Execute the query, return the preview or an error message and the result handle."""
+        started, execute_ms, result = None, None, None
+        try:
+            statement_timeout_ms, row_limit = None, None
+            if self.rollup_router is not None:
+                query = self.rollup_router.route(query) or query
+            if self.guard is not None:
+                prepared = self.guard.prepare(query)
+                query, row_limit = prepared["query"], prepared["row_limit"]
+                statement_timeout_ms = self.guard.statement_timeout_ms
+            started = time.perf_counter()
+            result = self.db.run(
+                query,
+                fetch="stream",
+                batch_size=self.batch_size,
+                read_only=True,
+                statement_timeout_ms=statement_timeout_ms,
+            )
+            execute_ms = (time.perf_counter() - started) * 1000
+            summary = self.summarizer.summarize(result)
+        except QueryRejected as e:
+            return self._error(e.message, tool_call_id)
+        except SQLAlchemyError as e:
+            if result is None and started is not None:
+                execute_ms = (time.perf_counter() - started) * 1000
+            self._log(query, self._database_ms(execute_ms, result), error=str(e).splitlines()[0])
+            """Format the error message"""
+            return self._error(f"Error: {e}", tool_call_id)
+        if not result.from_cache:
+            # A cached result says nothing about the query's runtime, the index advisor does not see it
+            self._log(query, self._database_ms(execute_ms, result), row_count=summary["row_count"])
+        if run_manager is not None:
+            # Streaming clients get the first rows before the model answers
+            dispatch_custom_event(
+                PREVIEW_EVENT,
+                {
+                    "query": query,
+                    "columns": result.columns,
+                    "rows": result.preview(self.preview_rows),
+                    "row_count": summary["row_count"],
+                    "rows_shown": summary["rows_shown"],
+                },
+            )
+
+        return Command(update={
+            "messages": [ToolMessage(summary["content"], name=self.name, tool_call_id=tool_call_id)],
+            "query_result": self.registry.register(result),
+            "query_result_call": tool_call_id,
+            "row_limit": row_limit,
+            "row_count": summary["row_count"],
+            "rows_shown": summary["rows_shown"],
+        })
+
+    @staticmethod
+    def _database_ms(execute_ms: Optional[float], result) -> Optional[float]:
+        """Time spent executing and fetching, without the summary's tokenizing and statistics."""
+        if execute_ms is None:
+            return None
+        return execute_ms + (result.fetch_ms if result is not None else 0.0)
+
+    def _log(
+        self,
+        query: str,
+        elapsed_ms: Optional[float],
+        row_count: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        # elapsed_ms is None when the query failed before it was executed
+        if self.query_log is not None and elapsed_ms is not None:
+            self.query_log.record(query, elapsed_ms, row_count=row_count, error=error)
+
+    def _error(self, content: str, tool_call_id: str) -> Command:
+        return Command(update={
+            "messages": [ToolMessage(content, name=self.name, tool_call_id=tool_call_id)],
+            "query_result": None,
+            "query_result_call": None,
+            "row_limit": None,
+            "row_count": None,
+            "rows_shown": None,
+        })
+
+
+class _ResolveEntitiesInput(BaseModel):
+    mentions: List[str] = Field(
+        ...,
+        description="Names as written in the question, one per entry, e.g. [\"Viseca\", \"Support CSAT\", \"EMEA\"].",
+    )
+    columns: Optional[List[str]] = Field(
+        default=None,
+        description=f"Columns to search, any of {', '.join(ENTITY_COLUMNS)}. All of them when omitted.",
+    )
+
+
+class ResolveEntitiesTool(BaseTool):
+    """Resolves loose account, product, business unit, source and geo names to their exact values in one call."""
+
+    name: str = "resolve_entities"
+    description: str = (
+        "Input is a list of account, product, business unit, source or geo names as the user wrote them. "
+        "Output is, for each name, the closest exact values stored in the database with their column and number of reviews. "
+        "Use it before filtering on such names, instead of guessing values or exploring them with SELECT DISTINCT / ILIKE queries."
+    )
+    args_schema: Type[BaseModel] = _ResolveEntitiesInput
+    index: EntityValueIndex = Field(exclude=True)
+
+    def _run(
+        self,
+        mentions: List[str],
+        columns: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        try:
+            resolved = self.index.resolve(mentions, columns)
+        except SQLAlchemyError as e:
+            return f"Error: {e}"
+        lines = []
+        for mention, matches in resolved.items():
+            if not matches:
+                lines.append(f"{mention!r}: no matching value")
+                continue
+            candidates = "; ".join(
+                f"{match['column']} = {match['value']!r} ({match['reviews']} reviews, score {match['score']})"
+                for match in matches
+            )
+            lines.append(f"{mention!r}: {candidates}")
+        return "\n".join(lines)
+
+
+class RelevantTablesListTool(ListSQLDatabaseTool):
+    """`sql_db_list_tables` listing only the tables selected for the current question.
+
+    The selection is read from config["configurable"]["relevant_tables"], all
+    usable tables are listed without one.
+    """
+
+    def _run(
+        self,
+        tool_input: str = "",
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        *,
+        # Must be annotated exactly RunnableConfig for the tool to pass it in
+        config: RunnableConfig,
+    ) -> str:
+        tables = config.get("configurable", {}).get("relevant_tables")
+        return ", ".join(tables if tables else self.db.get_usable_table_names())
@@ -0,0 +1,242 @@
+"""
+Spans and metrics for the agent graph.
+
+    from tracing import traced, tracer
+
+    @traced("trend_analysis_plot")
+    def trend_analysis_plot(...): ...
+
+    with tracer.span("db.run", fetch=fetch) as span:
+        ...
+        span.set(rows=len(rows))
+
+Each finished span records its wall time, status and attributes (tokens, rows,
+retries). Spans are appended to a JSON lines file and aggregated into
+Prometheus metrics, served as text on /metrics. Nested spans share the trace id
+of the outermost one, e.g. a question.
+
+The tracer is disabled by default: `tracer.span` then returns a shared no-op
+span and `traced` functions are called directly, so the instrumentation costs
+one attribute check.
+"""
+# python native packages
+import functools
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Standard library only, so that importing the instrumented modules stays cheap.
+# The LangChain callback handler for chat models is in llm_tracing.py.
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Span attributes exported as Prometheus counters
+COUNTED_ATTRIBUTES = {
+    "input_tokens": "agent_llm_input_tokens_total",
+    "output_tokens": "agent_llm_output_tokens_total",
+    "rows": "agent_rows_total",
+    "retries": "agent_retries_total",
+}
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "started_at", "_started")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, key: str, value: float = 1) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+
+class _NoopSpan:
+    def set(self, **attributes) -> None:
+        pass
+
+    def add(self, key: str, value: float = 1) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _SpanContext:
+    __slots__ = ("_tracer", "_span", "_token")
+
+    def __init__(self, tracer: "Tracer", span: Span):
+        self._tracer = tracer
+        self._span = span
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        _current_span.reset(self._token)
+        self._tracer.finish_span(self._span, error=exc)
+        return False
+
+
+class SpanMetrics:
+    """Per span name duration histogram, error count and the counters of COUNTED_ATTRIBUTES."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._durations: Dict[str, list] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+
+    def observe(self, record: Dict[str, Any]) -> None:
+        name, seconds = record["name"], record["duration_ms"] / 1000
+        with self._lock:
+            # Bucket counts, then sum and count
+            histogram = self._durations.setdefault(name, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            if record["status"] == "error":
+                self._counters[("agent_span_errors_total", name)] = self._counters.get(("agent_span_errors_total", name), 0) + 1
+            for attribute, metric in COUNTED_ATTRIBUTES.items():
+                value = record["attributes"].get(attribute)
+                if isinstance(value, (int, float)):
+                    self._counters[(metric, name)] = self._counters.get((metric, name), 0) + value
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP agent_span_duration_seconds Wall time of the agent's spans.",
+            "# TYPE agent_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, histogram in sorted(self._durations.items()):
+                cumulative = 0
+                for bucket, count in zip(self.buckets, histogram):
+                    cumulative += count
+                    lines.append(f'agent_span_duration_seconds_bucket{{span="{name}",le="{bucket}"}} {cumulative}')
+                lines.append(f'agent_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'agent_span_duration_seconds_sum{{span="{name}"}} {histogram[-2]:.6f}')
+                lines.append(f'agent_span_duration_seconds_count{{span="{name}"}} {histogram[-1]}')
+            metrics = sorted({metric for metric, _ in self._counters})
+            for metric in metrics:
+                lines.append(f"# TYPE {metric} counter")
+                for (counter, name), value in sorted(self._counters.items()):
+                    if counter == metric:
+                        lines.append(f'{metric}{{span="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.jsonl_path: Optional[str] = None
+        self.metrics = SpanMetrics()
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool = True, jsonl_path: Optional[str] = None) -> None:
+        self.jsonl_path = jsonl_path
+        self.enabled = enabled
+
+    def span(self, name: str, **attributes):
+        """Context manager timing its block as a child of the current span."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return _SpanContext(self, Span(name, _current_span.get(), attributes))
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """A span that is not made current, for callbacks that start and end in different calls."""
+        return Span(name, _current_span.get(), attributes)
+
+    def finish_span(self, span: Span, error: Optional[BaseException] = None) -> None:
+        record = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "start": datetime.fromtimestamp(span.started_at, timezone.utc).isoformat(),
+            "duration_ms": round((time.perf_counter() - span._started) * 1000, 3),
+            "status": "error" if error is not None else "ok",
+            "error": f"{type(error).__name__}: {error}" if error is not None else None,
+            "attributes": span.attributes,
+        }
+        self.metrics.observe(record)
+        if self.jsonl_path:
+            line = json.dumps(record, default=str) + "\n"
+            with self._lock:
+                with open(self.jsonl_path, "a", encoding="utf-8") as file:
+                    file.write(line)
+
+
+tracer = Tracer()
+
+
+def traced(name: str) -> Callable:
+    """Decorator running the function inside a span of the given name."""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with tracer.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = tracer.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serves the Prometheus metrics on http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_metrics_server: Optional[ThreadingHTTPServer] = None
+
+
+def configure_tracing(settings) -> None:
+    """Enables the tracer from the TRACING_ENABLED / TRACE_PATH / METRICS_PORT settings."""
+    global _metrics_server
+    tracer.configure(enabled=settings.tracing_enabled, jsonl_path=settings.trace_path or None)
+    if settings.tracing_enabled and settings.metrics_port and _metrics_server is None:
+        _metrics_server = serve_metrics(settings.metrics_port)
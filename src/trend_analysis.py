@@ -1,21 +1,17 @@
 import os
 import json
 import traceback
-import numpy as np
 from datetime import datetime
+from functools import lru_cache
 
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from sklearn.preprocessing import PolynomialFeatures, StandardScaler
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import GridSearchCV
-from sklearn.pipeline import make_pipeline
 
 from prompts import TREND_PLOT_GEN
+from tracing import traced
+
+# numpy, matplotlib, scikit-learn and the OpenAI client are imported on first use,
+# importing this module only to reach trend_analysis_plot stays cheap
 
 
 # Load API key from .env
@@ -29,15 +25,22 @@ class Eval_Query_Result(BaseModel):
     first_column_title: str
     second_column_title: str
 
-eval_prompt = ChatPromptTemplate.from_template(TREND_PLOT_GEN)
-eval_model = eval_prompt | ChatOpenAI(model="gpt-4o", temperature=0).with_structured_output(Eval_Query_Result)
+@lru_cache(maxsize=1)
+def get_eval_model():
+    from langchain_openai import ChatOpenAI
+    from langchain_core.prompts import ChatPromptTemplate
+    from llm_tracing import TracingCallbackHandler
+
+    eval_prompt = ChatPromptTemplate.from_template(TREND_PLOT_GEN)
+    eval_model = ChatOpenAI(model="gpt-4o", temperature=0, callbacks=[TracingCallbackHandler("openai")])
+    return eval_prompt | eval_model.with_structured_output(Eval_Query_Result)
 
 def check_if_columns_related_to_time(data):
     """
     Calls the LLM to evaluate if the columns' values are time-related.
     """
     try:
-        response = eval_model.invoke({"data": data})
+        response = get_eval_model().invoke({"data": data})
         return response
     except Exception as e:
         print("Error generating evaluation response:", e)
@@ -51,6 +54,12 @@ def check_if_columns_related_to_time(data):
 
 
 def curve_finder(x, y):
+    import numpy as np
+    from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+    from sklearn.linear_model import LinearRegression
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.pipeline import make_pipeline
+
     x = np.array(x)
     y = np.array(y)
 
@@ -69,6 +78,10 @@ def curve_finder(x, y):
 
 
 def plot_points_and_spline(x_key, x_values, y_key, y_values):
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
     # Determine the type of x_values and convert if necessary.
     if isinstance(x_values[0], datetime):
         x_values_numeric = mdates.date2num(x_values)
@@ -107,6 +120,7 @@ def plot_points_and_spline(x_key, x_values, y_key, y_values):
     plt.close()
 
 
+@traced("trend_analysis_plot")
 def trend_analysis_plot(query_results_list):
     if query_results_list:  # NON zero rows check
         # Failsafe added
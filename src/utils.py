@@ -1,39 +1,9 @@
-import csv
 import yaml
+from functools import lru_cache
 from langchain_core.messages.ai import AIMessage
+from langchain_core.messages.human import HumanMessage
 import os
 
-def export_dicts_to_csv(data, file_path):
-    """
-    Exports a list of dictionaries to a CSV file.
-
-    Parameters:
-    data (list of dict): List of dictionaries to export.
-    file_path (str): Path to the output CSV file.
-
-    The function writes the keys as the header row,
-    followed by the values for each dictionary.
-    """
-    if not data:
-        raise ValueError(
-            "The data list is empty. Provide at least one dictionary."
-        )
-
-    # Extract keys from the first dictionary
-    # (assumes all dictionaries have the same keys)
-    headers = data[0].keys()
-
-    # Write to CSV
-    with open(file_path, mode='a', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=headers)
-
-        # Write header
-        writer.writeheader()
-
-        # Write rows
-        writer.writerows(data)
-
-
 def read_include_tables(filename):
     # Load the tables to include
     with open(filename, 'r') as file:
@@ -42,12 +12,15 @@ def read_include_tables(filename):
         schema = result['schema']
     return include_tables, schema
 
-def extract_sql_query(data):
+def extract_sql_query(data, tool_call_id=None):
+    # The SQL of the last sql_db_query call, or of the call with the given id
     try:
         for message in reversed(data['messages']):
             if isinstance(message, AIMessage):
                 if hasattr(message, 'tool_calls'):
                     for tool_call in message.tool_calls:
+                        if tool_call_id is not None and tool_call.get('id') != tool_call_id:
+                            continue
                         if tool_call['name'] == 'sql_db_query' and 'args' in tool_call:
                             query = tool_call['args'].get('query', None)
                             if query:
@@ -58,9 +31,43 @@ def extract_sql_query(data):
         print(f"Exception: {e}") 
         return None  # No query generated or extraction failed
 
+def extract_question(data):
+    # The latest user question, earlier ones belong to previous turns of the session
+    for message in reversed(data['messages']):
+        if isinstance(message, HumanMessage):
+            return message.content
+    return None
+
+def is_standalone_question(data):
+    # Only the session's first question can be understood without the earlier turns
+    return sum(isinstance(message, HumanMessage) for message in data['messages']) <= 1
+
 def get_vertex_path():
     file_path = os.path.abspath(__file__)
     src_folder = os.path.dirname(file_path)
     credentials_path = os.path.join(src_folder, 'config', 'vertex.json')
     
     return credentials_path
+
+
+@lru_cache(maxsize=1)
+def _token_encoder():
+    import tiktoken
+
+    try:
+        return tiktoken.get_encoding("cl100k_base").encode
+    except Exception as e:
+        # The BPE file is downloaded on first use, offline hosts get an estimate instead
+        print(f"Exception: {e}")
+        return None
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text with tiktoken's cl100k_base encoding.
+    Gemini tokenizes differently, so this is an estimate used for budgeting.
+    Falls back to ~4 characters per token when the encoding is unavailable.
+    """
+    encode = _token_encoder()
+    if encode is None:
+        return (len(text) + 3) // 4
+    return len(encode(text, disallowed_special=()))